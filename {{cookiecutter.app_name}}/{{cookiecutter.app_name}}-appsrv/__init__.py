@@ -1,45 +1,17 @@
 # -*- coding: utf-8 -*-
-import datetime
-
 from pyramid.config import Configurator
-from pyramid.renderers import JSON
 from pyramid.session import UnencryptedCookieSessionFactoryConfig
-from sqlalchemy import func, cast
-from sqlalchemy.dialects.postgresql import INTERVAL
+from pyramid.settings import asbool
 
-from db import User, Session
-from utilities import date_serializer, time_serializer
-from views.base_views import app_base
+from db.pool import server_threads
+from renderers import FastJSON
+from security import authenticated_user
+from security.authorize import user_roles
+from views.base_views import app_base, warm_templates
 
 
-def user(request):
-    """
-    This property will be added to the request, and for now it simply verifies if they
-    are authenticated or not based on the token they provide.  If this fails, this property
-    is None
-    """
-    request_token = 'invalid_token'
-    if request.method == 'GET':
-        if request.GET.get('token') is None:
-            return None
-        else:
-            request_token = request.GET.get('token')
-    elif request.method in ['PUT', 'POST', 'DELETE']:
-        if 'token' not in request.json_body:
-            return None
-        else:
-            request_token = request.json_body.get('token')
-
-    dauser = request.dbsession.query(User)\
-        .filter(Session.token == request_token)\
-        .filter(Session.lastactive >= (func.current_timestamp() - cast('1 week', INTERVAL)))\
-        .join(Session, Session.user_id == User.id)\
-        .one_or_none()
-    if dauser:
-        session = request.dbsession.query(Session).filter(Session.token == request_token).one()
-        session.lastactive = datetime.datetime.now()
-        request.dbsession.flush()
-    return dauser
+# Registry entries with background threads, which includeme only sets up and main starts, in this order
+BACKGROUND = ['lastactive_buffer', 'token_revocations', 'scheduler']
 
 
 def add_routes(config):
@@ -48,14 +20,27 @@ def add_routes(config):
 
 
 def add_views(config):
-    config.add_view(app_base, route_name='app', renderer='templates/app_base.jinja2')
-    config.add_view(app_base, route_name='api', renderer='templates/app_base.jinja2')
+    config.add_view(app_base, route_name='app')
+    config.add_view(app_base, route_name='api')
+
+
+def start_background(registry):
+    for name in BACKGROUND:
+        each = registry.get(name)
+        if each is not None:
+            each.start()
 
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
     settings['tm.commit_veto'] = 'pyramid_tm.default_commit_veto'
+    if not asbool(global_config.get('prefork.maintenance', True)):
+        # serve_prefork prunes sessions in only one of its workers, the database only needs it done once
+        settings['maintenance.prune_sessions.enabled'] = 'false'
+    threads = server_threads(global_config)
+    if threads is not None:
+        settings.setdefault('server.threads', str(threads))
     session_factory = UnencryptedCookieSessionFactoryConfig('{{cookiecutter.project_slug}}session')
     config = Configurator(
         settings=settings,
@@ -65,25 +50,39 @@ def main(global_config, **settings):
     config.include('pyramid_exclog')
     config.include('cornice')
     config.include('db')
+    config.include('security')
+    config.include('maintenance')
+    config.include('networks')
+    config.include('static_assets')
     add_routes(config)
     add_views(config)
 
     # These modify the request to add db and user as methods, which once called are then reify values
     # subclassing/overriding the Request will be... problematic, as discovered the hard way
-    config.add_request_method(callable=user,
-                              name=None,
+    config.add_request_method(callable=authenticated_user,
+                              name='user',
+                              property=True,
+                              reify=True
+                              )
+    config.add_request_method(callable=user_roles,
+                              name='roles',
                               property=True,
                               reify=True
                               )
 
-    # This should add an adapter for types normally we don't wrap in JSON
-    json_renderer = JSON()
-    json_renderer.add_adapter(datetime.date, date_serializer)
-    json_renderer.add_adapter(datetime.time, time_serializer)
+    # Dates, times, Decimals, UUIDs and binary, which JSON doesn't have, are handled by the renderer itself
+    json_renderer = FastJSON(compact=asbool(settings.get('json.compact', False)))
     config.add_renderer('json', json_renderer)
 
     config.scan()
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+
+    # Compiled, and the app shell rendered, before the first request rather than during it
+    warm_templates(config)
+
+    # Only start background work once the app has configured successfully
+    start_background(config.registry)
+    return app
 
 # The following is all for intermediate testing purposes only, once we are ready to assign role based authentication
 # to our actual endpoints all of this testing code can be refactored to use those views, though these views are
@@ -101,11 +100,6 @@ def main(global_config, **settings):
 #     return {}
 
 
-# @authorized_roles(['NonexistentRole'])
-# def forbidden_view(request):
-#     return {}
-
-
 # @authorized_roles(['MS_admin'])
 # def admin_role_view(request):
 #     return {}
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks, run by hand from the appsrv directory, for example ``python -m benchmarks.login_benchmark``.  They are
+not part of the installed package or the test suite.
+"""
+
+import os
+import subprocess
+
+
+def git_commit():
+    """
+    The commit the benchmarks are running at, to record with their results, or None outside a git checkout
+    """
+    with open(os.devnull, 'w') as devnull:
+        try:
+            output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                                             stderr=devnull)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return output.strip().decode('ascii')
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+End to end latency of the API, through the whole WSGI app in this process.
+
+Builds the app with main() against a fresh local database (a temporary SQLite file, or --db-url), seeds it with
+users who each have a session, then has a number of client threads send a fixed number of requests each straight
+to the WSGI callable: a mix of signups, logins, token refreshes and profile reads and updates.  Reports throughput
+and p50/p95/p99 latency per route.  The traffic is drawn from a seeded random generator, so two runs with the same
+arguments send the same requests, and the JSON written by --output records the commit and settings it ran with, so
+runs from different commits can be laid side by side.
+
+SQLite lets one transaction write at a time, so with several threads some writes fail as "database is locked" and
+are counted as errors; point --db-url at an empty PostgreSQL database for numbers that mean something in production.
+
+    python -m benchmarks.http_benchmark --threads 8 --requests 500 --output before.json
+    python -m benchmarks.http_benchmark --db-url postgresql://user@127.0.0.1/loadtest auth.password.iterations=100000
+"""
+
+import argparse
+import imp
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import urllib
+
+from sqlalchemy import bindparam
+from webob import Request
+
+from benchmarks import git_commit
+from benchmarks.login_benchmark import percentile
+from db import Session, get_engine, metadata
+from scripts.initializedb import seed_users
+from security.passwords import hasher_from_settings
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'loadtest'
+
+sessions_table = Session.__table__
+
+# How often each kind of request comes up, out of the total
+MIX = [
+    ('signup', 5),
+    ('login', 10),
+    ('refresh', 15),
+    ('profile_get', 55),
+    ('profile_put', 15),
+]
+
+ROUTES = {
+    'signup': 'POST /api/users',
+    'login': 'POST /api/sessions',
+    'refresh': 'PUT /api/sessions',
+    'profile_get': 'GET /api/user/{id}',
+    'profile_put': 'PUT /api/user/{id}',
+}
+
+# Settings for a quiet, self contained run; anything given on the command line wins
+DEFAULT_SETTINGS = {
+    'email.check_deliverability': 'false',
+    'maintenance.enabled': 'false',
+    'sql_stats.headers': 'false',
+    'auth.password.iterations': '1000',
+    'some_key': 'this_is_a_key',
+}
+
+
+def load_main():
+    """
+    The app's main(), from the appsrv directory's __init__.py, which has no module name of its own to import by
+    """
+    return imp.load_package('appsrv', HERE).main
+
+
+def call(app, method, path, body=None, token=None):
+    """
+    Send one request to the app
+    :return: The response
+    """
+    if token is not None:
+        path += '?' + urllib.urlencode({'token': token})
+    request = Request.blank(path, method=method)
+    if body is not None:
+        request.content_type = 'application/json'
+        request.body = json.dumps(body).encode('utf-8')
+    return request.get_response(app)
+
+
+class Client(object):
+    """
+    One simulated user of the API, logged in as one of the seeded users and sending requests from the mix
+    """
+
+    def __init__(self, app, number, users, rng):
+        """
+        :param app: The WSGI app
+        :param number: Which client this is, to keep the names it signs up with unique
+        :param users: A list of (id, username, token) of the seeded users
+        :param rng: The client's own random.Random
+        """
+        self.app = app
+        self.number = number
+        self.signups = 0
+        self.rng = rng
+        self.user_id, self.username, self.token = rng.choice(users)
+        self.kinds = [kind for kind, weight in MIX for _ in range(weight)]
+
+    def signup(self):
+        self.signups += 1
+        name = 'bench%d_%d_%d' % (self.number, self.signups, self.rng.randint(0, 10 ** 9))
+        return call(self.app, 'POST', '/api/users',
+                    {'username': name, 'email': '%s@example.com' % name, 'password': PASSWORD})
+
+    def login(self):
+        response = call(self.app, 'POST', '/api/sessions', {'username': self.username, 'password': PASSWORD})
+        if response.status_int == 200:
+            self.token = response.json['d']['token']
+        return response
+
+    def refresh(self):
+        response = call(self.app, 'PUT', '/api/sessions', {'token': self.token})
+        if response.status_int == 200:
+            self.token = response.json['d']['token']
+        return response
+
+    def profile_get(self):
+        return call(self.app, 'GET', '/api/user/%d' % self.user_id, token=self.token)
+
+    def profile_put(self):
+        return call(self.app, 'PUT', '/api/user/%d' % self.user_id,
+                    {'token': self.token, 'email': '%s.%d@example.com' % (self.username, self.rng.randint(0, 9))})
+
+    def run(self, requests, results):
+        """
+        Send requests requests, recording (kind, seconds, status) for each in results
+        """
+        for _ in range(requests):
+            kind = self.rng.choice(self.kinds)
+            started = time.time()
+            try:
+                status = getattr(self, kind)().status_int
+            except Exception:
+                # Nothing turns an exception into a response in here, a real server would send a 500
+                status = 500
+            results.append((kind, time.time() - started, status))
+
+
+def build(db_url, settings=None):
+    """
+    Make the app against a database with its tables created
+    :return: A tuple of the app and the settings it was made with
+    """
+    app_settings = dict(DEFAULT_SETTINGS)
+    app_settings.update(settings or {})
+    app_settings['sqlalchemy.url'] = db_url
+    engine = get_engine(app_settings)
+    metadata.create_all(engine)
+    engine.dispose()
+    return load_main()({}, **dict(app_settings)), app_settings
+
+
+def shutdown(app):
+    """
+    Stop the app's background threads, writing out what they still hold, and close its connections, so nothing
+    touches the database once the run is over
+    """
+    registry = app.registry
+    for name in ('lastactive_buffer', 'token_revocations', 'scheduler'):
+        if registry.get(name) is not None:
+            registry[name].stop()
+    if registry.get('password_hasher') is not None:
+        registry['password_hasher'].close()
+    for engine in [registry['dbengine']] + registry.get('dbreplicas', []):
+        engine.dispose()
+
+
+def seed(app, settings, count):
+    """
+    Add count users with a session each, all with PASSWORD.  If the app signs its tokens the sessions get signed
+    tokens too, as logging in would have given them.
+    :return: A list of (id, username, token) for them
+    """
+    engine = get_engine(settings)
+    salt = os.urandom(256)
+    hasher = hasher_from_settings(settings)
+    try:
+        password = hasher.hash(PASSWORD, salt)
+    finally:
+        hasher.close()
+    seed_users(engine, count, 1, password, salt, prefix='httpbench')
+    rows = engine.execute('SELECT users.id, users.username, sessions.token, sessions.id FROM users '
+                          'JOIN sessions ON sessions.user_id = users.id '
+                          "WHERE users.username LIKE 'httpbench%' ORDER BY users.id").fetchall()
+    signer = app.registry.get('token_signer')
+    seeded, signed = [], []
+    for user_id, username, token, session_id in rows:
+        if signer is not None:
+            token = signer.sign(user_id, session_id)
+            signed.append({'session_id': session_id, 'signed': token})
+        seeded.append((user_id, username, token))
+    if signed:
+        engine.execute(sessions_table.update()
+                       .where(sessions_table.c.id == bindparam('session_id'))
+                       .values(token=bindparam('signed')), signed)
+    engine.dispose()
+    return seeded
+
+
+def summarize(results, elapsed):
+    routes = {}
+    for kind in sorted(ROUTES):
+        latencies = [seconds for k, seconds, status in results if k == kind]
+        if not latencies:
+            continue
+        routes[ROUTES[kind]] = {
+            'requests': len(latencies),
+            'errors': len([1 for k, seconds, status in results if k == kind and status >= 400]),
+            'requests_per_second': len(latencies) / elapsed,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    return routes
+
+
+def run(threads=8, requests=500, users=1000, warmup=20, seed_value=1, db_url=None, settings=None):
+    """
+    Build, seed and load the app
+    :return: A dict of results
+    """
+    app, db_file = None, None
+    try:
+        if db_url is None:
+            handle, db_file = tempfile.mkstemp(suffix='.sqlite', prefix='http_benchmark')
+            os.close(handle)
+            db_url = 'sqlite:///' + db_file
+        app, app_settings = build(db_url, settings)
+        seeded = seed(app, app_settings, users)
+        clients = [Client(app, i, seeded, random.Random(seed_value * 1000 + i)) for i in range(threads)]
+        # Fill the caches and the connection pool before anything is timed
+        for client in clients:
+            client.run(warmup, [])
+        results = []
+        workers = [threading.Thread(target=client.run, args=(requests, results)) for client in clients]
+        started = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - started
+    finally:
+        if app is not None:
+            shutdown(app)
+        if db_file is not None:
+            os.remove(db_file)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': app_settings['sqlalchemy.url'].split(':', 1)[0],
+        'settings': dict((k, v) for k, v in app_settings.items() if k != 'sqlalchemy.url'),
+        'threads': threads,
+        'requests_per_thread': requests,
+        'seeded_users': users,
+        'seed': seed_value,
+        'elapsed_seconds': elapsed,
+        'requests': len(results),
+        'errors': len([1 for kind, seconds, status in results if status >= 400]),
+        'requests_per_second': len(results) / elapsed,
+        'routes': summarize(results, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('settings', nargs='*', help='app settings to use, as name=value')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--requests', type=int, default=500, help='timed requests each thread sends')
+    parser.add_argument('--users', type=int, default=1000, help='users to seed the database with')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests each thread sends first')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random traffic')
+    parser.add_argument('--db-url', help='an empty database to use instead of a temporary SQLite file')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    settings = dict(setting.split('=', 1) for setting in args.settings)
+    # Failed requests are counted in the results rather than logged
+    logging.basicConfig(level=logging.CRITICAL)
+
+    result = run(args.threads, args.requests, args.users, args.warmup, args.seed, args.db_url, settings)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
+    print('%d requests from %d threads in %.1fs: %.1f requests/s, %d errors (%s, %s)' % (
+        result['requests'], result['threads'], result['elapsed_seconds'], result['requests_per_second'],
+        result['errors'], result['database'], result['commit'] or 'no commit'))
+    for route, stats in sorted(result['routes'].items()):
+        print('%-22s %6d requests %8.1f/s  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %d errors' % (
+            route, stats['requests'], stats['requests_per_second'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'], stats['errors']))
+
+
+if __name__ == '__main__':
+    main()
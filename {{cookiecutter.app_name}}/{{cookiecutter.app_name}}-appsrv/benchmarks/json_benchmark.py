@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+JSON rendering speed, FastJSON against Pyramid's JSON renderer with the date and time adapters we used to register.
+
+The payloads are shaped like our responses: a single user with their session, and a page of users.  Each is
+rendered both ways, checked to be identical, and timed, the best of a few runs each.
+
+    python -m benchmarks.json_benchmark --users 1000
+"""
+
+import argparse
+import datetime
+import json
+import time
+
+from pyramid.renderers import JSON
+
+from renderers import FastJSON
+from utilities import date_serializer, time_serializer
+
+
+def make_user(i, now):
+    return {
+        'id': i,
+        'username': 'user%d' % i,
+        'email': 'user%d@example.com' % i,
+        'created': now - datetime.timedelta(days=i),
+        'origin': 'web' if i % 2 else None,
+        'lockmessage': None,
+        'session': {
+            'id': i * 10,
+            'user_id': i,
+            'started': now - datetime.timedelta(hours=i),
+            'lastactive': now,
+            'token': 's1.%d.%d.1500000000.c2lnbmF0dXJl' % (i, i * 10),
+        },
+    }
+
+
+def payloads(users):
+    now = datetime.datetime(2018, 1, 1, 12, 0, 0, 123456)
+    return {
+        'single user': {'d': make_user(1, now)},
+        '%d users' % users: {'d': [make_user(i, now) for i in range(users)]},
+    }
+
+
+def pyramid_renderer():
+    renderer = JSON()
+    renderer.add_adapter(datetime.date, date_serializer)
+    renderer.add_adapter(datetime.time, time_serializer)
+    return renderer(None)
+
+
+def best_of(repeat, number, func, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.time()
+        for _ in range(number):
+            func(*args)
+        times.append((time.time() - started) / number)
+    return min(times)
+
+
+def run(users=1000, repeat=5):
+    old = pyramid_renderer()
+    new = FastJSON()(None)
+    results = []
+    for name, payload in sorted(payloads(users).items()):
+        assert old(payload, {}) == new(payload, {}), 'output differs for %s' % name
+        number = max(1, 20000 // len(old(payload, {})) * 10)
+        old_time = best_of(repeat, number, old, payload, {})
+        new_time = best_of(repeat, number, new, payload, {})
+        results.append({
+            'payload': name,
+            'bytes': len(new(payload, {})),
+            'pyramid_ms': old_time * 1000,
+            'fast_ms': new_time * 1000,
+            'speedup': old_time / new_time,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='users in the list payload')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    results = run(args.users, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for r in results:
+        print('%-12s %9d bytes: pyramid %8.3fms, fast %8.3fms, %.1fx faster' % (
+            r['payload'], r['bytes'], r['pyramid_ms'], r['fast_ms'], r['speedup']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Login throughput against password KDF cost.
+
+For each iteration count, a number of client threads log in as fast as they can for a while, each login being the
+password check the sessions view does, through a PasswordHasher set up the way the ini settings would.  Reports
+logins per second, how many were turned away as busy, and the latency of the ones that got through, which is
+what picking auth.password.iterations, pool_size and max_pending comes down to.
+
+    python -m benchmarks.login_benchmark --iterations 10000,100000,200000 --clients 8 --pool-size 2
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from security.passwords import ALGORITHMS, PasswordHasher, PasswordHasherBusy
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(iterations, algorithm='pbkdf2_sha512', clients=8, duration=5.0, pool_size=2, max_pending=2):
+    """
+    Log in from clients threads for duration seconds at one KDF cost
+    :return: A dict of results
+    """
+    hasher = PasswordHasher(algorithm=algorithm, iterations=iterations, pool_size=pool_size,
+                            max_pending=max_pending)
+    salt = os.urandom(256)
+    stored = hasher.hash(u'correct horse battery staple', salt)
+    latencies = []
+    busy = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        mine = []
+        rejected = 0
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                hasher.verify(u'correct horse battery staple', salt, stored)
+            except PasswordHasherBusy:
+                rejected += 1
+                # A real client would back off on the 503's Retry-After, this keeps us from spinning
+                time.sleep(0.01)
+                continue
+            mine.append(time.time() - started)
+        with lock:
+            latencies.extend(mine)
+            busy[0] += rejected
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    hasher.close()
+    p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+    return {
+        'algorithm': algorithm,
+        'iterations': iterations,
+        'clients': clients,
+        'pool_size': pool_size,
+        'max_pending': max_pending,
+        'logins': len(latencies),
+        'logins_per_second': len(latencies) / elapsed,
+        'busy': busy[0],
+        'p50_ms': p50 * 1000 if p50 is not None else None,
+        'p95_ms': p95 * 1000 if p95 is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', default='1000,10000,50000,100000,200000',
+                        help='comma separated iteration counts to try')
+    parser.add_argument('--algorithm', default='pbkdf2_sha512', choices=sorted(ALGORITHMS))
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to run each cost for')
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=2)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for iterations in [int(x) for x in args.iterations.split(',')]:
+        results.append(run(iterations, args.algorithm, args.clients, args.duration, args.pool_size,
+                           args.max_pending))
+        if not args.json:
+            r = results[-1]
+            print('%10d iterations: %8.1f logins/s  p50 %8.1fms  p95 %8.1fms  %d busy' % (
+                iterations, r['logins_per_second'], r['p50_ms'] or 0, r['p95_ms'] or 0, r['busy']))
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
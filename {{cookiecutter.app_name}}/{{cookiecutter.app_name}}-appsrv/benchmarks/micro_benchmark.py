@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Per call timings of the small functions every request goes through.
+
+Each case is timed with timeit, calling it enough times per run to take about --min-time seconds, and the best of
+--repeat runs is kept, as microseconds per call.  The runs go round the cases in turn rather than finishing one case
+before starting the next, so the machine getting busier or quieter part way through shifts every case alike.
+
+--output saves the results as JSON, with the commit and Python they came from.  --baseline compares a run with
+results saved earlier and exits with status 1 if any case got more than --threshold percent slower, so a change to
+one of these paths can be judged against the commit before it.  Compare runs from the same machine, and on a busy
+one raise --min-time and --repeat before trusting a small difference.
+
+    python -m benchmarks.micro_benchmark --output baseline.json
+    python -m benchmarks.micro_benchmark --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+from benchmarks import git_commit
+from db import User
+from db.converters import array_of_dicts_from_array_of_models, dict_from_row, sqlobj_from_dict
+from utilities import date_serializer, error_dict, hash_password
+from views.base_views import app_base
+from views.local_view import is_internal
+
+
+class FakeRegistry(dict):
+    """
+    The settings, and the app shells as warm_templates leaves them, so app_base is timed as it runs once warmed up
+    """
+    settings = {'some_key': 'this_is_a_key', 'app_shell.cache_control': 'no-cache'}
+
+    def __init__(self):
+        dict.__init__(self)
+        shell = b'<!DOCTYPE html>' + b' ' * 4096
+        self['app_shells'] = {False: (shell, 'a' * 40), True: (shell, 'b' * 40)}
+
+
+class FakeRequest(object):
+    """
+    Just what the request handling functions read, so their own cost is all that is timed
+    """
+    registry = FakeRegistry()
+
+    def __init__(self, host, remote_addr):
+        self.host = host
+        self.remote_addr = remote_addr
+
+
+def make_user(number=1):
+    return User(id=number, username='user%d' % number, email='user%d@example.com' % number, password=b'p' * 64,
+                salt=b's' * 256, created=datetime(2018, 1, 2, 3, 4, 5), origin='benchmark', lockmessage=None)
+
+
+def cases():
+    """
+    The cases, as a list of (name, function to call with no arguments)
+    """
+    salt = os.urandom(256)
+    user = make_user()
+    users = [make_user(i) for i in range(100)]
+    values = {'username': 'user', 'email': 'user@example.com', 'origin': 'benchmark', 'not_a_column': 1}
+    now = datetime(2018, 1, 2, 3, 4, 5)
+    local = FakeRequest('localhost:6543', '127.0.0.1')
+    public = FakeRequest('app.example.com', '203.0.113.9')
+    removals = ['password', 'salt']
+    return [
+        ('hash_password', lambda: hash_password(u'correct horse battery staple', salt)),
+        ('error_dict', lambda: error_dict('api_errors', 'not authenticated for this request')),
+        ('dict_from_row', lambda: dict_from_row(user, remove_fields=removals)),
+        ('array_of_dicts_from_array_of_models_100', lambda: array_of_dicts_from_array_of_models(users, removals)),
+        ('sqlobj_from_dict', lambda: sqlobj_from_dict(User(), values)),
+        ('date_serializer', lambda: date_serializer(now, None)),
+        ('is_internal_local', lambda: is_internal(local)),
+        ('is_internal_public', lambda: is_internal(public)),
+        ('app_base_dev', lambda: app_base(local)),
+        ('app_base_public', lambda: app_base(public)),
+    ]
+
+
+def calls_per_run(timer, min_time):
+    """
+    How many calls make a run of about min_time seconds
+    """
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    return max(1, int(number * min_time / elapsed))
+
+
+def run(only=None, min_time=0.2, repeat=7):
+    timers = [(name, timeit.Timer(func)) for name, func in cases()
+              if not only or any(part in name for part in only)]
+    numbers = dict((name, calls_per_run(timer, min_time)) for name, timer in timers)
+    best = {}
+    for _ in range(repeat):
+        for name, timer in timers:
+            elapsed = timer.timeit(numbers[name])
+            best[name] = min(best.get(name, elapsed), elapsed)
+    results = dict((name, {'usec_per_call': best[name] / numbers[name] * 1e6, 'calls_per_run': numbers[name]})
+                   for name, timer in timers)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'min_time': min_time,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=15.0):
+    """
+    Line up a run with a baseline run
+    :param threshold: The percentage change beyond which a case counts as slower or faster
+    :return: A dict of case name to its baseline and current times, the percentage change and a verdict
+    """
+    comparison = {}
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            comparison[name] = {'current_usec': result['usec_per_call'], 'verdict': 'new'}
+            continue
+        change = (result['usec_per_call'] - before['usec_per_call']) / before['usec_per_call'] * 100
+        if change > threshold:
+            verdict = 'slower'
+        elif change < -threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        comparison[name] = {
+            'baseline_usec': before['usec_per_call'],
+            'current_usec': result['usec_per_call'],
+            'change_percent': change,
+            'verdict': verdict,
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cases', nargs='*', help='only run cases with one of these in their names')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds each timed run should take')
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs per case, the best is kept')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare with results written earlier by --output')
+    parser.add_argument('--threshold', type=float, default=15.0, help='percent change to call slower or faster')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    result = run(args.cases, args.min_time, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(result, baseline, args.threshold)
+        result['baseline_commit'] = baseline.get('commit')
+        result['comparison'] = comparison
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    elif comparison is None:
+        for name, stats in sorted(result['results'].items()):
+            print('%-42s %10.3f usec' % (name, stats['usec_per_call']))
+    else:
+        print('Against %s' % (result['baseline_commit'] or args.baseline))
+        for name, stats in sorted(comparison.items()):
+            if stats['verdict'] == 'new':
+                print('%-42s %10s -> %10.3f usec  new' % (name, '', stats['current_usec']))
+            else:
+                print('%-42s %10.3f -> %10.3f usec  %+6.1f%%  %s' % (
+                    name, stats['baseline_usec'], stats['current_usec'], stats['change_percent'], stats['verdict']))
+    if comparison is not None and any(stats['verdict'] == 'slower' for stats in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
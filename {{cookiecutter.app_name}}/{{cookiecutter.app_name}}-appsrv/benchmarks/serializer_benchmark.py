@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Model serialization speed, the compiled serializers in db.converters against the row by row dict_from_row they
+replaced.
+
+Builds a result set of User models in memory, no database needed, and times turning it into dictionaries both
+ways, the best of a few runs each.  With --query it also loads the rows from an in-memory SQLite database, timing
+query-and-serialize through ORM instances against the row tuple path that never builds them.
+
+    python -m benchmarks.serializer_benchmark --rows 100000 --query
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from db import User, metadata
+from db.converters import array_of_dicts_from_array_of_models, array_of_dicts_from_rows, make_set_of_field_names
+
+
+def legacy_dict_from_row(row, remove_fields=None, sub_values=None):
+    """
+    dict_from_row as it was before the serializers were compiled, kept here to compare against
+    """
+    retdict = {}
+    remove_fields = make_set_of_field_names(remove_fields)
+    sub_values = make_set_of_field_names(sub_values)
+
+    for public_key in [i.name for i in row.__table__.columns if i.name not in remove_fields]:
+        value = getattr(row, public_key)
+        if value is not None:
+            retdict[public_key] = value
+        else:
+            retdict[public_key] = None
+    for key in [i for i in sub_values if hasattr(row, i)]:
+        sub = getattr(row, key)
+        if isinstance(sub, list):
+            retdict[key] = [legacy_dict_from_row(i, remove_fields=remove_fields) for i in sub if i not in remove_fields]
+        else:
+            retdict[key] = sub._to_dict()
+    return retdict
+
+
+def legacy_array_of_dicts_from_array_of_models(models, remove_fields=None, sub_values=None):
+    remove_fields = make_set_of_field_names(remove_fields)
+    sub_values = make_set_of_field_names(sub_values)
+    return [legacy_dict_from_row(x, remove_fields, sub_values) for x in models]
+
+
+def make_users(count):
+    created = datetime(2018, 1, 1)
+    return [User(id=i, username='user%d' % i, email='user%d@example.com' % i, password=b'p', salt=b's',
+                 created=created, origin='benchmark', lockmessage=None)
+            for i in range(count)]
+
+
+def best_of(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.time()
+        func(*args)
+        times.append(time.time() - started)
+    return min(times)
+
+
+def run(rows=100000, repeat=3):
+    users = make_users(rows)
+    removals = ['password', 'salt']
+    assert legacy_array_of_dicts_from_array_of_models(users[:10], removals) == \
+        array_of_dicts_from_array_of_models(users[:10], removals)
+    legacy = best_of(repeat, legacy_array_of_dicts_from_array_of_models, users, removals)
+    compiled = best_of(repeat, array_of_dicts_from_array_of_models, users, removals)
+    return {
+        'rows': rows,
+        'legacy_seconds': legacy,
+        'compiled_seconds': compiled,
+        'legacy_rows_per_second': rows / legacy,
+        'compiled_rows_per_second': rows / compiled,
+        'speedup': legacy / compiled,
+    }
+
+
+def run_query(rows=100000, repeat=3):
+    """
+    Load and serialize rows from a database, through ORM instances and straight from the row tuples
+    """
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    users_table = User.__table__
+    created = datetime(2018, 1, 1)
+    engine.execute(users_table.insert(), [
+        {'id': i, 'username': 'user%d' % i, 'email': 'user%d@example.com' % i, 'password': b'p', 'salt': b's',
+         'created': created, 'origin': 'benchmark'}
+        for i in range(1, rows + 1)])
+    session = sessionmaker(bind=engine)()
+    removals = ['password', 'salt']
+
+    def orm():
+        result = array_of_dicts_from_array_of_models(session.query(User).all(), removals)
+        session.expunge_all()
+        return result
+
+    def core():
+        return array_of_dicts_from_rows(session.execute(select([users_table])), removals)
+
+    assert orm() == core()
+    orm_time = best_of(repeat, orm)
+    core_time = best_of(repeat, core)
+    return {
+        'rows': rows,
+        'orm_seconds': orm_time,
+        'rows_seconds': core_time,
+        'speedup': orm_time / core_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--query', action='store_true', help='also time loading from a database')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    results = {'models': run(args.rows, args.repeat)}
+    if args.query:
+        results['query'] = run_query(args.rows, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    result = results['models']
+    print('%d models: legacy %.3fs, compiled %.3fs, %.1fx faster' % (
+        result['rows'], result['legacy_seconds'], result['compiled_seconds'], result['speedup']))
+    if args.query:
+        result = results['query']
+        print('%d rows from the database: ORM %.3fs, row tuples %.3fs, %.1fx faster' % (
+            result['rows'], result['orm_seconds'], result['rows_seconds'], result['speedup']))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,18 +6,22 @@
 #import customer
 
 import zope.sqlalchemy
+from pyramid.settings import asbool, aslist
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship, sessionmaker, configure_mappers
+from sqlalchemy.orm import relationship, sessionmaker, configure_mappers, make_transient_to_detached
 from sqlalchemy.schema import MetaData
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy import (
     engine_from_config,
+    event,
+    func,
     Boolean,
     Column,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     BigInteger,
     LargeBinary,
@@ -25,6 +29,10 @@ from sqlalchemy import (
     Text,
     TIMESTAMP,
     Table)
+from sqlalchemy.engine.url import make_url
+
+from db.pool import TimedQueuePool, check_pool_capacity
+from db.replicas import ReplicaRouter, RoutingSession
 
 # Recommended naming convention used by Alembic, as various different database
 # providers will autogenerate vastly different names making migrations more
@@ -44,6 +52,9 @@ from sqlalchemy import (
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 
+# SQLite only autoincrements an INTEGER PRIMARY KEY, so the big keys become plain integers there
+BigIntegerKey = BigInteger().with_variant(Integer(), 'sqlite')
+
 
 class MyBase(Base):
     """
@@ -71,13 +82,20 @@ class User(MyBase):
     
     __tablename__ = 'users'
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)
     username = Column(Text, nullable=False, unique=True)
     email = Column(String(254), nullable=False)
-    password = Column(String(254), nullable=False)
-    salt = Column(String(254), nullable=False)
-    created = Column(DateTime, nullable=False, server_default='current_timestamp')
+    # These hold raw digest and salt bytes, not text
+    password = Column(LargeBinary, nullable=False)
+    salt = Column(LargeBinary, nullable=False)
+    created = Column(DateTime, nullable=False, server_default=func.current_timestamp())
     origin = Column(Text)
+    lockmessage = Column(Text)
+    # A bitmask of the user's roles, as in security.authorize.ROLES
+    roles = Column(BigInteger, nullable=False, default=0, server_default='0')
+
+    # For listing users a page at a time in (created, id) order
+    __table_args__ = (Index('ix_users_created_id', 'created', 'id'),)
 
 
 class Session(MyBase):
@@ -88,11 +106,24 @@ class Session(MyBase):
     __tablename__ = 'sessions'
     # __table_args__ = {u'schema': 'pj'}
     
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    started = Column(TIMESTAMP, nullable=False, server_default='current_timestamp')
-    lastactive = Column(TIMESTAMP, nullable=False, server_default='current_timestamp')
-    token = Column(Text, nullable=False)
+    started = Column(TIMESTAMP, nullable=False, server_default=func.current_timestamp())
+    lastactive = Column(TIMESTAMP, nullable=False, server_default=func.current_timestamp())
+    token = Column(Text, nullable=False, unique=True)
+
+
+class RevokedSession(MyBase):
+    """
+    Sessions ended before their signed tokens expire, so every process can stop accepting them.  Rows older than
+    the signed tokens' max_age can't reject anything and are pruned.
+    """
+
+    __tablename__ = 'revoked_sessions'
+
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)
+    session_id = Column(BigIntegerKey, nullable=False)
+    revoked = Column(DateTime, nullable=False, index=True)
 
 
 # run configure_mappers after defining all of the models to ensure
@@ -101,15 +132,92 @@ configure_mappers()
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
-    return engine_from_config(settings, prefix)
+    """
+    Make the engine from the settings starting with prefix, such as sqlalchemy.url and sqlalchemy.pool_size.  Pooled
+    connections to a database server go through a TimedQueuePool, so the pool's use can be reported.
+    """
+    options = {}
+    if make_url(settings[prefix + 'url']).get_backend_name() != 'sqlite':
+        options['poolclass'] = TimedQueuePool
+    engine = engine_from_config(settings, prefix, **options)
+    if engine.dialect.name == 'sqlite':
+        enable_sqlite_savepoints(engine)
+    return engine
+
+
+def enable_sqlite_savepoints(engine):
+    """
+    pysqlite manages transactions itself and breaks SAVEPOINT, so take that over as sqlalchemy recommends
+    :param engine: An engine for a sqlite database
+    """
+    @event.listens_for(engine, 'connect')
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def do_begin(conn):
+        conn.execute('BEGIN')
+
+
+def is_postgresql(bind):
+    """
+    Whether a session or engine talks to PostgreSQL, for the few statements that only it can do in one round trip
+    :param bind: A sqlalchemy Session, Engine or Connection
+    """
+    if hasattr(bind, 'get_bind'):
+        bind = bind.get_bind()
+    return bind.dialect.name == 'postgresql'
 
 
-def get_session_factory(engine):
-    factory = sessionmaker()
+def merge_row(dbsession, model, values):
+    """
+    Attach a model instance built from column values we already have, such as from a RETURNING clause or a cache,
+    to a session as if it had been loaded, without going to the database
+    :param dbsession: The db session the instance should belong to
+    :param model: The model class
+    :param values: A dictionary of the instance's column values, including its primary key
+    :return: A persistent instance of model
+    """
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return dbsession.merge(instance, load=False)
+
+
+def mark_changed(dbsession):
+    """
+    Tell the transaction manager that a session wrote with a plain statement, rather than through the ORM, so that
+    its transaction gets committed instead of rolled back as read only.  Sessions not managed by a transaction
+    manager, as in the tests, are left alone.
+    :param dbsession: A db session
+    """
+    transaction_manager = dbsession.info.get('transaction_manager')
+    if transaction_manager is not None:
+        zope.sqlalchemy.mark_changed(dbsession, transaction_manager=transaction_manager)
+
+
+def get_session_factory(engine, replicas=None):
+    """
+    :param engine: The primary's engine, which sessions are bound to
+    :param replicas: A list of engines for read replicas, which makes the sessions RoutingSessions that can read
+        from them
+    """
+    if replicas:
+        factory = sessionmaker(class_=RoutingSession, replicas=replicas)
+    else:
+        factory = sessionmaker()
     factory.configure(bind=engine)
     return factory
 
 
+def get_replica_engines(settings, prefix='sqlalchemy.'):
+    """
+    Make an engine for each of the replicas.urls, with the same pool and other settings as the primary's
+    :return: A list of engines, empty if there are no replicas
+    """
+    return [get_engine(dict(settings, **{prefix + 'url': url}), prefix)
+            for url in aslist(settings.get('replicas.urls', ''))]
+
+
 def get_tm_session(session_factory, transaction_manager):
     """
     Get a ``sqlalchemy.orm.Session`` instance backed by a transaction.
@@ -135,11 +243,28 @@ def get_tm_session(session_factory, transaction_manager):
 
     """
     dbsession = session_factory()
+    dbsession.info['transaction_manager'] = transaction_manager
     zope.sqlalchemy.register(
         dbsession, transaction_manager=transaction_manager)
     return dbsession
 
 
+def background_connections(settings):
+    """
+    How many primary connections the app's background threads may hold at once, from what the settings turn on: the
+    lastactive flusher, the signed token revocation refresher and the session pruning job.  Replicas have none.
+    :param settings: The app's settings
+    :return: The number of connections
+    """
+    threads = [
+        asbool(settings.get('auth.lastactive.write_behind', True)),
+        bool(settings.get('auth.token_secret')),
+        asbool(settings.get('maintenance.enabled', True)) and
+        asbool(settings.get('maintenance.prune_sessions.enabled', True)),
+    ]
+    return len([each for each in threads if each])
+
+
 def includeme(config):
     """
     Initialize the model for a Pyramid app.
@@ -152,14 +277,54 @@ def includeme(config):
     # use pyramid_tm to hook the transaction lifecycle to the request
     config.include('pyramid_tm')
 
-    session_factory = get_session_factory(get_engine(settings))
+    engine = get_engine(settings)
+    replicas = get_replica_engines(settings)
+    session_factory = get_session_factory(engine, replicas)
+    config.registry['dbengine'] = engine
+    config.registry['dbreplicas'] = replicas
     config.registry['dbsession_factory'] = session_factory
 
+    # GET requests read from a replica, if there are any, unless the client has just written
+    router = None
+    if replicas:
+        router = ReplicaRouter(
+            pin_seconds=int(settings.get('replicas.pin_seconds', 10)),
+            cookie_name=settings.get('replicas.cookie_name', 'db_primary'),
+        )
+        config.registry['replica_router'] = router
+
+    # Fail now, rather than with pool timeouts under load, if the server has more threads than the pool connections
+    if settings.get('server.threads') is not None:
+        check_pool_capacity(engine, int(settings['server.threads']), background_connections(settings))
+        for each in replicas:
+            check_pool_capacity(each, int(settings['server.threads']), background=0)
+
+    # Count and time each request's statements, over pyramid_tm so the commit is included
+    if asbool(settings.get('sql_stats.enabled', True)):
+        from db.stats import track_engine
+        for each in [engine] + replicas:
+            track_engine(each)
+        config.add_tween('db.stats.sql_stats_tween_factory', over='pyramid_tm.tm_tween_factory')
+
+    # Session activity is written behind the request, in bulk, unless turned off
+    if asbool(settings.get('auth.lastactive.write_behind', True)):
+        from db.activity import LastActiveBuffer
+        lastactive_buffer = LastActiveBuffer(
+            engine,
+            flush_interval=float(settings.get('auth.lastactive.flush_interval', 5)),
+            flush_size=int(settings.get('auth.lastactive.flush_size', 500)),
+            min_interval=float(settings.get('auth.lastactive.min_interval', 60)),
+        )
+        # Started by main once the app has configured successfully
+        config.registry['lastactive_buffer'] = lastactive_buffer
+
+    def request_dbsession(request):
+        # request.tm is the transaction manager used by pyramid_tm
+        dbsession = get_tm_session(session_factory, request.tm)
+        if router is not None:
+            router.route(request, dbsession)
+        return dbsession
+
     # make request.dbsession available for use in Pyramid
-    config.add_request_method(
-        # r.tm is the transaction manager used by pyramid_tm
-        lambda r: get_tm_session(session_factory, r.tm),
-        'dbsession',
-        reify=True
-    )
+    config.add_request_method(request_dbsession, 'dbsession', reify=True)
 
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind buffering of session activity, so that the authentication path doesn't have to write to the
+sessions table on every request.
+"""
+
+import atexit
+import datetime
+import logging
+import threading
+
+from sqlalchemy import case
+
+from db import Session
+
+log = logging.getLogger(__name__)
+
+sessions_table = Session.__table__
+
+
+class LastActiveBuffer(object):
+    """
+    Collects the last time each token was seen in memory, and writes them to sessions.lastactive in bulk, every
+    flush_interval seconds or whenever flush_size tokens are waiting, whichever comes first.
+
+    A token that was written (or that we know the database has) within min_interval seconds is not queued again,
+    so a busy client costs at most one write per min_interval.  Anything still waiting is written at shutdown.
+    """
+
+    def __init__(self, engine, flush_interval=5, flush_size=500, min_interval=60, clock=datetime.datetime.now):
+        """
+        :param engine: The engine to write with, outside of any request transaction
+        :param flush_interval: Seconds between background flushes
+        :param flush_size: How many waiting tokens trigger an early flush, and the most written per statement
+        :param min_interval: Seconds within which a token that was already written is not written again
+        :param clock: A callable returning the current datetime, replaceable for testing
+        """
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.min_interval = datetime.timedelta(seconds=min_interval)
+        self.clock = clock
+        self._pending = {}
+        self._written = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.skipped = 0
+
+    def touch(self, token, lastactive=None):
+        """
+        Note that a token was just used.  This never touches the database itself.
+        :param token: A session token
+        :param lastactive: The lastactive value the database has for this token, if the caller already knows it
+        """
+        now = self.clock()
+        with self._lock:
+            known = self._written.get(token)
+            if lastactive is not None and (known is None or lastactive > known):
+                known = lastactive
+            if known is not None and now - known < self.min_interval:
+                self.skipped += 1
+                return
+            self._pending[token] = now
+            self._written[token] = now
+            full = len(self._pending) >= self.flush_size
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def discard(self, token):
+        """
+        Forget a token, such as when its session is deleted, so we don't bother updating a row that is gone
+        """
+        with self._lock:
+            self._pending.pop(token, None)
+            self._written.pop(token, None)
+
+    def flush(self):
+        """
+        Write everything that is waiting, in chunks of at most flush_size tokens per UPDATE
+        :return: The number of tokens written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            cutoff = self.clock() - self.min_interval
+            # Anything written before the cutoff no longer suppresses anything, so stop remembering it
+            self._written = dict((k, v) for k, v in self._written.items() if v >= cutoff)
+        if not pending:
+            return 0
+        # Sorted so concurrent writers always lock rows in the same order
+        items = sorted(pending.items())
+        written = 0
+        with self._flush_lock:
+            try:
+                for start in range(0, len(items), self.flush_size):
+                    chunk = dict(items[start:start + self.flush_size])
+                    stmt = sessions_table.update()\
+                        .where(sessions_table.c.token.in_(list(chunk)))\
+                        .values(lastactive=case(chunk, value=sessions_table.c.token))
+                    with self.engine.begin() as conn:
+                        conn.execute(stmt)
+                    written += len(chunk)
+            except Exception:
+                log.exception('Failed writing session activity, will retry on the next flush')
+                self._requeue(items[written:])
+            self.flushes += 1
+            self.rows_written += written
+        return written
+
+    def start(self):
+        """
+        Start the background flushing thread, and make sure we flush when the process exits
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='lastactive-flush')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Stop the background thread, if any, and write whatever is still waiting
+        """
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+                'skipped': self.skipped,
+            }
+
+    def _requeue(self, items):
+        with self._lock:
+            for token, when in items:
+                if token not in self._pending or self._pending[token] < when:
+                    self._pending[token] = when
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            self.flush()
@@ -3,7 +3,11 @@
 This file contains utility functions for use in the Pyramid view handling
 """
 
-from sqlalchemy.ext.declarative import declarative_base
+from itertools import chain
+from operator import attrgetter, itemgetter
+
+# Compiled serializers by (model class, remove_fields, sub_values), as given by the caller
+_serializers = {}
 
 
 def make_set_of_field_names(field_names=None):
@@ -25,6 +29,102 @@ def make_set_of_field_names(field_names=None):
         return []
 
 
+def _cache_key(field_names):
+    if not field_names:
+        return ()
+    if isinstance(field_names, list):
+        return tuple(field_names)
+    return (field_names,)
+
+
+def compile_serializer(model, remove_fields=None, sub_values=None):
+    """
+    Build the function that turns instances of one model class into dictionaries, the way dict_from_row does, with
+    the column names and attribute getters worked out once up front rather than for every row
+    :param model: A mapped class
+    :param remove_fields: A list of fields, by string or sqlalchemy object attribute, to leave out
+    :param sub_values: A list of fields to be further loaded into the dict, only if present on the row
+    :return: A function taking an instance of model and returning a dict
+    """
+    remove_fields = make_set_of_field_names(remove_fields)
+    sub_values = make_set_of_field_names(sub_values)
+    names = tuple(c.name for c in model.__table__.columns if c.name not in remove_fields)
+    if len(names) == 1:
+        name = names[0]
+        getter = attrgetter(name)
+        columns = lambda row: {name: getter(row)}
+    elif names:
+        getter = attrgetter(*names)
+        loaded = itemgetter(*names)
+
+        def columns(row):
+            # A loaded row has its values in __dict__, which is much quicker to read than through the instrumented
+            # attributes; anything expired or deferred isn't there, and the attributes load it
+            try:
+                return dict(zip(names, loaded(row.__dict__)))
+            except KeyError:
+                return dict(zip(names, getter(row)))
+    else:
+        columns = lambda row: {}
+    if not sub_values:
+        return columns
+
+    def serialize(row):
+        retdict = columns(row)
+        for key in sub_values:
+            if not hasattr(row, key):
+                continue
+            sub = getattr(row, key)
+            # This used to be the way it was, but Tod didn't know why it would be a list but also a dict
+            # if isinstance(sub, list) and not isinstance(sub, dict):
+            if isinstance(sub, list):
+                retdict[key] = [serializer_for(type(i), remove_fields)(i) for i in sub if i not in remove_fields]
+            else:
+                retdict[key] = sub._to_dict()
+        return retdict
+    return serialize
+
+
+def serializer_for(model, remove_fields=None, sub_values=None):
+    """
+    Get the compiled serializer for a model class and set of options, compiling it the first time it is asked for
+    :param model: A mapped class
+    :param remove_fields: A list of fields, by string or sqlalchemy object attribute, to leave out
+    :param sub_values: A list of fields to be further loaded into the dict, only if present on the row
+    :return: A function taking an instance of model and returning a dict
+    """
+    key = (model, _cache_key(remove_fields), _cache_key(sub_values))
+    try:
+        return _serializers[key]
+    except KeyError:
+        serializer = _serializers[key] = compile_serializer(model, remove_fields, sub_values)
+        return serializer
+
+
+def _passthrough(value):
+    return value
+
+
+def dispatching_serializer(remove_fields, sub_values, models_only=False):
+    """
+    A function serializing rows of any model with the same options, looking each class's serializer up only once
+    :param models_only: Pass anything that isn't a mapped model through untouched instead of failing on it
+    """
+    by_class = {}
+
+    def serialize(row):
+        cls = type(row)
+        try:
+            serializer = by_class[cls]
+        except KeyError:
+            if models_only and getattr(cls, '__table__', None) is None:
+                serializer = by_class[cls] = _passthrough
+            else:
+                serializer = by_class[cls] = serializer_for(cls, remove_fields, sub_values)
+        return serializer(row)
+    return serialize
+
+
 def dict_from_row(row, remove_fields=None, sub_values=None):
     """
     Pyramid is not aware of the model classes used for our database structures, and it should not be, so
@@ -36,25 +136,7 @@ def dict_from_row(row, remove_fields=None, sub_values=None):
     :param sub_values: A list of fields to be further loaded into the return dict, only if present as column names
     :return: A dictionary representation of all the non-private attributes of the row given
     """
-    retdict = {}
-    remove_fields = make_set_of_field_names(remove_fields)
-    sub_values = make_set_of_field_names(sub_values)
-
-    for public_key in [i.name for i in row.__table__.columns if i.name not in remove_fields]:
-        value = getattr(row, public_key)
-        if value is not None:
-            retdict[public_key] = value
-        else:
-            retdict[public_key] = None
-    for key in [i for i in sub_values if hasattr(row, i)]:
-        sub = getattr(row, key)
-        # This used to be the way it was, but Tod didn't know why it would be a list but also a dict
-        # if isinstance(sub, list) and not isinstance(sub, dict):
-        if isinstance(sub, list):
-            retdict[key] = [dict_from_row(i, remove_fields=remove_fields) for i in sub if i not in remove_fields]
-        else:
-            retdict[key] = sub._to_dict()
-    return retdict
+    return serializer_for(type(row), remove_fields, sub_values)(row)
 
 
 def array_of_dicts_from_map(map, remove_fields=None, sub_values=None):
@@ -65,12 +147,9 @@ def array_of_dicts_from_map(map, remove_fields=None, sub_values=None):
     :param sub_values: A list of fields, by string or sqlalchemy object attribute, to get sub_values for on each object
     :return: An array of dictionaries as rendered one at a time from the function appropriate
     """
-    # It's faster to do this once ahead of the dataset instead of redoing it every call
-    remove_fields = make_set_of_field_names(remove_fields)
-    sub_values = make_set_of_field_names(sub_values)
-    return [x if not isinstance(x, declarative_base())
-            else dict_from_row(x, remove_fields, sub_values)
-            for x in map.values()]
+    # Whether each class is a model, and its serializer, are worked out once per class rather than per value
+    serialize = dispatching_serializer(remove_fields, sub_values, models_only=True)
+    return [serialize(x) for x in map.values()]
 
 
 def array_of_dicts_from_array_of_models(models, remove_fields=None, sub_values=None):
@@ -81,10 +160,9 @@ def array_of_dicts_from_array_of_models(models, remove_fields=None, sub_values=N
     :param sub_values: A list of fields, by string or sqlalchemy object attribute, to get sub_values for on each object
     :return: An array of dictionaries as rendered one at a time from the function appropriate
     """
-    # It's faster to do this once ahead of the dataset instead of redoing it every call
-    remove_fields = make_set_of_field_names(remove_fields)
-    sub_values = make_set_of_field_names(sub_values)
-    return [dict_from_row(x, remove_fields, sub_values) for x in models]
+    # Each class's serializer is looked up once ahead of the dataset instead of being redone for every row
+    serialize = dispatching_serializer(remove_fields, sub_values)
+    return [serialize(x) for x in models]
 
 
 # I'd really like to never have to use this ever again, but just in case, we're leaving the code
@@ -114,6 +192,82 @@ def array_of_dicts_from_array_of_models(models, remove_fields=None, sub_values=N
 #     return result
 
 
+def _first_and_keys(rows):
+    """
+    Get the column names for some rows without reading past the first, from the result itself if it knows them
+    :return: A tuple of (column names, rows iterator) where the iterator still yields the first row
+    """
+    keys = list(rows.keys()) if hasattr(rows, 'keys') else None
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return keys or [], iter(())
+    if keys is None:
+        keys = list(first.keys())
+    return keys, chain((first,), rows)
+
+
+def _kept_columns(keys, remove_fields):
+    """
+    :return: A tuple of the kept column names, and a getter picking their values out of a row tuple, or None if
+    every column is kept
+    """
+    remove_fields = make_set_of_field_names(remove_fields)
+    kept = [i for i, key in enumerate(keys) if key not in remove_fields]
+    if len(kept) == len(keys):
+        return keys, None
+    names = [keys[i] for i in kept]
+    if len(kept) == 1:
+        index = kept[0]
+        return names, lambda row: (row[index],)
+    return names, itemgetter(*kept)
+
+
+def iter_dicts_from_rows(rows, remove_fields=None):
+    """
+    Turn plain result rows, from a Core select() or a query(...).with_entities(...), into dictionaries straight
+    from the row tuples, with no ORM instances built along the way.  Rows are read one at a time, so a streamed
+    result stays streamed.
+    :param rows: A result, query, or any iterable of rows with keys()
+    :param remove_fields: A list of column names, or sqlalchemy columns, to leave out
+    :return: A generator of dictionaries
+    """
+    keys, rows = _first_and_keys(rows)
+    names, pick = _kept_columns(keys, remove_fields)
+    if pick is None:
+        return (dict(zip(names, row)) for row in rows)
+    return (dict(zip(names, pick(row))) for row in rows)
+
+
+def array_of_dicts_from_rows(rows, remove_fields=None):
+    """
+    Like iter_dicts_from_rows, but a list
+    :param rows: A result, query, or any iterable of rows with keys()
+    :param remove_fields: A list of column names, or sqlalchemy columns, to leave out
+    :return: An array of dictionaries
+    """
+    return list(iter_dicts_from_rows(rows, remove_fields))
+
+
+def columns_from_rows(rows, remove_fields=None, renames=None):
+    """
+    Turn plain result rows into one array of values per column, which is much smaller to send than a dictionary
+    per row when there are a lot of them
+    :param rows: A result, query, or any iterable of rows with keys()
+    :param remove_fields: A list of column names, or sqlalchemy columns, to leave out
+    :param renames: A dict of column names to the names they should have in the output
+    :return: A dictionary of column name to a list of that column's values, in row order
+    """
+    keys, rows = _first_and_keys(rows)
+    names, pick = _kept_columns(keys, remove_fields)
+    if pick is not None:
+        rows = (pick(row) for row in rows)
+    columns = zip(*rows) or [()] * len(names)
+    renames = renames or {}
+    return dict((renames.get(name, name), list(values)) for name, values in zip(names, columns))
+
+
 def array_of_dicts_from_array_of_keyed_tuples(keyed_tuples):
     """
     Helper function for processing an entire resultset of a query that touched multiple tables,
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Connection pool statistics, and checking at startup that the pool is big enough for the server in front of it.
+"""
+
+import logging
+import threading
+import time
+
+from pyramid.exceptions import ConfigurationError
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+log = logging.getLogger(__name__)
+
+# What waitress runs with when [server:main] doesn't say
+WAITRESS_DEFAULT_THREADS = 4
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that also counts checkouts and timeouts and times how long getting each connection took, which
+    is waiting for one to be checked in, or opening a new one as overflow
+    """
+
+    def __init__(self, creator, **kw):
+        QueuePool.__init__(self, creator, **kw)
+        self._stats_lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        started = time.time()
+        timed_out = False
+        try:
+            return QueuePool._do_get(self)
+        except TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.time() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def stats(self, reset=False):
+        """
+        :param reset: Whether to start the checkout and wait counts again from zero afterwards
+        :return: A dict of how the pool is now, and of the checkouts since it was made or last reset
+        """
+        with self._stats_lock:
+            result = {
+                'size': self.size(),
+                'max_overflow': self._max_overflow,
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(0, self.overflow()),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_mean': self.wait_time / self.checkouts * 1000 if self.checkouts else 0.0,
+                'wait_ms_max': self.max_wait * 1000,
+            }
+            if reset:
+                self._reset_counters()
+        return result
+
+
+def pool_stats(engine, reset=False):
+    """
+    :param engine: An engine
+    :param reset: Whether to start the pool's counts again from zero afterwards
+    :return: A dict of the engine's pool statistics, which for pools other than TimedQueuePool is just its status
+    """
+    if isinstance(engine.pool, TimedQueuePool):
+        return engine.pool.stats(reset)
+    return {'status': engine.pool.status()}
+
+
+def log_pool_stats(engine):
+    """
+    Log the pool's statistics since the last call, as a warning if a request timed out waiting for a connection
+    :return: The statistics
+    """
+    stats = pool_stats(engine, reset=True)
+    if stats.get('timeouts'):
+        log.warning('Database pool for %r: %d checkouts timed out waiting for a connection, it may be too small: %r',
+                    engine.url, stats['timeouts'], stats)
+    return stats
+
+
+def server_threads(global_config):
+    """
+    How many threads waitress serves requests with, read from the ini file the app was loaded from
+    :param global_config: The global configuration main is given
+    :return: The thread count, or None if it can't be known, as when the app isn't loaded from an ini file or isn't
+        served by waitress
+    """
+    path = global_config.get('__file__')
+    if not path:
+        return None
+    try:
+        from ConfigParser import RawConfigParser
+    except ImportError:
+        from configparser import RawConfigParser
+    parser = RawConfigParser()
+    if not parser.read(path) or not parser.has_option('server:main', 'use'):
+        return None
+    if 'waitress' not in parser.get('server:main', 'use'):
+        return None
+    if parser.has_option('server:main', 'threads'):
+        return int(parser.get('server:main', 'threads'))
+    return WAITRESS_DEFAULT_THREADS
+
+
+def check_pool_capacity(engine, threads, background=1):
+    """
+    Make sure every server thread can hold a connection at once without waiting for another to give one back
+    :param engine: The app's engine
+    :param threads: How many threads serve requests
+    :param background: How many more connections background work, like the maintenance jobs, may hold
+    :raises ConfigurationError: If the pool can't hold that many connections
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        # Only a QueuePool with a limit can run out
+        return
+    capacity = pool.size() + pool._max_overflow
+    needed = threads + background
+    if capacity < needed:
+        raise ConfigurationError(
+            'sqlalchemy.pool_size plus sqlalchemy.max_overflow is %d, but %d server threads and background work can '
+            'use %d connections at once; raise the pool size or lower the threads' % (capacity, threads, needed))
+    log.info('Database pool holds %d connections for %d server threads', capacity, threads)
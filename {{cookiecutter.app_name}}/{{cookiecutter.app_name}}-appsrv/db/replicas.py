@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Sending reads to read replicas while writes stay on the primary.
+
+A RoutingSession reads from the replica it has been given with read_from_replica, and only plain SELECTs; anything
+else, a flush, an UPDATE, a SELECT ... FOR UPDATE or a text() statement, goes to the primary, and so does every
+statement after it, so a request that writes reads its own writes.  The ReplicaRouter gives GET and HEAD requests a
+replica, unless the client wrote within the last few seconds, which a cookie set on its writing response says, so a
+client isn't shown data older than what it just saved while the replicas catch up.
+"""
+
+import random
+import time
+
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.sql.expression import SelectBase
+
+# Methods whose requests read from a replica
+READ_METHODS = ('GET', 'HEAD')
+
+
+class RoutingSession(OrmSession):
+    """
+    A session that can read from a replica of the database it is bound to
+    """
+
+    def __init__(self, replicas=(), **kw):
+        """
+        :param replicas: A list of engines for the replicas of the session's bind
+        """
+        OrmSession.__init__(self, **kw)
+        self.replicas = list(replicas)
+
+    def get_bind(self, mapper=None, clause=None):
+        reading = not self._flushing and isinstance(clause, SelectBase) \
+            and getattr(clause, '_for_update_arg', None) is None
+        if reading:
+            replica = self.info.get('replica')
+            if replica is not None:
+                return replica
+        elif clause is not None or self._flushing:
+            # Everything after a write reads from the primary too, so it sees what was written
+            self.info['wrote'] = True
+            self.info.pop('replica', None)
+        return OrmSession.get_bind(self, mapper, clause)
+
+
+def read_from_replica(dbsession):
+    """
+    Have a session send its reads to one of its replicas, picked at random
+    :param dbsession: A db session
+    :return: The replica engine, or None if the session has none
+    """
+    replicas = getattr(dbsession, 'replicas', None)
+    if not replicas:
+        return None
+    dbsession.info['replica'] = random.choice(replicas)
+    return dbsession.info['replica']
+
+
+def use_primary(dbsession):
+    """
+    Send a session's reads to the primary from now on, as when something a replica didn't have may just not have
+    reached it yet
+    :param dbsession: A db session
+    :return: Whether it was reading from a replica, and so whether asking again can give a different answer
+    """
+    return dbsession.info.pop('replica', None) is not None
+
+
+class ReplicaRouter(object):
+    """
+    Decides which requests read from a replica, and pins clients to the primary for a while after they write
+    """
+
+    def __init__(self, pin_seconds=10, cookie_name='db_primary'):
+        """
+        :param pin_seconds: How long after writing a client reads from the primary, which should be longer than
+            the replicas ever lag
+        :param cookie_name: The name of the cookie that holds when the client's pin runs out
+        """
+        self.pin_seconds = pin_seconds
+        self.cookie_name = cookie_name
+
+    def pinned(self, request):
+        """
+        Whether the client wrote recently enough that it should read from the primary
+        """
+        try:
+            until = int(request.cookies.get(self.cookie_name, 0))
+        except ValueError:
+            return False
+        now = time.time()
+        # A time further off than a pin can last wasn't set by us
+        return now < until <= now + self.pin_seconds
+
+    def reads_from_replica(self, request):
+        """
+        Whether a request can read from a replica
+        """
+        return request.method in READ_METHODS and not self.pinned(request)
+
+    def route(self, request, dbsession):
+        """
+        Send a request's session's reads to a replica if the request can read from one, and pin the client to the
+        primary if the session writes.  GET and HEAD requests don't pin, whatever bookkeeping they write, such as
+        a session's lastactive.
+        :param request: The current request
+        :param dbsession: The request's db session, before it has run anything
+        """
+        if self.reads_from_replica(request):
+            read_from_replica(dbsession)
+
+        def pin(request, response):
+            if dbsession.info.get('wrote') and request.method not in READ_METHODS:
+                response.set_cookie(self.cookie_name, str(int(time.time() + self.pin_seconds)),
+                                    max_age=self.pin_seconds, httponly=True)
+        request.add_response_callback(pin)
@@ -6,13 +6,18 @@
 
 CREATE TABLE users (
 	id               bigserial PRIMARY KEY,
-	username         text NOT NULL,
+	username         text UNIQUE NOT NULL,
 	email            varchar(254) NOT NULL,                    -- http://www.rfc-editor.org/errata_search.php?rfc=3696&eid=1690
-	password         text NOT NULL,                            -- SHA-512 hash of <password, salt>
-	salt             text NOT NULL,                            -- big 'ol pile of entropy
-	created          timestamp DEFAULT current_timestamp
+	password         bytea NOT NULL,                           -- <algorithm>$<iterations>$<hex PBKDF2>, or a legacy SHA-512 of <password, salt>
+	salt             bytea NOT NULL,                           -- big 'ol pile of entropy
+	created          timestamp NOT NULL DEFAULT current_timestamp,
+	origin           text,
+	lockmessage      text,                                     -- shown instead of logging in when set
+	roles            bigint NOT NULL DEFAULT 0                 -- bitmask of security.authorize.ROLES
 );
 
+CREATE INDEX ix_users_created_id ON users (created, id);            -- GET /api/users pages through this
+
 CREATE TABLE sessions (
 	id               bigserial PRIMARY KEY,
 	user_id          bigint REFERENCES pj.users(id),
@@ -20,3 +25,11 @@ CREATE TABLE sessions (
 	lastactive       timestamp default current_timestamp,
 	token            text UNIQUE NOT NULL
 );
+
+CREATE TABLE revoked_sessions (
+	id               bigserial PRIMARY KEY,
+	session_id       bigint NOT NULL,                          -- no foreign key, the session is usually deleted
+	revoked          timestamp NOT NULL
+);
+
+CREATE INDEX ix_revoked_sessions_revoked ON revoked_sessions (revoked);  -- revocation lists read from here on
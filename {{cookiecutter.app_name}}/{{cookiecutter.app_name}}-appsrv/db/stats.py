@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request SQL statistics: how many statements a request ran, how long they took altogether, and which was the
+slowest, collected by engine events and reported by a tween.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from pyramid.settings import asbool
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class QueryStats(object):
+    """
+    The statements run on one thread while collecting
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = []
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        self.statements.append(statement)
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def summary(self):
+        slowest = ' '.join((self.slowest_statement or '').split())
+        return '%d statements in %.1fms, slowest %.1fms: %s' % (
+            self.count, self.total_time * 1000, self.slowest_time * 1000, slowest[:200])
+
+
+@contextmanager
+def collect():
+    """
+    Collect the statements run on this thread, by any engine we track, while inside the block
+    :return: The QueryStats being filled in
+    """
+    previous = getattr(_local, 'stats', None)
+    stats = _local.stats = QueryStats()
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'stats', None) is not None:
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = getattr(_local, 'stats', None)
+    started = conn.info.get('query_start_time')
+    if stats is not None and started:
+        stats.record(statement, time.time() - started.pop())
+
+
+def track_engine(engine):
+    """
+    Have an engine's statements counted by collect()
+    :param engine: A sqlalchemy engine
+    """
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def sql_stats_tween_factory(handler, registry):
+    """
+    A tween collecting SQL statistics for each request, which are added to the response as headers when
+    sql_stats.headers is on, and logged: at INFO for every request, at WARNING when a request runs more than
+    sql_stats.warn_count statements or spends more than sql_stats.warn_ms milliseconds in the database.
+    """
+    settings = registry.settings
+    headers = asbool(settings.get('sql_stats.headers', False))
+    warn_count = int(settings.get('sql_stats.warn_count', 20))
+    warn_time = float(settings.get('sql_stats.warn_ms', 500)) / 1000
+
+    def sql_stats_tween(request):
+        with collect() as stats:
+            response = handler(request)
+        if headers:
+            response.headers['X-DB-Statements'] = str(stats.count)
+            response.headers['X-DB-Time'] = '%.1f' % (stats.total_time * 1000)
+            response.headers['X-DB-Slowest'] = '%.1f' % (stats.slowest_time * 1000)
+            response.headers['Server-Timing'] = 'db;dur=%.1f' % (stats.total_time * 1000)
+        if stats.count > warn_count or stats.total_time > warn_time:
+            log.warning('%s %s: %s', request.method, request.path, stats.summary())
+        elif log.isEnabledFor(logging.INFO):
+            log.info('%s %s: %s', request.method, request.path, stats.summary())
+        return response
+
+    return sql_stats_tween
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Housekeeping that runs inside the app process on a timer, such as clearing out sessions nobody can use any more.
+"""
+
+import atexit
+import datetime
+import logging
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import select
+
+from db import RevokedSession, Session
+from db.pool import log_pool_stats
+from security import SESSION_IDLE_LIMIT
+
+log = logging.getLogger(__name__)
+
+sessions_table = Session.__table__
+revoked_table = RevokedSession.__table__
+
+
+class Job(object):
+    """
+    A callable run every interval seconds, with a record of how its runs went
+    """
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_result = None
+        self.last_duration = None
+        self.last_run = None
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_result': self.last_result,
+            'last_duration': self.last_duration,
+            'last_run': self.last_run,
+        }
+
+
+class Scheduler(object):
+    """
+    Runs maintenance jobs one after another in a single background thread.  A job that fails is logged and tried
+    again at its next interval, it never stops the others.  Each job is passed an Event that is set when the
+    scheduler is stopping, so long running jobs can give up early.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        :param clock: A callable returning the current time in seconds, replaceable for testing
+        """
+        self.clock = clock
+        self.jobs = []
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, interval, delay=None):
+        """
+        :param name: What to call the job in logs and stats
+        :param func: A callable taking the stopping Event, whose return value is recorded as the job's result
+        :param interval: Seconds between the end of one run and the start of the next
+        :param delay: Seconds before the first run, defaulting to interval
+        :return: The Job
+        """
+        job = Job(name, func, interval)
+        job.next_run = self.clock() + (interval if delay is None else delay)
+        self.jobs.append(job)
+        return job
+
+    def run_pending(self):
+        """
+        Run every job that is due
+        :return: Seconds until the next job is due
+        """
+        for job in self.jobs:
+            if self._stopping.is_set():
+                break
+            if job.next_run <= self.clock():
+                self.run_job(job)
+        if not self.jobs:
+            return 60
+        return max(0, min(job.next_run for job in self.jobs) - self.clock())
+
+    def run_job(self, job):
+        started = self.clock()
+        job.last_run = datetime.datetime.now()
+        try:
+            job.last_result = job.func(self._stopping)
+        except Exception:
+            job.failures += 1
+            log.exception('Maintenance job %s failed', job.name)
+        else:
+            log.info('Maintenance job %s finished in %.3fs: %r', job.name, self.clock() - started, job.last_result)
+        job.runs += 1
+        job.last_duration = self.clock() - started
+        job.next_run = self.clock() + job.interval
+
+    def start(self):
+        """
+        Start running jobs in the background, until the process exits
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='maintenance')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def stats(self):
+        return dict((job.name, job.stats()) for job in self.jobs)
+
+    def _run(self):
+        wait = self.run_pending()
+        while not self._stopping.wait(wait):
+            wait = self.run_pending()
+
+
+def prune_sessions(engine, idle_limit=SESSION_IDLE_LIMIT, batch_size=1000, pause=0.1, stopping=None):
+    """
+    Delete sessions that have been idle too long to authenticate, batch_size rows per transaction with a pause
+    between them, so no single delete holds its locks for long or starves the requests using the table.
+    :param engine: The engine to delete with, outside of any request transaction
+    :param idle_limit: A timedelta, sessions last active before now minus this are deleted
+    :param batch_size: The most rows deleted by one statement
+    :param pause: Seconds to sleep between batches
+    :param stopping: An optional Event which, once set, stops us after the current batch
+    :return: The number of sessions deleted
+    """
+    cutoff = datetime.datetime.now() - idle_limit
+    batch = select([sessions_table.c.id])\
+        .where(sessions_table.c.lastactive < cutoff)\
+        .limit(batch_size)
+    stmt = sessions_table.delete().where(sessions_table.c.id.in_(batch))
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            count = conn.execute(stmt).rowcount
+        deleted += count
+        if count < batch_size or (stopping is not None and stopping.is_set()):
+            return deleted
+        if stopping is not None:
+            if stopping.wait(pause):
+                return deleted
+        else:
+            time.sleep(pause)
+
+
+def prune_revocations(engine, max_age):
+    """
+    Delete recorded revocations older than any signed token can be, since they can't reject anything any more
+    :param engine: The engine to delete with, outside of any request transaction
+    :param max_age: How many seconds a signed token is good for
+    :return: The number of revocations deleted
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+    with engine.begin() as conn:
+        return conn.execute(revoked_table.delete().where(revoked_table.c.revoked < cutoff)).rowcount
+
+
+def includeme(config):
+    """
+    Set up the maintenance scheduler and its jobs.  It is stored in the registry, and started by main once the app
+    is configured.
+    :param config: a pyramid config
+    """
+    settings = config.get_settings()
+    scheduler = Scheduler()
+    config.registry['scheduler'] = scheduler
+    if not asbool(settings.get('maintenance.enabled', True)):
+        return
+
+    if asbool(settings.get('maintenance.prune_sessions.enabled', True)):
+        engine = config.registry['dbengine']
+        batch_size = int(settings.get('maintenance.prune_sessions.batch_size', 1000))
+        pause = float(settings.get('maintenance.prune_sessions.pause', 0.1))
+        max_age = int(settings.get('auth.signed_tokens.max_age', 604800))
+
+        def prune(stopping):
+            return {
+                'sessions': prune_sessions(engine, batch_size=batch_size, pause=pause, stopping=stopping),
+                'revocations': prune_revocations(engine, max_age),
+            }
+
+        scheduler.add_job(
+            'prune_sessions',
+            prune,
+            interval=float(settings.get('maintenance.prune_sessions.interval', 3600)),
+            delay=float(settings.get('maintenance.prune_sessions.delay', 60)),
+        )
+
+    if asbool(settings.get('maintenance.pool_stats.enabled', True)):
+        engines = [config.registry['dbengine']] + config.registry.get('dbreplicas', [])
+        scheduler.add_job(
+            'pool_stats',
+            lambda stopping: [log_pool_stats(engine) for engine in engines],
+            interval=float(settings.get('maintenance.pool_stats.interval', 300)),
+        )
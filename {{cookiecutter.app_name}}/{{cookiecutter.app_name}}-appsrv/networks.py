@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Telling where a request comes from, by the networks configured in the ini.
+
+The CIDR ranges are merged into sorted, non-overlapping intervals once at startup, so looking an address up is a
+binary search however many there are, and each address's answer is kept so most requests don't even do that.
+"""
+
+import bisect
+
+import ipaddress
+from pyramid.settings import aslist
+
+INTERNAL_NETWORKS = ['0.0.0.0/32', '127.0.0.0/8', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '::1/128',
+                     'fc00::/7']
+INTERNAL_HOSTS = ['localhost']
+DEV_NETWORKS = ['0.0.0.0/32', '127.0.0.0/8', '10.19.0.0/16', '192.168.0.0/16', '::1/128']
+DEV_HOSTS = ['localhost', 'dev.squizzlezig.com']
+
+# Answers kept per classifier before starting over, which is plenty for the addresses of one process's clients
+CACHE_SIZE = 4096
+
+
+def _text(value):
+    # ipaddress only takes unicode for the string forms, and addresses and networks are ASCII
+    return value if isinstance(value, unicode) else value.decode('ascii')
+
+
+class NetworkClassifier(object):
+    """
+    A set of IPv4 and IPv6 networks that can say whether an address is in one of them
+    """
+
+    def __init__(self, cidrs, cache_size=CACHE_SIZE):
+        """
+        :param cidrs: The networks, as CIDR strings like 10.0.0.0/8 or fc00::/7; host bits are ignored
+        :param cache_size: How many addresses' answers to keep
+        """
+        ranges = {4: [], 6: []}
+        for cidr in cidrs:
+            network = ipaddress.ip_network(_text(cidr), strict=False)
+            ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self.starts, self.ends = {}, {}
+        for version, intervals in ranges.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[version] = [start for start, end in merged]
+            self.ends[version] = [end for start, end in merged]
+        self.cache = {}
+        self.cache_size = cache_size
+
+    def __contains__(self, address):
+        found = self.cache.get(address)
+        if found is None:
+            found = self.lookup(address)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[address] = found
+        return found
+
+    def lookup(self, address):
+        """
+        Whether an address is in one of the networks, without the cache
+        :param address: An IPv4 or IPv6 address as a string; anything that isn't one is in none of them
+        """
+        if not address:
+            return False
+        try:
+            ip = ipaddress.ip_address(_text(address))
+        except ValueError:
+            return False
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        number = int(ip)
+        index = bisect.bisect_right(self.starts[ip.version], number) - 1
+        return index >= 0 and number <= self.ends[ip.version][index]
+
+
+def host_name(request):
+    """
+    The request's host without its port, and without the brackets around an IPv6 address
+    """
+    host = request.host
+    if host.startswith('['):
+        return host[1:].split(']', 1)[0]
+    return host.split(':', 1)[0]
+
+
+class Networks(object):
+    """
+    The networks and host names that make a request internal, or for the development version of the app
+    """
+
+    def __init__(self, internal=INTERNAL_NETWORKS, internal_hosts=INTERNAL_HOSTS, dev=DEV_NETWORKS,
+                 dev_hosts=DEV_HOSTS):
+        self.internal = NetworkClassifier(internal)
+        self.internal_hosts = frozenset(internal_hosts)
+        self.dev = NetworkClassifier(dev)
+        self.dev_hosts = frozenset(dev_hosts)
+
+    def is_internal(self, request):
+        """
+        Whether a request was made to an internal host name from an internal address
+        """
+        return host_name(request) in self.internal_hosts and request.remote_addr in self.internal
+
+    def is_dev(self, request):
+        """
+        Whether a request was made to a development host, by name or address, or from a development address
+        """
+        host = host_name(request)
+        return host in self.dev_hosts or host in self.dev or request.remote_addr in self.dev
+
+
+DEFAULT_NETWORKS = Networks()
+
+
+def request_networks(request):
+    """
+    The app's Networks, or the defaults if it wasn't configured with them
+    """
+    return request.registry.get('networks') or DEFAULT_NETWORKS
+
+
+def includeme(config):
+    """
+    Build the Networks from the networks.* settings, each a list of CIDR ranges or host names.
+
+    Activate this setup using ``config.include('networks')``.
+    :param config: a pyramid config
+    """
+    settings = config.get_settings()
+    config.registry['networks'] = Networks(
+        internal=aslist(settings.get('networks.internal', ' '.join(INTERNAL_NETWORKS))),
+        internal_hosts=aslist(settings.get('networks.internal_hosts', ' '.join(INTERNAL_HOSTS))),
+        dev=aslist(settings.get('networks.dev', ' '.join(DEV_NETWORKS))),
+        dev_hosts=aslist(settings.get('networks.dev_hosts', ' '.join(DEV_HOSTS))),
+    )
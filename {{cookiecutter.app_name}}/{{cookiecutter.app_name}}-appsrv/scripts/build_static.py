@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprint the static files for serving with far-future caching.  From the appsrv directory, after building the
+front end:
+
+    build_static_assets production.ini
+    build_static_assets production.ini --source ../{{cookiecutter.app_name}}-static/build
+
+The files of --source, or static.source, if either is given, are first copied into static.directory under build/.
+Then every file in static.directory is copied to a name with the start of a hash of its content in it, so
+build/app/js/app.min.js becomes build/app/js/app.min.0123456789abcdef.js, and text files that compress well get
+gzip copies next to them, and brotli ones too where the brotli package is installed.  manifest.json maps each file
+to its fingerprinted name, for static_assets to serve and the templates to link to.  Fingerprinted files from
+earlier builds are left in place, so pages that are already open can still load what they link to.
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.scripts.common import parse_vars
+
+from static_assets import MANIFEST, SUFFIXES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+DIGEST_LENGTH = 16
+
+# What a build writes: the fingerprint, then maybe an extension, then maybe a compressed copy's suffix
+BUILT_RE = re.compile(r'\.' + '[0-9a-f]' * DIGEST_LENGTH + r'(\.[^./]+)?(' +
+                      '|'.join(re.escape(suffix) for suffix in SUFFIXES.values()) + ')?$')
+
+COMPRESSIBLE = frozenset(['.css', '.htm', '.html', '.ico', '.js', '.json', '.map', '.svg', '.txt', '.xml',
+                          '.eot', '.otf', '.ttf'])
+
+# Compressed copies that don't save at least this much aren't worth a second lookup
+MIN_SAVING = 0.1
+
+
+def fingerprinted_name(name, digest):
+    """
+    name with digest before its extension, or at its end if it has none
+    """
+    head, tail = os.path.split(name)
+    base, ext = os.path.splitext(tail)
+    return os.path.join(head, '%s.%s%s' % (base, digest, ext))
+
+
+def gzip_bytes(data):
+    out = io.BytesIO()
+    # A fixed mtime makes the same input give the same output
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+COMPRESSORS = {'gzip': gzip_bytes}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=11)
+
+
+def write_file(path, data):
+    """
+    Write a file all at once, so a server never sends one half written
+    """
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.rename(partial, path)
+
+
+def copy_source(source, directory):
+    """
+    Copy a front end's build into directory/build, replacing the files that are there
+    """
+    for root, dirs, files in os.walk(source):
+        target = os.path.join(directory, 'build', os.path.relpath(root, source))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in files:
+            shutil.copy2(os.path.join(root, name), os.path.join(target, name))
+
+
+def build(directory):
+    """
+    Fingerprint and compress the files in directory and write its manifest
+    :return: The manifest, a dict of each file's name to its fingerprinted one, relative to directory with
+        forward slashes
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename == MANIFEST or BUILT_RE.search(filename) or filename.endswith('.partial'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+            built = fingerprinted_name(path, hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH])
+            if not os.path.exists(built):
+                write_file(built, data)
+            if os.path.splitext(filename)[1].lower() in COMPRESSIBLE:
+                for encoding, compress in COMPRESSORS.items():
+                    compressed_path = built + SUFFIXES[encoding]
+                    if os.path.exists(compressed_path):
+                        continue
+                    compressed = compress(data)
+                    if len(compressed) <= len(data) * (1 - MIN_SAVING):
+                        write_file(compressed_path, compressed)
+            name = os.path.relpath(path, directory).replace(os.sep, '/')
+            manifest[name] = os.path.relpath(built, directory).replace(os.sep, '/')
+    write_file(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config_uri', help='the ini file, for example production.ini')
+    parser.add_argument('options', nargs='*', help='settings to override, as name=value')
+    parser.add_argument('--source', help="a front end's build to copy in first")
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.options))
+    directory = settings.get('static.directory', os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'static'))
+    source = args.source or settings.get('static.source')
+    if source:
+        copy_source(source, directory)
+    manifest = build(directory)
+    log.info('Fingerprinted %d files in %s%s', len(manifest), directory, '' if brotli else ', without brotli')
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Create the database tables from the models, and optionally fill them with generated users and sessions, as many as
+a load test needs.  From the appsrv directory:
+
+    initialize_pyra_db development.ini
+    initialize_pyra_db development.ini --users 1000000 --sessions-per-user 3
+    initialize_pyra_db production.ini --grant-role alice MS_admin
+
+Seeded users are named <prefix><9 digit number>, numbered on from any seeded before, and all share one password so a
+load test can log in as any of them.  On PostgreSQL the rows are streamed in with COPY, elsewhere they are inserted
+with executemany, batch_size users and their sessions per transaction, so memory use doesn't grow with the count.
+"""
+
+import argparse
+import binascii
+import logging
+import os
+import sys
+import time
+from uuid import uuid4
+
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import LargeBinary, func, select
+
+from db import Session, User, get_engine, is_postgresql, metadata
+from security.authorize import ROLES, role_mask
+from security.passwords import hasher_from_settings
+
+log = logging.getLogger(__name__)
+
+users_table = User.__table__
+sessions_table = Session.__table__
+
+USER_COLUMNS = ['username', 'email', 'password', 'salt', 'origin']
+SESSION_COLUMNS = ['user_id', 'token']
+NUMBER_DIGITS = 9
+
+_copy_escapes = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]
+
+
+def _copy_value(value, binary=False):
+    """
+    A value as COPY's text format writes it
+    """
+    if value is None:
+        return '\\N'
+    if binary:
+        # bytea's hex form, with its backslash escaped for the text format
+        return '\\\\x' + binascii.hexlify(value).decode('ascii')
+    if not isinstance(value, basestring):
+        value = str(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    for char, escaped in _copy_escapes:
+        value = value.replace(char, escaped)
+    return value
+
+
+class RowStream(object):
+    """
+    A file of rows in COPY's text format, made a line at a time as it is read, for psycopg2's copy_expert
+    """
+
+    def __init__(self, rows, binary):
+        """
+        :param rows: An iterable of row tuples
+        :param binary: A list saying, for each column, whether it holds bytes for a bytea column
+        """
+        self._lines = ('\t'.join(_copy_value(value, is_binary) for value, is_binary in zip(row, binary)) + '\n'
+                       for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def insert_rows(connection, table, columns, rows):
+    """
+    Insert many rows in one go, with COPY on PostgreSQL and executemany elsewhere
+    :param connection: A sqlalchemy Connection, in a transaction
+    :param table: The Table to insert into
+    :param columns: The names of the columns the rows have values for
+    :param rows: An iterable of row tuples, in the order of columns
+    """
+    if is_postgresql(connection):
+        binary = [isinstance(table.c[name].type, LargeBinary) for name in columns]
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table.name, ', '.join(columns)), RowStream(rows, binary))
+        finally:
+            cursor.close()
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def next_number(connection, prefix):
+    """
+    The number the next seeded user's name should have, one past the highest already seeded
+    """
+    pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '_' * NUMBER_DIGITS
+    highest = connection.execute(select([func.max(users_table.c.username)])
+                                 .where(users_table.c.username.like(pattern, escape='\\'))).scalar()
+    if highest is None:
+        return 0
+    return int(highest[len(prefix):]) + 1
+
+
+def seed_users(engine, count, sessions_per_user=0, password=b'', salt=b'', prefix='loadtest', origin='seed',
+               batch_size=10000):
+    """
+    Add generated users, each with some sessions of their own
+    :param engine: The engine to write with
+    :param count: How many users to add
+    :param sessions_per_user: How many sessions each gets, with random tokens
+    :param password: The stored password every user gets, as PasswordHasher.hash made it with salt
+    :param salt: The salt every user gets
+    :param prefix: The start of every username, and of their email addresses
+    :param origin: The users' origin
+    :param batch_size: How many users to add per transaction
+    :return: The numbers of the first and last users added
+    """
+    with engine.connect() as connection:
+        first = next_number(connection, prefix)
+    for start in range(first, first + count, batch_size):
+        names = ['%s%0*d' % (prefix, NUMBER_DIGITS, number)
+                 for number in range(start, min(start + batch_size, first + count))]
+        with engine.begin() as connection:
+            insert_rows(connection, users_table, USER_COLUMNS,
+                        ((name, '%s@example.com' % name, password, salt, origin) for name in names))
+            if sessions_per_user:
+                # The names sort in number order, so the batch is a range of the username index
+                user_ids = [row[0] for row in connection.execute(
+                    select([users_table.c.id]).where(users_table.c.username.between(names[0], names[-1])))]
+                insert_rows(connection, sessions_table, SESSION_COLUMNS,
+                            ((user_id, str(uuid4())) for user_id in user_ids for _ in range(sessions_per_user)))
+        log.info('Seeded users %s to %s', names[0], names[-1])
+    return first, first + count - 1
+
+
+def grant_role(engine, username, role):
+    """
+    Give an existing user a role.  Nothing in the API grants roles, so this is how the first admin gets theirs.  A
+    process that has the user in its token cache sees the change once the entry expires, after auth.token_cache.ttl.
+    :param engine: The engine to write with
+    :param username: The user's username
+    :param role: A role name from security.authorize.ROLES
+    :return: Whether there is such a user
+    """
+    with engine.begin() as connection:
+        result = connection.execute(users_table.update()
+                                    .values(roles=users_table.c.roles.op('|')(role_mask([role])))
+                                    .where(users_table.c.username == username))
+    return result.rowcount > 0
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config_uri', help='the ini file, for example development.ini')
+    parser.add_argument('options', nargs='*', help='settings to override, as name=value')
+    parser.add_argument('--users', type=int, default=0, help='how many users to seed')
+    parser.add_argument('--sessions-per-user', type=int, default=0, help='how many sessions each seeded user gets')
+    parser.add_argument('--password', default='loadtest', help='the password every seeded user gets')
+    parser.add_argument('--prefix', default='loadtest', help='the start of every seeded username')
+    parser.add_argument('--batch-size', type=int, default=10000, help='how many users to seed per transaction')
+    parser.add_argument('--grant-role', nargs=2, action='append', default=[], metavar=('USERNAME', 'ROLE'),
+                        help='give an existing user a role, one of %s; can be repeated' % ', '.join(sorted(ROLES)))
+    args = parser.parse_args(argv[1:])
+    for username, role in args.grant_role:
+        if role not in ROLES:
+            parser.error('unknown role %s' % role)
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.options))
+    engine = get_engine(settings)
+    metadata.create_all(engine)
+    for username, role in args.grant_role:
+        if not grant_role(engine, username, role):
+            log.error('There is no user %s to give %s', username, role)
+            sys.exit(1)
+        log.info('Gave %s the %s role', username, role)
+    if args.users < 1:
+        return
+
+    # Hashed once, with the configured cost, so the seeded users log in exactly as real ones would
+    salt = os.urandom(256)
+    hasher = hasher_from_settings(settings)
+    try:
+        password = hasher.hash(args.password, salt)
+    finally:
+        hasher.close()
+    started = time.time()
+    first, last = seed_users(engine, args.users, args.sessions_per_user, password, salt, args.prefix,
+                             batch_size=args.batch_size)
+    elapsed = time.time() - started
+    log.info('Seeded %d users (%s numbers %d to %d) and %d sessions in %.1fs, %.0f users a second',
+             args.users, args.prefix, first, last, args.users * args.sessions_per_user, elapsed, args.users / elapsed)
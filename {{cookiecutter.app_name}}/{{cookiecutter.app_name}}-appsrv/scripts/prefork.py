@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Serve the app from several worker processes, so requests can use more than one core.  From the appsrv directory:
+
+    serve_prefork production.ini
+    serve_prefork production.ini --workers 8 --max-requests 10000
+
+The parent opens the listening socket on [server:main]'s host and port and forks the workers.  Each worker loads
+the app itself, so every worker has its own engine, pools and background threads.  It serves the shared socket
+with waitress, using [server:main]'s threads.  The parent doesn't serve anything: it starts a new worker whenever
+one exits, replaces them all on SIGHUP to pick up new code or settings, and stops them on SIGTERM or SIGINT.  Only
+one worker at a time prunes sessions, the others load the app with maintenance.prune_sessions.enabled off, and when
+that worker exits its replacement takes the job over.
+
+A worker retires after max_requests requests, plus a random part of max_requests_jitter so they don't all go at
+once, or once its resident memory passes max_rss_mb.  Retiring, or being sent SIGTERM, a worker stops accepting
+connections, finishes the requests it has for up to graceful_timeout seconds and exits, and the parent starts
+another in its place.  New connections wait in the socket's backlog while a replacement loads.  The ini's
+[prefork] section sets these, and the command line overrides it.
+"""
+
+import argparse
+import errno
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import signal
+import socket
+import sys
+import threading
+import time
+
+from pyramid.paster import get_app, setup_logging
+from waitress.server import create_server
+
+log = logging.getLogger(__name__)
+
+# A worker exits with this when it can't load the app, which another try won't fix
+BOOT_FAILED = 3
+
+# The global option telling main whether this worker prunes sessions
+MAINTENANCE_OPTION = 'prefork.maintenance'
+
+DEFAULT_OPTIONS = {
+    'host': '0.0.0.0',
+    'port': 6543,
+    'threads': 4,
+    'workers': multiprocessing.cpu_count(),
+    'max_requests': 0,
+    'max_requests_jitter': 0,
+    'max_rss_mb': 0,
+    'graceful_timeout': 30,
+}
+
+
+def read_options(path):
+    """
+    Read the listening address and threads from the ini's [server:main], and the rest from its [prefork]
+    :param path: The ini file
+    :return: A dict of the options, with defaults for any the file doesn't give
+    """
+    try:
+        from ConfigParser import RawConfigParser
+    except ImportError:
+        from configparser import RawConfigParser
+    parser = RawConfigParser()
+    parser.read(path)
+    options = dict(DEFAULT_OPTIONS)
+    if parser.has_section('server:main'):
+        if parser.has_option('server:main', 'listen'):
+            # Only the first address is served
+            host, port = parser.get('server:main', 'listen').split()[0].rsplit(':', 1)
+            options['host'], options['port'] = host.strip('[]'), port
+        for name in ('host', 'port', 'threads'):
+            if parser.has_option('server:main', name):
+                options[name] = parser.get('server:main', name)
+    if parser.has_section('prefork'):
+        for name in ('workers', 'max_requests', 'max_requests_jitter', 'max_rss_mb', 'graceful_timeout'):
+            if parser.has_option('prefork', name):
+                options[name] = parser.get('prefork', name)
+    for name, default in DEFAULT_OPTIONS.items():
+        options[name] = type(default)(options[name])
+    return options
+
+
+def rss_mb():
+    """
+    This process's resident memory in megabytes, or its peak where there's no /proc to say what it is now
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024)
+    except (IOError, OSError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux counts ru_maxrss in kilobytes, macOS in bytes
+        return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def listen(host, port, backlog=1024):
+    """
+    Open the socket the workers all accept connections from
+    """
+    family, socktype, proto, canonname, address = socket.getaddrinfo(
+        host, port, socket.AF_UNSPEC, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+class _Finishing(object):
+    """
+    A response's body, which calls done once the server has closed it, having sent all of it
+    """
+
+    def __init__(self, iterable, done):
+        self.iterable = iterable
+        self.done = done
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.done()
+
+
+class RecyclingApp(object):
+    """
+    WSGI middleware that counts requests, those in progress and all of them, and asks for the worker to be retired
+    once it has served enough or grown too big
+    """
+
+    def __init__(self, app, max_requests=0, max_rss_mb=0, retire=None):
+        """
+        :param app: The WSGI app
+        :param max_requests: How many requests to serve before retiring, or 0 for no limit
+        :param max_rss_mb: How much resident memory to grow to before retiring, or 0 for no limit
+        :param retire: Called, once, with the reason, when it is time to retire
+        """
+        self.app = app
+        self.max_requests = max_requests
+        self.max_rss_mb = max_rss_mb
+        self.retire = retire
+        self.requests = 0
+        self.active = 0
+        self.retiring = False
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            self._finished()
+            raise
+        return _Finishing(result, self._finished)
+
+    def _finished(self):
+        with self._lock:
+            self.active -= 1
+            if self.retiring:
+                return
+            if self.max_requests and self.requests >= self.max_requests:
+                reason = 'served %d requests' % self.requests
+            elif self.max_rss_mb and rss_mb() > self.max_rss_mb:
+                reason = 'grew past %dMB' % self.max_rss_mb
+            else:
+                return
+            self.retiring = True
+        log.info('Worker %d retiring, having %s', os.getpid(), reason)
+        if self.retire is not None:
+            self.retire(reason)
+
+
+class Worker(object):
+    """
+    One worker process's server, which on SIGTERM stops accepting connections and exits once the requests it has
+    are answered
+    """
+
+    def __init__(self, app, sock, threads=4, max_requests=0, max_rss_mb=0, graceful_timeout=30):
+        self.socket_map = {}
+        self.app = RecyclingApp(app, max_requests, max_rss_mb, retire=self.retire)
+        self.server = create_server(self.app, map=self.socket_map, sockets=[sock], threads=threads)
+        self.graceful_timeout = graceful_timeout
+        self.stopping = False
+
+    def retire(self, reason):
+        # Stopping has to start in the main thread, where the server's loop runs
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def busy(self):
+        """
+        Whether any request is being answered, or waiting to be, or has a response still to send
+        """
+        if self.app.active:
+            return True
+        try:
+            channels = list(self.socket_map.values())
+        except RuntimeError:
+            # The loop changed the map as we read it
+            return True
+        return any(channel.writable() or getattr(channel, 'requests', None) for channel in channels)
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        # The other workers accept the new connections from here on.  The socket is left open, since closing it
+        # here can pull it out from under the loop's select()
+        self.server.accepting = False
+        drain = threading.Thread(target=self.drain)
+        drain.daemon = True
+        drain.start()
+
+    def drain(self):
+        deadline = time.time() + self.graceful_timeout
+        while self.busy() and time.time() < deadline:
+            time.sleep(0.1)
+        # Raises KeyboardInterrupt in the main thread, which ends the server's loop
+        os.kill(os.getpid(), signal.SIGUSR1)
+
+    def serve(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGUSR1, signal.default_int_handler)
+        # Ctrl-C reaches the whole process group, but only the parent acts on it
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        log.info('Worker %d serving', os.getpid())
+        self.server.run()
+        # The loop has stopped, so the listening socket, the connections left and waitress's trigger can be closed
+        for channel in list(self.socket_map.values()):
+            channel.close()
+
+
+class Supervisor(object):
+    """
+    The parent process, which keeps the workers running
+    """
+
+    def __init__(self, load_app, sock, options):
+        """
+        :param load_app: Called in each worker to load the app, with whether that worker prunes sessions
+        :param sock: The listening socket
+        :param options: The options, as read_options gives them
+        """
+        self.load_app = load_app
+        self.sock = sock
+        self.options = options
+        self.workers = {}
+        self.maintenance_pid = None
+        self.stopping = False
+        self.failed = False
+
+    def takes_maintenance(self):
+        """
+        Whether the next worker should run the once-per-database maintenance jobs, which it does when no running
+        worker already is
+        """
+        return self.maintenance_pid not in self.workers
+
+    def spawn(self):
+        maintenance = self.takes_maintenance()
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            if maintenance:
+                self.maintenance_pid = pid
+            return pid
+        # In the worker, which leaves with SystemExit rather than returning, so the app's atexit handlers, like
+        # flushing buffered writes, run on the way out
+        try:
+            random.seed()
+            code = self.run_worker(maintenance)
+        except Exception:
+            log.exception('Worker %d failed', os.getpid())
+            code = 1
+        sys.exit(code)
+
+    def run_worker(self, maintenance):
+        """
+        Load the app and serve it until told to stop
+        :param maintenance: Whether this worker prunes sessions
+        :return: The worker's exit status
+        """
+        # The parent's handlers mustn't run in here before the worker sets its own
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        try:
+            app = self.load_app(maintenance)
+        except Exception:
+            log.exception('Worker %d could not load the app', os.getpid())
+            return BOOT_FAILED
+        options = self.options
+        max_requests = options['max_requests']
+        if max_requests and options['max_requests_jitter']:
+            max_requests += random.randint(0, options['max_requests_jitter'])
+        worker = Worker(app, self.sock, options['threads'], max_requests, options['max_rss_mb'],
+                        options['graceful_timeout'])
+        worker.serve()
+        return 0
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            started = self.workers.pop(pid, None)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            if code == BOOT_FAILED:
+                log.error('Worker %d could not load the app, stopping', pid)
+                self.failed = True
+                self.stopping = True
+            elif code and not self.stopping:
+                log.warning('Worker %d exited with %d after %.0fs', pid, code, time.time() - (started or 0))
+
+    def signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        log.info('Replacing %d workers', len(self.workers))
+        self.signal_workers(signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        log.info('Serving on %s:%s with %d workers of %d threads', self.options['host'], self.options['port'],
+                 self.options['workers'], self.options['threads'])
+        last_spawn = 0
+        while not self.stopping:
+            self.reap()
+            if self.stopping:
+                break
+            # Workers that keep dying come back at most once a second
+            if len(self.workers) < self.options['workers'] and time.time() - last_spawn >= 1:
+                while len(self.workers) < self.options['workers']:
+                    self.spawn()
+                last_spawn = time.time()
+            time.sleep(0.5)
+        self.shutdown()
+        return 1 if self.failed else 0
+
+    def shutdown(self):
+        """
+        Stop the workers, giving them graceful_timeout to finish, then a little longer before they are killed
+        """
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.time() + self.options['graceful_timeout'] + 5
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(signal.SIGKILL)
+        while self.workers:
+            self.reap()
+            time.sleep(0.1)
+
+
+def load_worker_app(config_uri, maintenance):
+    """
+    Load the app for a worker, passing whether it prunes sessions to main as a global option
+    """
+    return get_app(config_uri, options={MAINTENANCE_OPTION: 'true' if maintenance else 'false'})
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config_uri', help='the ini file, for example production.ini')
+    parser.add_argument('--workers', type=int, help='how many worker processes to run')
+    parser.add_argument('--max-requests', type=int, help='requests a worker serves before it is replaced')
+    parser.add_argument('--max-requests-jitter', type=int, help='up to how many more requests a worker serves')
+    parser.add_argument('--max-rss-mb', type=int, help='resident megabytes a worker grows to before it is replaced')
+    parser.add_argument('--graceful-timeout', type=int, help='seconds a stopping worker has to finish its requests')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    options = read_options(args.config_uri)
+    for name in ('workers', 'max_requests', 'max_requests_jitter', 'max_rss_mb', 'graceful_timeout'):
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    sock = listen(options['host'], options['port'])
+    supervisor = Supervisor(lambda maintenance: load_worker_app(args.config_uri, maintenance), sock, options)
+    sys.exit(supervisor.run())
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
-from db import User, Session
+import datetime
 
+from db import User, Session, is_postgresql, mark_changed, merge_row
+from db.replicas import use_primary
+
+from pyramid.settings import asbool
+from sqlalchemy import and_, select
 from sqlalchemy.orm import Session as dbSession
 
+from security.passwords import hasher_from_settings
+from security.token_cache import TokenCache
+from security.tokens import TOKEN_PREFIX, RevocationList, TokenSigner
+
+# How long a session can sit idle before its token stops authenticating
+SESSION_IDLE_LIMIT = datetime.timedelta(weeks=1)
+
+users_table = User.__table__
+sessions_table = Session.__table__
+
 def get_user_from_token(dbsession, token):
     """
     Get the associated user for a given token, if any
@@ -18,3 +33,250 @@ def get_user_from_token(dbsession, token):
         raise ValueError('dbsession should be a valid db session')
     user = dbsession.query(User).join(Session, Session.user_id == User.id).filter(Session.token == token).one_or_none()
     return user
+
+
+def user_from_principal(dbsession, principal):
+    """
+    Turn a cached principal back into a User attached to the given session, without going to the database
+    :param dbsession: The db session the user should belong to
+    :param principal: A dictionary of the user's column values, as stored in the TokenCache
+    :return: A persistent User model
+    """
+    return merge_row(dbsession, User, principal)
+
+
+def authenticate_token(dbsession, token, touch=True):
+    """
+    Validate a token and load its user in a single statement.  When touching on PostgreSQL, this is an
+    UPDATE ... FROM users ... RETURNING that also bumps the session's lastactive, otherwise it is a
+    plain SELECT that also returns lastactive so the caller can decide whether it needs bumping.  Other
+    databases can't return from an UPDATE, so touching there costs a second statement.
+    :param dbsession: The db session to execute with
+    :param token: A text based session token
+    :param touch: Whether to set the session's lastactive to now
+    :return: A tuple of a dictionary of the user's column values and the session's lastactive, or None
+    """
+    return _authenticate(dbsession, sessions_table.c.token == token, touch)
+
+
+def authenticate_session(dbsession, session_id, user_id, touch=True):
+    """
+    Like authenticate_token, for a signed token whose claims have already been verified, so that the session still
+    has to exist and not have sat idle for longer than SESSION_IDLE_LIMIT, whatever the token's own age
+    :param dbsession: The db session to execute with
+    :param session_id: The session id the token claims
+    :param user_id: The user id the token claims
+    :param touch: Whether to set the session's lastactive to now
+    :return: A tuple of a dictionary of the user's column values and the session's lastactive, or None
+    """
+    condition = and_(sessions_table.c.id == session_id, sessions_table.c.user_id == user_id)
+    return _authenticate(dbsession, condition, touch)
+
+
+def _authenticate(dbsession, condition, touch):
+    now = datetime.datetime.now()
+    cutoff = now - SESSION_IDLE_LIMIT
+    if touch and is_postgresql(dbsession):
+        stmt = sessions_table.update()\
+            .values(lastactive=now)\
+            .where(sessions_table.c.user_id == users_table.c.id)\
+            .where(condition)\
+            .where(sessions_table.c.lastactive >= cutoff)\
+            .returning(*users_table.c)
+        row = dbsession.execute(stmt).first()
+        if row is None:
+            return None
+        mark_changed(dbsession)
+        return dict((c.name, row[c.name]) for c in users_table.c), now
+
+    stmt = select(list(users_table.c) + [sessions_table.c.lastactive.label('session_lastactive')])\
+        .select_from(users_table.join(sessions_table, sessions_table.c.user_id == users_table.c.id))\
+        .where(condition)\
+        .where(sessions_table.c.lastactive >= cutoff)
+    row = dbsession.execute(stmt).first()
+    if row is None:
+        return None
+    principal = dict((c.name, row[c.name]) for c in users_table.c)
+    if not touch:
+        return principal, row['session_lastactive']
+    dbsession.execute(sessions_table.update().values(lastactive=now).where(condition))
+    mark_changed(dbsession)
+    return principal, now
+
+
+def authenticated_user(request):
+    """
+    This property will be added to the request as ``request.user``, and for now it simply verifies if they
+    are authenticated or not based on the token they provide.  If this fails, this property
+    is None
+    """
+    request_token = 'invalid_token'
+    if request.method == 'GET':
+        if request.GET.get('token') is None:
+            return None
+        else:
+            request_token = request.GET.get('token')
+    elif request.method in ['PUT', 'POST', 'DELETE']:
+        if 'token' not in request.json_body:
+            return None
+        else:
+            request_token = request.json_body.get('token')
+    if not isinstance(request_token, basestring):
+        return None
+
+    claims = None
+    signer = request.registry.get('token_signer')
+    if signer is not None and request_token.startswith(TOKEN_PREFIX + '.'):
+        # A forged, expired or revoked signed token is turned away without asking the database.  One that verifies
+        # still has its session checked for idleness, like any other token, unless the token cache has it
+        claims = signer.verify(request_token)
+        if claims is None:
+            return None
+        revocations = request.registry.get('token_revocations')
+        if revocations is not None and revocations.is_revoked(claims[1]):
+            return None
+
+    cache = request.registry.get('token_cache')
+    lastactive_buffer = request.registry.get('lastactive_buffer')
+    if cache is not None:
+        principal = cache.get(request_token)
+        if principal is not None:
+            if lastactive_buffer is not None:
+                lastactive_buffer.touch(request_token)
+            return user_from_principal(request.dbsession, principal)
+
+    if claims is not None:
+        return _user_from_claims(request, request_token, claims, cache, lastactive_buffer)
+
+    # With the write-behind buffer this is one SELECT, without it one UPDATE ... RETURNING on PostgreSQL
+    found = authenticate_token(request.dbsession, request_token, touch=lastactive_buffer is None)
+    if found is None and use_primary(request.dbsession):
+        # A token made moments ago may not have reached the replica yet
+        found = authenticate_token(request.dbsession, request_token, touch=lastactive_buffer is None)
+    if found is None:
+        return None
+    principal, lastactive = found
+    if lastactive_buffer is not None:
+        lastactive_buffer.touch(request_token, lastactive)
+    if cache is not None:
+        cache.put(request_token, principal['id'], principal)
+    return user_from_principal(request.dbsession, principal)
+
+
+def _user_from_claims(request, token, claims, cache, lastactive_buffer):
+    """
+    Load the user a verified signed token names, by the session's primary key, as long as the session hasn't been
+    idle for too long
+    """
+    user_id, session_id, issued = claims
+    found = authenticate_session(request.dbsession, session_id, user_id, touch=lastactive_buffer is None)
+    if found is None and use_primary(request.dbsession):
+        found = authenticate_session(request.dbsession, session_id, user_id, touch=lastactive_buffer is None)
+    if found is None:
+        return None
+    principal, lastactive = found
+    if lastactive_buffer is not None:
+        lastactive_buffer.touch(token, lastactive)
+    if cache is not None:
+        cache.put(token, user_id, principal)
+    return user_from_principal(request.dbsession, principal)
+
+
+def sign_session(request, session):
+    """
+    Replace a flushed session's token with a signed one issued now, if signed tokens are configured
+    :param request: The current request
+    :param session: A Session model that has been flushed, so it has an id
+    :return: The session's token
+    """
+    signer = request.registry.get('token_signer')
+    if signer is not None:
+        session.token = signer.sign(session.user_id, session.id)
+    return session.token
+
+
+def session_for_token(request, token):
+    """
+    Find the session a token belongs to.  A signed token is found by the session id it claims, since refreshing a
+    session replaces its signed token while the one before it stays good until it expires.
+    :param request: The current request
+    :param token: A session token of any format
+    :return: The Session model, or None
+    """
+    query = request.dbsession.query(Session)
+    signer = request.registry.get('token_signer')
+    claims = signer.verify(token) if signer is not None else None
+    if claims is not None:
+        return query.filter(Session.id == claims[1], Session.user_id == claims[0]).one_or_none()
+    return query.filter(Session.token == token).one_or_none()
+
+
+def invalidate_token(request, token):
+    """
+    Drop a token from the token cache and any pending activity writes, if we have them, and if it is a signed one
+    record its session as revoked, for every process, and revoke it here right away
+    """
+    signer = request.registry.get('token_signer')
+    claims = signer.verify(token) if signer is not None else None
+    if claims is not None:
+        RevocationList.record(request.dbsession, claims[1])
+        revocations = request.registry.get('token_revocations')
+        if revocations is not None:
+            revocations.deny(claims[1])
+    cache = request.registry.get('token_cache')
+    if cache is not None:
+        cache.invalidate(token)
+    lastactive_buffer = request.registry.get('lastactive_buffer')
+    if lastactive_buffer is not None:
+        lastactive_buffer.discard(token)
+
+
+def invalidate_user(request, user_id):
+    """
+    Drop every token for a user from the token cache, if we have one
+    """
+    cache = request.registry.get('token_cache')
+    if cache is not None:
+        cache.invalidate_user(user_id)
+
+
+def password_hasher(request):
+    """
+    The app's PasswordHasher, made from the settings the first time it is needed if includeme hasn't already
+    :param request: The current request
+    :return: A security.passwords.PasswordHasher
+    """
+    hasher = request.registry.get('password_hasher')
+    if hasher is None:
+        hasher = hasher_from_settings(request.registry.settings or {})
+        request.registry['password_hasher'] = hasher
+    return hasher
+
+
+def includeme(config):
+    """
+    Set up the password hasher, the authentication caches, and signed tokens if there is a secret for them, from the settings.
+
+    Activate this setup using ``config.include('security')``.
+    :param config: a pyramid config
+    """
+    settings = config.get_settings()
+    config.registry['password_hasher'] = hasher_from_settings(settings)
+
+    if asbool(settings.get('auth.token_cache.enabled', True)):
+        config.registry['token_cache'] = TokenCache(
+            max_size=int(settings.get('auth.token_cache.size', 10000)),
+            ttl=float(settings.get('auth.token_cache.ttl', 60)),
+        )
+
+    secret = settings.get('auth.token_secret')
+    if secret:
+        max_age = int(settings.get('auth.signed_tokens.max_age', 604800))
+        config.registry['token_signer'] = TokenSigner(secret, max_age=max_age)
+        revocations = RevocationList(
+            config.registry['dbengine'],
+            max_age=max_age,
+            refresh_interval=float(settings.get('auth.signed_tokens.revocation_refresh', 30)),
+        )
+        # Started, with its first read of revoked_sessions, by main once the app has configured successfully
+        config.registry['token_revocations'] = revocations
@@ -1,14 +1,52 @@
 # -*- coding: utf-8 -*-
-import base64
-
 from functools import wraps
-import hashlib
-import hmac
-from urllib import quote
-from db import User
+
 from pyramid.httpexceptions import HTTPForbidden
 
-# This is for a partial "roles" implementation that needs a lot of adjustment
+# Each role's bit in users.roles.  Add new roles with the next unused bit, and never reuse or move one, since the
+# bits are what is stored.
+ROLES = {
+    'MS_user': 1 << 0,
+    'MS_admin': 1 << 1,
+}
+
+
+def role_mask(roles):
+    """
+    Turn role names into the bitmask they are stored as
+    :param roles: A list of role names, or a comma separated string of them
+    :return: The bits of the roles ORed together, 0 for none
+    :raises ValueError: If a role isn't one of ROLES
+    """
+    if isinstance(roles, basestring):
+        roles = [role.strip() for role in roles.split(',') if role.strip()]
+    mask = 0
+    for role in roles:
+        if role not in ROLES:
+            raise ValueError('unknown role %r' % role)
+        mask |= ROLES[role]
+    return mask
+
+
+def role_names(mask):
+    """
+    The names of the roles in a bitmask, sorted
+    """
+    return sorted(name for name, bit in ROLES.items() if mask & bit)
+
+
+def user_roles(request):
+    """
+    This property will be added to the request as ``request.roles``, the bitmask of the authenticated user's roles,
+    which came with the user from the statement that checked their token, or 0 if there is no user.  Whatever
+    changes a user's roles should call security.invalidate_user, so cached copies of the user pick the change up.
+    """
+    user = request.user
+    if user is None:
+        return 0
+    return user.roles or 0
+
+
 class authorized_roles(object):
     """
     For passing roles into the decorator, and returning a forbidden if the user does not have
@@ -16,35 +54,25 @@ class authorized_roles(object):
     """
     def __init__(self, roles=None):
         """
-        Store the roles, or an empty list
+        Store the roles as a bitmask, so checking a request is a single AND
+        :param roles: A list of role names, a comma separated string of them, or None for any request
         """
-        if roles is None and not isinstance(roles, list):
-            if isinstance(roles, basestring):
-                roles = roles.split(',')
-            else:
-                roles = []
-        self.roles = roles
+        self.mask = role_mask(roles or [])
 
     def __call__(self, func):
         """
-        Returns a function that will only call the wrapped function if the user has an appropriate
-        role passed originally to the decorator call (or if None, simply calls the function), if
+        Returns a function that will only call the wrapped function if the user has any of the roles
+        passed originally to the decorator call (or if None, simply calls the function), if
         the role is missing, it returns an HTTP403Forbidden
         :param func: The function to wrap
         :return: The wrapped function
         """
+        mask = self.mask
+
         @wraps(func)
         def wrapped_func(request):
-            if isinstance(request.user, User):
-                user_roles = request.cust.roles.split(',')
-            else:
-                user_roles = None
-            if len(self.roles) == 0 or ((user_roles is not None) and request.cust.has_role(self.roles)):
-                return func(request)
-            else:
+            if mask and not request.roles & mask:
                 return HTTPForbidden()
-
+            return func(request)
 
         return wrapped_func
-
-
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Password hashing with a deliberately slow, tunable KDF, run on a small bounded pool of threads so that a burst of
+logins can only ever tie up a few of the server's worker threads.
+"""
+
+import binascii
+import hashlib
+import hmac
+import threading
+from multiprocessing.pool import ThreadPool
+
+from utilities import hash_password
+
+ALGORITHMS = {
+    'pbkdf2_sha256': 'sha256',
+    'pbkdf2_sha512': 'sha512',
+}
+
+# How long a request waits for its hash before giving up, which should never happen short of a wedged pool
+HASH_TIMEOUT = 30
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many requests are already hashing, so the caller should answer 503 rather than queue
+    """
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords with PBKDF2.  Hashes are stored as ``<algorithm>$<iterations>$<hex digest>``,
+    so the cost can be raised later and older hashes are still verifiable, and anything else in the password
+    column is taken to be a legacy single round SHA-512 digest from ``utilities.hash_password``.
+
+    With a pool_size the work runs on that many threads (hashlib releases the GIL while it works, so they really
+    do run in parallel), and at most max_pending requests may be hashing or waiting for a thread at once; any
+    more are refused with PasswordHasherBusy straight away.  A pool_size of 0 hashes inline in the caller.
+    """
+
+    def __init__(self, algorithm='pbkdf2_sha512', iterations=100000, pool_size=2, max_pending=2):
+        """
+        :param algorithm: One of ALGORITHMS
+        :param iterations: The PBKDF2 iteration count for new hashes
+        :param pool_size: How many threads hash at once, or 0 to hash in the calling thread
+        :param max_pending: How many callers may be hashing or waiting at once, which should stay below the
+        number of server threads
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unsupported password algorithm: %s' % algorithm)
+        self.algorithm = algorithm
+        self.iterations = iterations
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self._pool = ThreadPool(pool_size) if pool_size > 0 else None
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self.rejected = 0
+
+    def _derive(self, password, salt, algorithm, iterations):
+        return hashlib.pbkdf2_hmac(ALGORITHMS[algorithm], password.encode('utf-8'), salt, iterations)
+
+    def _run(self, func, *args):
+        if self._pool is None:
+            return func(*args)
+        if not self._slots.acquire(False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        try:
+            return self._pool.apply_async(func, args).get(HASH_TIMEOUT)
+        finally:
+            self._slots.release()
+
+    def _encode(self, password, salt):
+        digest = self._derive(password, salt, self.algorithm, self.iterations)
+        return b'%s$%d$%s' % (self.algorithm, self.iterations, binascii.b2a_hex(digest))
+
+    def _check(self, password, salt, stored):
+        stored = bytes(stored)
+        parts = stored.split(b'$')
+        if len(parts) == 3 and parts[0] in ALGORITHMS:
+            algorithm, iterations, digest = parts[0], int(parts[1]), binascii.a2b_hex(parts[2])
+            candidate = self._derive(password, salt, algorithm, iterations)
+            current = algorithm == self.algorithm and iterations == self.iterations
+        else:
+            digest, candidate, current = stored, hash_password(password, salt), False
+        if not hmac.compare_digest(candidate, digest):
+            return False, False
+        return True, not current
+
+    def hash(self, password, salt):
+        """
+        Hash a password with the current algorithm and cost
+        :param password: The password string
+        :param salt: The user's salt bytes
+        :return: The bytes to store in the password column
+        :raises PasswordHasherBusy: If the pool is full
+        """
+        return self._run(self._encode, password, salt)
+
+    def verify(self, password, salt, stored):
+        """
+        Check a password against what we have stored, in either format
+        :param password: The password string given
+        :param salt: The user's salt bytes
+        :param stored: The contents of the user's password column
+        :return: A tuple of (matches, needs_rehash), where needs_rehash means it matched but was stored with a
+        legacy format or an older cost, so should be replaced with a fresh hash
+        :raises PasswordHasherBusy: If the pool is full
+        """
+        return self._run(self._check, password, salt, stored)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+def hasher_from_settings(settings):
+    """
+    :param settings: The app settings
+    :return: A PasswordHasher configured from the auth.password.* settings
+    """
+    return PasswordHasher(
+        algorithm=settings.get('auth.password.algorithm', 'pbkdf2_sha512'),
+        iterations=int(settings.get('auth.password.iterations', 100000)),
+        pool_size=int(settings.get('auth.password.pool_size', 2)),
+        max_pending=int(settings.get('auth.password.max_pending', 2)),
+    )
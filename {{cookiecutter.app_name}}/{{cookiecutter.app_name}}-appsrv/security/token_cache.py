@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+An in-process cache of session token to principal, so that authenticated requests don't have to go to the
+database every time just to find out who they are.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache(object):
+    """
+    A bounded LRU cache with a TTL, keyed on session token.  The values are the column values of the User the
+    token belongs to, never the ORM object itself, as those are bound to the session of the request that loaded them.
+
+    This is per process, so invalidation only reaches the process it happens in.  The TTL is what bounds how stale
+    any other process can be, so keep it short.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.time):
+        """
+        :param max_size: The most tokens we will hold before evicting the least recently used
+        :param ttl: How many seconds an entry is good for after it is stored
+        :param clock: A callable returning the current time in seconds, replaceable for testing
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        """
+        Get the principal for a token, or None if we don't have a fresh one
+        :param token: A session token
+        :return: A dictionary of the user's column values, or None
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, user_id, principal = entry
+            if expires <= self.clock():
+                self._remove(token)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # Re-inserting moves it to the most recently used end
+            del self._entries[token]
+            self._entries[token] = entry
+            self.hits += 1
+            return principal
+
+    def put(self, token, user_id, principal):
+        """
+        Store the principal for a token, evicting the least recently used entries if we are full
+        :param token: A session token
+        :param user_id: The id of the user the token belongs to, so we can invalidate by user
+        :param principal: A dictionary of the user's column values
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (self.clock() + self.ttl, user_id, principal)
+            self._tokens_by_user.setdefault(user_id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, token):
+        """
+        Forget a single token, such as when the session is deleted
+        :param token: A session token
+        """
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id):
+        """
+        Forget every token belonging to a user, such as when their password or email changes
+        :param user_id: The id of the user
+        """
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        """
+        The counters for sizing the cache
+        :return: A dictionary of the current size and the hit, miss, eviction, expiration and invalidation counts
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, token):
+        """
+        Remove a token from both the entries and the user index, the lock must already be held
+        """
+        expires, user_id, principal = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
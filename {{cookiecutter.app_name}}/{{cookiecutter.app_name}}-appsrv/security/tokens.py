@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Signed session tokens, which carry the user id, session id and issue time so they can be verified without
+asking the database, plus the revocation list that makes deleting a session still mean something.
+"""
+
+import atexit
+import base64
+import datetime
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+from sqlalchemy import select
+
+from db import RevokedSession, mark_changed
+
+log = logging.getLogger(__name__)
+
+TOKEN_PREFIX = 's1'
+
+revoked_table = RevokedSession.__table__
+
+# Each refresh reads back this many seconds before the last one, for revocations that were recorded then but
+# hadn't committed yet
+REFRESH_OVERLAP = 60
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class TokenSigner(object):
+    """
+    Makes and verifies tokens of the form ``s1.<user_id>.<session_id>.<issued>.<signature>``, where the signature
+    is an HMAC-SHA256 over everything before it.  Anything else, such as the older uuid4 tokens, simply doesn't
+    verify, and should be looked up in the database as before.
+    """
+
+    def __init__(self, secret, max_age=604800, clock=time.time):
+        """
+        :param secret: The signing key, from the ini settings
+        :param max_age: How many seconds after issue a token stops being accepted
+        :param clock: A callable returning the current time in seconds, replaceable for testing
+        """
+        self.secret = _to_bytes(secret)
+        self.max_age = max_age
+        self.clock = clock
+
+    def _signature(self, payload):
+        digest = hmac.new(self.secret, _to_bytes(payload), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=')
+
+    def sign(self, user_id, session_id, issued=None):
+        """
+        Make a signed token
+        :param user_id: The id of the user the session belongs to
+        :param session_id: The id of the session
+        :param issued: The issue time in seconds, defaulting to now
+        :return: The token string
+        """
+        if issued is None:
+            issued = self.clock()
+        payload = '%s.%d.%d.%d' % (TOKEN_PREFIX, user_id, session_id, int(issued))
+        return '%s.%s' % (payload, self._signature(payload))
+
+    def verify(self, token):
+        """
+        Check a token's signature and age
+        :param token: A token string of any format
+        :return: A tuple of (user_id, session_id, issued) if it is a valid signed token, otherwise None
+        """
+        if not isinstance(token, basestring) or not token.startswith(TOKEN_PREFIX + '.'):
+            return None
+        payload, _, signature = token.rpartition('.')
+        if not hmac.compare_digest(_to_bytes(signature), self._signature(payload)):
+            return None
+        try:
+            user_id, session_id, issued = [int(x) for x in payload.split('.')[1:]]
+        except ValueError:
+            return None
+        if issued + self.max_age < self.clock():
+            return None
+        return user_id, session_id, issued
+
+
+class RevocationList(object):
+    """
+    The set of session ids whose signed tokens must no longer be accepted, kept in memory.
+
+    Ending a session before its tokens expire records it in revoked_sessions, in the same transaction, with
+    record().  Each refresh reads only the rows recorded since the last one, going back REFRESH_OVERLAP seconds
+    further so a revocation whose transaction committed late is still picked up, and forgets those older than a
+    token can live.  Anything revoked in this process is added immediately, anything revoked elsewhere shows up on
+    the next refresh.
+    """
+
+    def __init__(self, engine, max_age=604800, refresh_interval=30):
+        """
+        :param engine: The engine to read revoked_sessions with
+        :param max_age: How many seconds a signed token is good for, which bounds how long a revocation matters
+        :param refresh_interval: Seconds between refreshes from revoked_sessions
+        """
+        self.engine = engine
+        self.max_age = datetime.timedelta(seconds=max_age)
+        self.refresh_interval = refresh_interval
+        self._denied = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.read_until = None
+        self.refreshed = None
+
+    def is_revoked(self, session_id):
+        """
+        :param session_id: The id of the session a signed token claims
+        :return: True if that session is known to be gone
+        """
+        return session_id in self._denied
+
+    def deny(self, session_id):
+        """
+        Revoke a session in this process right away, rather than waiting for the next refresh
+        """
+        with self._lock:
+            self._denied[session_id] = datetime.datetime.now()
+
+    @staticmethod
+    def record(dbsession, session_id):
+        """
+        Record a session's revocation for every process, as part of the transaction that ends it
+        :param dbsession: The db session ending it
+        :param session_id: The session's id
+        """
+        dbsession.execute(revoked_table.insert().values(session_id=session_id, revoked=datetime.datetime.now()))
+        mark_changed(dbsession)
+
+    def refresh(self):
+        """
+        Add the revocations recorded since the last refresh, and drop those too old to matter
+        :return: The number of revoked session ids
+        """
+        now = datetime.datetime.now()
+        oldest = now - self.max_age
+        since = oldest if self.read_until is None else max(
+            oldest, self.read_until - datetime.timedelta(seconds=REFRESH_OVERLAP))
+        with self.engine.connect() as conn:
+            rows = conn.execute(select([revoked_table.c.session_id, revoked_table.c.revoked])
+                                .where(revoked_table.c.revoked >= since)).fetchall()
+        with self._lock:
+            denied = dict((k, v) for k, v in self._denied.items() if v >= oldest)
+            for session_id, revoked in rows:
+                denied[session_id] = max(revoked, denied.get(session_id, revoked))
+            self._denied = denied
+            self.read_until = now
+            self.refreshed = now
+        return len(denied)
+
+    def start(self):
+        """
+        Do the first refresh, and start refreshing in the background
+        """
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='token-revocations')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Failed refreshing revoked sessions, keeping the previous list')
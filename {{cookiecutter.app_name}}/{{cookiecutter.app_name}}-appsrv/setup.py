@@ -33,7 +33,7 @@ setup(name='{{cookiecutter.app_name}}Appsrv',
       author_email='{{cookiecutter.email}}',
       url='{{cookiecutter.website}}',
       keywords='web wsgi bfg pylons pyramid',
-      packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests"]),
+      packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests", "benchmarks", "benchmarks.*"]),
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
@@ -42,5 +42,7 @@ setup(name='{{cookiecutter.app_name}}Appsrv',
       main = {{cookiecutter.app_name}}Appsrv:main
       [console_scripts]
       initialize_pyra_db = {{cookiecutter.app_name}}Appsrv.scripts.initializedb:main
+      serve_prefork = {{cookiecutter.app_name}}Appsrv.scripts.prefork:main
+      build_static_assets = {{cookiecutter.app_name}}Appsrv.scripts.build_static:main
       """,
       )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Serving the front end's files from /static.
+
+scripts/build_static.py copies each file to a name with a hash of its content in it and records the pairs in
+manifest.json, so static_url can give the templates the fingerprinted names.  A fingerprinted file never changes,
+so it is sent to be cached for a year without asking again; any other file is sent with static.cache_control and
+revalidated by its ETag.  Where the build left gzip or brotli compressed copies next to a file, the one the client
+accepts is sent instead, and the response varies on Accept-Encoding.  Range and conditional requests are answered
+by webob from the ETag, Last-Modified and Content-Length.
+"""
+
+import json
+import mimetypes
+import os
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import FileResponse
+
+MANIFEST = 'manifest.json'
+
+# Best first, with the suffix of their compressed copies
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+SUFFIXES = dict(ENCODINGS)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def load_manifest(directory):
+    """
+    :return: The build's map of original names to fingerprinted ones, or an empty one if it hasn't been built
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+class StaticAssets(object):
+    """
+    A directory of static files, and a view serving them
+    """
+
+    def __init__(self, directory, manifest=None, cache_control='no-cache'):
+        """
+        :param directory: The directory the files are in
+        :param manifest: The map of original names to fingerprinted ones, relative to directory and with forward
+            slashes
+        :param cache_control: The Cache-Control for files that aren't fingerprinted
+        """
+        self.directory = os.path.abspath(directory)
+        self.manifest = manifest or {}
+        self.fingerprinted = frozenset(self.manifest.values())
+        self.cache_control = cache_control
+
+    def name_for(self, name):
+        """
+        The name a file is served under, its fingerprinted one if it has one
+        """
+        return self.manifest.get(name, name)
+
+    def path_for(self, subpath):
+        """
+        The file a request's subpath names, or None if it isn't one inside the directory
+        """
+        for part in subpath:
+            if part in ('', '.', '..') or '/' in part or '\\' in part or '\0' in part:
+                return None
+        path = os.path.join(self.directory, *subpath)
+        return path if os.path.isfile(path) else None
+
+    def __call__(self, request):
+        requested = '/'.join(request.matchdict.get('subpath', ()))
+        served = self.name_for(requested)
+        path = self.path_for(served.split('/'))
+        if path is None:
+            return HTTPNotFound()
+
+        sent, encoding = path, None
+        # Without an Accept-Encoding header anything is acceptable, but some clients can't decode everything
+        if 'Accept-Encoding' in request.headers:
+            for accepted, quality in request.accept_encoding.acceptable_offers([e for e, suffix in ENCODINGS]):
+                if os.path.isfile(path + SUFFIXES[accepted]):
+                    sent, encoding = path + SUFFIXES[accepted], accepted
+                    break
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response = FileResponse(sent, request=request, content_type=content_type, content_encoding=encoding)
+        stat = os.stat(sent)
+        response.etag = '%x-%x' % (int(stat.st_mtime), stat.st_size)
+        response.vary = ('Accept-Encoding',)
+        # An original name still works, but what it gives changes with each build
+        immutable = served == requested and served in self.fingerprinted
+        response.headers['Cache-Control'] = IMMUTABLE if immutable else self.cache_control
+        return response
+
+
+def static_url(request, name):
+    """
+    The url of a static file, by the name it was built from, for the templates
+    :param request: The current request
+    :param name: The file's path under the static directory, with forward slashes
+    """
+    assets = request.registry.get('static_assets')
+    if assets is not None:
+        name = assets.name_for(name)
+    return request.route_path('static', subpath=name.split('/'))
+
+
+def includeme(config):
+    """
+    Serve static.directory at /static, with the manifest the build left there.
+
+    Activate this setup using ``config.include('static_assets')``.
+    :param config: a pyramid config
+    """
+    settings = config.get_settings()
+    directory = settings.get('static.directory', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    assets = StaticAssets(directory, load_manifest(directory), settings.get('static.cache_control', 'no-cache'))
+    config.registry['static_assets'] = assets
+    config.add_route('static', '/static/*subpath')
+    config.add_view(assets, route_name='static', request_method=('GET', 'HEAD'))
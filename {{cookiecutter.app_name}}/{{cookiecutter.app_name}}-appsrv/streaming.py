@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming JSON responses, for views that return more rows than we want to hold in memory at once.
+"""
+
+import json
+import logging
+
+from pyramid.interfaces import IRendererFactory
+from pyramid.renderers import JSON
+from pyramid.response import Response
+from sqlalchemy.orm import Query
+
+from db.converters import dispatching_serializer, iter_dicts_from_rows
+from db.replicas import read_from_replica
+from renderers import FastJSON
+
+log = logging.getLogger(__name__)
+
+
+def _encoder(request):
+    """
+    A JSONEncoder that writes values the same way the app's json renderer does
+    """
+    renderer = request.registry.queryUtility(IRendererFactory, name='json')
+    if not isinstance(renderer, JSON):
+        renderer = FastJSON()
+    return json.JSONEncoder(default=renderer._make_default(request), **renderer.kw)
+
+
+def _bytes(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def _rows(dbsession, query, chunk_size, remove_fields, sub_values):
+    """
+    Run the query on dbsession a chunk at a time with a server-side cursor where the database has them, and
+    yield each row as a dict
+    """
+    if isinstance(query, Query):
+        query = query.with_session(dbsession).yield_per(chunk_size)
+        descriptions = query.column_descriptions
+        if len(descriptions) == 1 and descriptions[0]['expr'] is descriptions[0]['entity']:
+            serialize = dispatching_serializer(remove_fields, sub_values)
+            # What the session held before we started, such as the request's user, stays attached
+            kept = set(dbsession.identity_map.values())
+            for count, row in enumerate(query, 1):
+                yield serialize(row)
+                if count % chunk_size == 0:
+                    # Written out already, so there's no reason for the session to keep what we loaded
+                    for instance in list(dbsession.identity_map.values()):
+                        if instance not in kept:
+                            dbsession.expunge(instance)
+            return
+        rows = query
+    else:
+        rows = dbsession.execute(query.execution_options(stream_results=True))
+    for row in iter_dicts_from_rows(rows, remove_fields):
+        yield row
+
+
+def stream_json(request, query, remove_fields=None, sub_values=None, chunk_size=1000, dbsession=None):
+    """
+    Make a response that writes a query's rows as the usual ``{"d": [...]}`` JSON, a chunk of rows at a time, so
+    memory use stays flat however many rows there are.  The output is the same as rendering the whole list with
+    the json renderer.
+
+    The body is written after the view returns, when the request's own db session has been committed and closed,
+    so the rows are read with a new session from the registry's session factory, which is closed at the end.  That
+    session reads from a replica if request.dbsession would have.
+    :param request: The current request
+    :param query: An ORM Query, for models or for columns, or a Core select()
+    :param remove_fields: A list of fields, by string or sqlalchemy object attribute, to leave out of each row
+    :param sub_values: For model queries, a list of fields to be further loaded into each row
+    :param chunk_size: How many rows to fetch, and write, at a time
+    :param dbsession: A session to read with instead of a new one, which is left open; not request.dbsession
+    :return: A Response
+    """
+    encoder = _encoder(request)
+    session_factory = request.registry.get('dbsession_factory') if dbsession is None else None
+    router = request.registry.get('replica_router')
+    replica = dbsession is None and router is not None and router.reads_from_replica(request)
+
+    def body():
+        session = dbsession if dbsession is not None else session_factory()
+        if replica:
+            read_from_replica(session)
+        try:
+            yield _bytes('{' + encoder.encode('d') + encoder.key_separator + '[')
+            separator = ''
+            chunk = []
+            for row in _rows(session, query, chunk_size, remove_fields, sub_values):
+                chunk.append(encoder.encode(row))
+                if len(chunk) >= chunk_size:
+                    yield _bytes(separator + encoder.item_separator.join(chunk))
+                    separator = encoder.item_separator
+                    chunk = []
+            if chunk:
+                yield _bytes(separator + encoder.item_separator.join(chunk))
+            yield b']}'
+        except Exception:
+            # The headers have gone out already, so all we can do is cut the response short
+            log.exception('Failed streaming %s', request.path)
+            raise
+        finally:
+            if dbsession is None:
+                session.close()
+
+    return Response(app_iter=body(), content_type='application/json')
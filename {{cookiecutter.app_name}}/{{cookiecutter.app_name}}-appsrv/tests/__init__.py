@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
+import os
+from contextlib import contextmanager
 
 from unittest import TestCase
 from datetime import datetime
 from pyramid import testing
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
 
 from datautils import DataUtils
+from db import enable_sqlite_savepoints, metadata
+from db.stats import collect, track_engine
 
 def get_type_array():
     """
@@ -33,6 +38,39 @@ bad_data_typevals_list = [
 engine = None
 Session = None
 
+# Tests run against an in-memory SQLite database by default, one per test process, so they need no server and
+# can run in parallel.  Set TEST_DB_URL to run them against a real database instead, for example
+# TEST_DB_URL=postgresql+psycopg2://dbuser@127.0.0.1:5432/{{cookiecutter.testdbname}}
+# which is expected to have the schema already.
+default_db_url = 'sqlite://'
+
+
+def sqlalchemy_engine(uri):
+    """
+    Create the engine for the test database, making an in-memory SQLite one behave: a single shared connection
+    so every session sees the same database, the schema created, and SAVEPOINTs that actually work.
+    :param uri: A sqlalchemy url
+    :return: An engine
+    """
+    if not uri.startswith('sqlite'):
+        test_engine = create_engine(uri)
+        track_engine(test_engine)
+        return test_engine
+    test_engine = create_engine(uri, connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    enable_sqlite_savepoints(test_engine)
+    metadata.create_all(test_engine)
+    track_engine(test_engine)
+    return test_engine
+
+
+def throwaway_engine():
+    """
+    A new, empty in-memory SQLite database, for tests that commit or write from other threads and so can't use the
+    shared test database and its rolled back transactions.  Its one connection is shared by every thread.
+    :return: An engine, with no tables created
+    """
+    return create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
 
 class MyTestBase(TestCase):
     """
@@ -45,12 +83,10 @@ class MyTestBase(TestCase):
     def setUpClass(cls):
         global engine
         global Session
-        dbport = '5432'
-        dbname = '{{cookiecutter.testdbname}}'
-        uri = 'postgresql+psycopg2://dbuser@127.0.0.1:%s/%s' % (dbport, dbname)
+        uri = os.environ.get('TEST_DB_URL', default_db_url)
         cls.db_url = uri
         if engine is None:
-            engine = create_engine(uri)
+            engine = sqlalchemy_engine(uri)
             Session = scoped_session(sessionmaker(bind=engine))
         cls.factory_sessions = Session
         cls.class_session = Session()
@@ -67,6 +103,8 @@ class MyTestBase(TestCase):
 
     def tearDown(self):
         self.session.rollback()
+        # Objects loaded during the test outlive its rollback, and SQLite hands their ids out again
+        self.session.expunge_all()
 
     def create_customer(self, extra_data=None):
         """
@@ -84,7 +122,12 @@ class MyPyramidTestBase(MyTestBase):
 
     def setUp(self):
         MyTestBase.setUp(self)
-        self.config = testing.setUp()
+        # A cheap KDF hashed inline keeps the tests quick and free of background threads
+        self.config = testing.setUp(settings={
+            'email.check_deliverability': 'false',
+            'auth.password.iterations': '1000',
+            'auth.password.pool_size': '0',
+        })
         self.config.include('pyramid_jinja2')
         self.request = testing.DummyRequest()
         self.request.dbsession = self.session
@@ -93,3 +136,16 @@ class MyPyramidTestBase(MyTestBase):
         testing.tearDown()
         MyTestBase.tearDown(self)
 
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """
+        Fail if the block runs more than limit SQL statements, to hold a view to its query budget
+        :param limit: The most statements allowed
+        """
+        # Issue the test's own SAVEPOINT now, so it isn't counted against the block
+        self.session.connection()
+        with collect() as stats:
+            yield stats
+        if stats.count > limit:
+            self.fail('%d statements run, expected at most %d:\n%s' % (stats.count, limit, '\n'.join(stats.statements)))
+
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from pyramid import testing
+from sqlalchemy import event
+
+import db
+from db import Session, User
+from db.activity import LastActiveBuffer
+from tests import throwaway_engine
+
+
+class FakeClock(object):
+    """
+    A clock we can move by hand
+    """
+    def __init__(self):
+        self.now = datetime(2018, 1, 1, 12, 0, 0)
+
+    def __call__(self):
+        return self.now
+
+
+class LastActiveBufferTests(TestCase):
+    """
+    Tests for the LastActiveBuffer, against its own throwaway database since it writes outside of any test transaction
+    """
+    def setUp(self):
+        self.engine = throwaway_engine()
+        User.__table__.create(self.engine)
+        Session.__table__.create(self.engine)
+        self.long_ago = datetime(2017, 1, 1)
+        self.engine.execute(User.__table__.insert(), id=1, username='u', email='e', password='p', salt='s')
+        self.engine.execute(Session.__table__.insert(), [
+            {'id': i, 'user_id': 1, 'token': 't%d' % i, 'started': self.long_ago, 'lastactive': self.long_ago}
+            for i in range(1, 6)])
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        self.clock = FakeClock()
+        self.buffer = LastActiveBuffer(self.engine, flush_size=3, min_interval=60, clock=self.clock)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def lastactive(self, token):
+        return self.engine.execute(Session.__table__.select().where(Session.__table__.c.token == token)).first().lastactive
+
+    def test_touch_does_not_write(self):
+        """
+        Touching only remembers, nothing goes to the database until a flush
+        """
+        self.buffer.touch('t1')
+        self.buffer.touch('t2')
+        self.assertEqual(self.statements, [])
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(self.lastactive('t1'), self.clock.now)
+        self.assertEqual(self.lastactive('t2'), self.clock.now)
+        self.assertEqual(self.lastactive('t3'), self.long_ago)
+
+    def test_recent_touch_skipped(self):
+        """
+        A token already written within min_interval is not queued again, but is once it has passed
+        """
+        self.buffer.touch('t1')
+        self.buffer.flush()
+        self.clock.now += timedelta(seconds=30)
+        self.buffer.touch('t1')
+        self.assertEqual(self.buffer.flush(), 0)
+        self.clock.now += timedelta(seconds=31)
+        self.buffer.touch('t1')
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.lastactive('t1'), self.clock.now)
+
+    def test_known_lastactive_skipped(self):
+        """
+        If the caller already knows the database is recent enough, don't queue it
+        """
+        self.buffer.touch('t1', self.clock.now - timedelta(seconds=5))
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+        self.assertEqual(self.buffer.stats()['skipped'], 1)
+
+    def test_full_buffer_flushes(self):
+        """
+        With no background thread, filling the buffer flushes it
+        """
+        for token in ['t1', 't2', 't3']:
+            self.buffer.touch(token)
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+    def test_discard(self):
+        """
+        A discarded token isn't written
+        """
+        self.buffer.touch('t1')
+        self.buffer.discard('t1')
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_stop_flushes(self):
+        """
+        Stopping writes whatever is left
+        """
+        self.buffer.start()
+        self.buffer.touch('t4')
+        self.buffer.stop()
+        self.assertEqual(self.lastactive('t4'), self.clock.now)
+
+
+class IncludemeTests(TestCase):
+    """
+    Tests for how includeme sets the buffer up
+    """
+    def test_not_started(self):
+        """
+        The buffer's thread is left for main to start, once the whole app has configured
+        """
+        config = testing.setUp(settings={'sqlalchemy.url': 'sqlite://'})
+        try:
+            db.includeme(config)
+            self.assertIsNone(config.registry['lastactive_buffer']._thread)
+        finally:
+            testing.tearDown()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPForbidden
+
+from security import authenticated_user
+from security.authorize import ROLES, authorized_roles, role_mask, role_names, user_roles
+from tests import MyPyramidTestBase
+
+
+def ok_view(request):
+    return {'ok': True}
+
+
+class RoleMaskTests(TestCase):
+    """
+    Tests for turning role names into bitmasks and back
+    """
+    def test_role_mask(self):
+        """
+        Lists and comma separated strings give the same mask, and nothing gives 0
+        """
+        both = ROLES['MS_user'] | ROLES['MS_admin']
+        self.assertEqual(role_mask(['MS_user', 'MS_admin']), both)
+        self.assertEqual(role_mask('MS_user, MS_admin'), both)
+        self.assertEqual(role_mask('MS_admin'), ROLES['MS_admin'])
+        self.assertEqual(role_mask([]), 0)
+        self.assertEqual(role_mask(''), 0)
+
+    def test_unknown_role(self):
+        """
+        An unknown role is an error as soon as the decorator is made
+        """
+        with self.assertRaises(ValueError):
+            role_mask(['MS_user', 'NonexistentRole'])
+        with self.assertRaises(ValueError):
+            authorized_roles(['NonexistentRole'])
+
+    def test_role_names(self):
+        """
+        A mask gives back the names of its roles, ignoring unknown bits
+        """
+        self.assertEqual(role_names(role_mask('MS_admin,MS_user') | 1 << 40), ['MS_admin', 'MS_user'])
+        self.assertEqual(role_names(0), [])
+
+
+class AuthorizedRolesTests(TestCase):
+    """
+    Tests for the authorized_roles decorator
+    """
+    def request(self, roles):
+        return testing.DummyRequest(roles=roles)
+
+    def test_no_roles(self):
+        """
+        Without roles the view is called for anyone
+        """
+        self.assertEqual(authorized_roles()(ok_view)(self.request(0)), {'ok': True})
+
+    def test_roles(self):
+        """
+        The view is called if the user has any of the roles, and otherwise it is forbidden
+        """
+        view = authorized_roles(['MS_user', 'MS_admin'])(ok_view)
+        self.assertEqual(view(self.request(ROLES['MS_user'])), {'ok': True})
+        self.assertEqual(view(self.request(ROLES['MS_admin'])), {'ok': True})
+        self.assertIsInstance(view(self.request(0)), HTTPForbidden)
+        admin_view = authorized_roles('MS_admin')(ok_view)
+        self.assertIsInstance(admin_view(self.request(ROLES['MS_user'])), HTTPForbidden)
+        self.assertEqual(admin_view.__name__, 'ok_view')
+
+
+class UserRolesTests(MyPyramidTestBase):
+    """
+    Tests for the request.roles property
+    """
+    def test_anonymous(self):
+        """
+        Without a user there are no roles
+        """
+        self.request.user = None
+        self.assertEqual(user_roles(self.request), 0)
+
+    def test_loaded_with_user(self):
+        """
+        The roles come with the user when the token is authenticated, and new users have none
+        """
+        admin = self.datautils.create_user({'roles': ROLES['MS_admin']})
+        self.request.GET['token'] = str(self.datautils.create_session({'user_id': admin.id}).token)
+        self.session.expire_all()
+        self.request.user = authenticated_user(self.request)
+        self.assertEqual(user_roles(self.request), ROLES['MS_admin'])
+
+        self.request.user = self.datautils.create_user()
+        self.assertEqual(user_roles(self.request), 0)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from pyramid import testing
+from webob import Request
+
+from views.base_views import app_base, warm_templates
+
+
+class AppBaseTests(TestCase):
+    """
+    Tests for rendering, caching and revalidating the app shell
+    """
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'some_key': 'this_is_a_key',
+            'app_shell.cache_control': 'private, max-age=60',
+        })
+        self.config.include('pyramid_jinja2')
+        self.config.include('static_assets')
+        self.config.commit()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def get(self, host='app.example.com', remote_addr='203.0.113.9'):
+        request = testing.DummyRequest(host=host, remote_addr=remote_addr)
+        return app_base(request)
+
+    def test_render(self):
+        """
+        The shell is HTML with the settings in it, an ETag and the configured Cache-Control
+        """
+        response = self.get()
+        self.assertEqual(response.content_type, 'text/html')
+        self.assertIn(b"var some_key = 'this_is_a_key';", response.body)
+        self.assertEqual(len(response.etag), 40)
+        self.assertEqual(response.headers['Cache-Control'], 'private, max-age=60')
+        self.assertIn(b'<script src="/static/build/app/js/app.min.js">', response.body)
+
+    def test_variants(self):
+        """
+        The development and public shells differ, and each keeps its ETag
+        """
+        public, dev = self.get(), self.get('localhost:6543', '127.0.0.1')
+        self.assertNotEqual(public.etag, dev.etag)
+        self.assertNotEqual(public.body, dev.body)
+        self.assertEqual(self.get().etag, public.etag)
+        self.assertEqual(self.get('localhost:6543', '127.0.0.1').etag, dev.etag)
+
+    def test_not_modified(self):
+        """
+        A request with the shell's ETag gets a 304 without the body, and one with another gets the shell
+        """
+        response = self.get()
+        revalidated = Request.blank('/app', headers={'If-None-Match': '"%s"' % response.etag}).get_response(response)
+        self.assertEqual(revalidated.status_int, 304)
+        self.assertEqual(revalidated.body, b'')
+        changed = Request.blank('/app', headers={'If-None-Match': '"stale"'}).get_response(self.get())
+        self.assertEqual(changed.status_int, 200)
+        self.assertEqual(changed.body, response.body)
+
+    def test_warm(self):
+        """
+        Warming renders both shells into the cache, which is then used
+        """
+        warm_templates(self.config)
+        shells = self.config.registry['app_shells']
+        self.assertEqual(sorted(shells), [False, True])
+        shells[False] = (b'cached', 'e' * 40)
+        self.assertEqual(self.get().body, b'cached')
+
+    def test_reload_templates(self):
+        """
+        Nothing is cached while templates are reloading
+        """
+        self.config.registry.settings['pyramid.reload_templates'] = 'true'
+        warm_templates(self.config)
+        self.assertNotIn('app_shells', self.config.registry)
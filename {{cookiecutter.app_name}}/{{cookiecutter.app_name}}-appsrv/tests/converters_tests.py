@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from db import Session, User
+from db.converters import (
+    array_of_dicts_from_array_of_models,
+    array_of_dicts_from_map,
+    array_of_dicts_from_rows,
+    columns_from_rows,
+    dict_from_row,
+    serializer_for,
+)
+from tests import MyTestBase
+
+
+class SerializerTests(TestCase):
+    """
+    Tests for the compiled serializers behind dict_from_row
+    """
+    def setUp(self):
+        self.user = User(id=1, username='user', email='user@example.com', password=b'p', salt=b's',
+                         created=datetime(2018, 1, 1), origin=None, lockmessage=None)
+        self.session = Session(id=2, user_id=1, token='token', started=datetime(2018, 1, 1),
+                               lastactive=datetime(2018, 1, 2))
+
+    def test_all_columns(self):
+        """
+        Every column comes out, None included
+        """
+        self.assertEqual(dict_from_row(self.session), {
+            'id': 2, 'user_id': 1, 'token': 'token',
+            'started': datetime(2018, 1, 1), 'lastactive': datetime(2018, 1, 2),
+        })
+        self.assertIsNone(dict_from_row(self.user)['origin'])
+
+    def test_remove_fields(self):
+        """
+        Fields can be removed by name, by a single name, or by column
+        """
+        expected = set(['id', 'username', 'email', 'created', 'origin', 'lockmessage', 'roles'])
+        self.assertEqual(set(dict_from_row(self.user, ['password', 'salt'])), expected)
+        self.assertEqual(set(dict_from_row(self.user, [User.password, User.__table__.c.salt])), expected)
+        self.assertEqual(set(dict_from_row(self.user, 'password')), expected | set(['salt']))
+
+    def test_compiled_once(self):
+        """
+        The same model and options get the same serializer back
+        """
+        self.assertIs(serializer_for(User, ['password', 'salt']), serializer_for(User, ['password', 'salt']))
+        self.assertIsNot(serializer_for(User, ['password']), serializer_for(User, ['password', 'salt']))
+
+    def test_sub_values(self):
+        """
+        Listed relations are serialized too, with the same removals
+        """
+        self.user.sessions = [self.session]
+        result = dict_from_row(self.user, remove_fields=['password', 'salt', 'token'], sub_values=['sessions'])
+        self.assertNotIn('password', result)
+        self.assertEqual(result['sessions'], [{
+            'id': 2, 'user_id': 1, 'started': datetime(2018, 1, 1), 'lastactive': datetime(2018, 1, 2),
+        }])
+
+    def test_mixed_models(self):
+        """
+        A list of different models gets each serialized as its own class
+        """
+        result = array_of_dicts_from_array_of_models([self.user, self.session, self.user], remove_fields=['id'])
+        self.assertEqual(result, [dict_from_row(self.user, ['id']), dict_from_row(self.session, ['id']),
+                                  dict_from_row(self.user, ['id'])])
+        self.assertNotIn('id', result[1])
+
+
+class ExpiredRowTests(MyTestBase):
+    """
+    Serializing rows whose attributes aren't loaded yet
+    """
+    def test_expired(self):
+        """
+        Expired attributes are loaded rather than missed
+        """
+        user = self.datautils.create_user()
+        expected = dict_from_row(user)
+        self.session.expire(user)
+        self.assertNotIn('username', user.__dict__)
+        self.assertEqual(dict_from_row(user), expected)
+
+
+class RowTests(MyTestBase):
+    """
+    Tests for converting plain result rows, without ORM instances
+    """
+    def setUp(self):
+        MyTestBase.setUp(self)
+        self.users = [self.datautils.create_user() for _ in range(3)]
+        self.users_table = User.__table__
+
+    def test_core_select(self):
+        """
+        Rows from a Core select come out as the same dictionaries the models would
+        """
+        result = self.session.execute(select([self.users_table]).order_by(self.users_table.c.id))
+        self.assertEqual(array_of_dicts_from_rows(result, remove_fields=['password', 'salt']),
+                         [dict_from_row(u, ['password', 'salt']) for u in self.users])
+
+    def test_with_entities(self):
+        """
+        Rows from query(...).with_entities(...) work too, and keep their column order
+        """
+        rows = self.session.query(User).with_entities(User.id, User.username).order_by(User.id)
+        self.assertEqual(array_of_dicts_from_rows(rows, remove_fields=[User.id]),
+                         [{'username': u.username} for u in self.users])
+
+    def test_columns(self):
+        """
+        Column arrays have one list per column, in row order, with renames applied
+        """
+        rows = self.session.query(User.id, User.username, User.email).order_by(User.id)
+        result = columns_from_rows(rows, remove_fields=['email'], renames={'username': 'name'})
+        self.assertEqual(result, {'id': [u.id for u in self.users], 'name': [u.username for u in self.users]})
+
+    def test_empty(self):
+        """
+        No rows is no dictionaries, or empty columns when the result knows its keys
+        """
+        result = self.session.execute(select([self.users_table.c.id]).where(self.users_table.c.id < 0))
+        self.assertEqual(columns_from_rows(result), {'id': []})
+        self.assertEqual(array_of_dicts_from_rows([]), [])
+
+    def test_map(self):
+        """
+        array_of_dicts_from_map serializes the models in a map and passes anything else through
+        """
+        result = array_of_dicts_from_map({'a': self.users[0], 'b': 3}, remove_fields=['password', 'salt'])
+        self.assertEqual(sorted(result, key=lambda x: isinstance(x, dict)),
+                         [3, dict_from_row(self.users[0], ['password', 'salt'])])
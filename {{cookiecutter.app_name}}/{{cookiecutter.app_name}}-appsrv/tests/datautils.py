@@ -1,19 +1,37 @@
 # -*- coding: utf-8 -*-
 import hashlib
+import itertools
 from copy import deepcopy
 from uuid import uuid4
 from random import randint
 
 from datetime import datetime
-from sqlalchemy import func
+
+from sqlalchemy import func, select
 
 from db import (
     User,
     Session,
+    is_postgresql,
+    merge_row,
 )
 from db.converters import sqlobj_from_dict
 
 
+# Ids come from the database on insert, so generated values need their own sequence to stay unique
+generated_numbers = itertools.count(1)
+
+
+def hash_generated(text, salt=b''):
+    """
+    The SHA-512 digest create_user stores for a salt or password given as a string
+    """
+    m = hashlib.sha512()
+    m.update(text.encode('utf-8'))
+    m.update(salt)
+    return m.digest()
+
+
 def random_with_n_digits(n):
     range_start = 10**(n-1)
     range_end = (10**n)-1
@@ -53,16 +71,15 @@ class DataUtils(object):
             spec_data = {}
         sqlobj_from_dict(u, spec_data)
 
-        if u.id is None:
-            u.id = self.session.query(func.nextval('users_id_seq')).scalar()
+        number = next(generated_numbers)
         if u.username is None:
-            u.username = 'generated%d' % u.id
+            u.username = 'generated%d' % number
         if u.email is None:
-            u.email = 'Test%d@example.com' % u.id
+            u.email = 'Test%d@example.com' % number
         if u.salt is None:
-            u.salt = 'generated_salt%d' % u.id
+            u.salt = 'generated_salt%d' % number
         if u.password is None:
-            u.password = 'generated_pass%d' % u.id
+            u.password = 'generated_pass%d' % number
 
         if isinstance(u.salt, basestring):
             s = hashlib.sha512()
@@ -96,7 +113,7 @@ class DataUtils(object):
         if s.user_id is None:
             s.user_id = self.create_user(spec_data).id
         if s.token is None:
-            s.token = uuid4()
+            s.token = str(uuid4())
 
         self.session.add(s)
         self.session.flush()
@@ -105,4 +122,110 @@ class DataUtils(object):
             return s
         return s.id
 
- 
\ No newline at end of file
+    def allocate_ids(self, model, count):
+        """
+        Reserve primary keys for count new rows of a model with one query
+        :param model: The model class
+        :param count: How many ids are needed
+        :return: A list of the ids
+        """
+        table = model.__table__
+        if is_postgresql(self.session):
+            nextval = func.nextval('%s_id_seq' % table.name)
+            return [row[0] for row in self.session.execute(select([nextval]).select_from(func.generate_series(1, count)))]
+        # SQLite gives new rows one past the highest id, so the next count of those are ours
+        highest = self.session.execute(select([func.max(table.c.id)])).scalar() or 0
+        return list(range(highest + 1, highest + count + 1))
+
+    def insert_rows(self, model, rows):
+        """
+        Insert rows, which all have the same keys, with a multi-row INSERT
+        :param model: The model class
+        :param rows: A list of dictionaries of column values
+        """
+        table = model.__table__
+        # One statement on PostgreSQL, as many as older SQLite's limit of 999 variables a statement needs elsewhere
+        per_statement = len(rows) if is_postgresql(self.session) else max(1, 999 // len(table.columns))
+        for start in range(0, len(rows), per_statement):
+            self.session.execute(table.insert().values(rows[start:start + per_statement]))
+
+    def _bulk_rows(self, model, count, spec_data, defaults, prepare=None):
+        """
+        Column values for count new rows, each the defaults made for it overridden by its spec_data
+        """
+        if spec_data is None:
+            spec_data = {}
+        if isinstance(spec_data, dict):
+            spec_data = [spec_data] * count
+        if len(spec_data) != count:
+            raise ValueError('spec_data has %d entries for %d rows' % (len(spec_data), count))
+        rows = []
+        for row_id, spec in zip(self.allocate_ids(model, count), spec_data):
+            row = defaults()
+            row['id'] = row_id
+            row.update((c.name, spec[c.name]) for c in model.__table__.columns if c.name in spec)
+            if prepare is not None:
+                prepare(row, spec)
+            rows.append(row)
+        return rows
+
+    def create_users(self, count, spec_data=None, return_objects=True):
+        """
+        Make count users at once, with one query for their ids and one multi-row INSERT, rather than the several
+        statements each create_user costs.  They're the users create_user would make, except that the generated
+        ones all share a salt and password, hashed once, and created is set here rather than by the database.
+        :param count: How many users to make
+        :param spec_data: A dictionary of values for every user, or a list of count dictionaries, one per user
+        :param return_objects: Whether to return the objects, which are attached without loading them, or just ids
+        :return: A list of user db models, or of their ids
+        """
+        salt = hash_generated('generated_salt')
+        password = hash_generated('generated_pass', salt)
+        created = datetime.now()
+
+        def defaults():
+            number = next(generated_numbers)
+            return {'username': 'generated%d' % number, 'email': 'Test%d@example.com' % number, 'salt': salt,
+                    'password': password, 'created': created, 'origin': None, 'lockmessage': None}
+
+        # Strings given for a salt or password are hashed, as create_user does, once for each distinct value
+        hashed = {}
+
+        def digest(text, salt=b''):
+            if (text, salt) not in hashed:
+                hashed[text, salt] = hash_generated(text, salt)
+            return hashed[text, salt]
+
+        def prepare(row, spec):
+            if isinstance(spec.get('salt'), basestring):
+                row['salt'] = digest(spec['salt'])
+            if isinstance(spec.get('password'), basestring):
+                row['password'] = digest(spec['password'], row['salt'])
+
+        rows = self._bulk_rows(User, count, spec_data, defaults, prepare)
+        self.insert_rows(User, rows)
+        if return_objects:
+            return [merge_row(self.session, User, row) for row in rows]
+        return [row['id'] for row in rows]
+
+    def create_sessions(self, count, spec_data=None, return_objects=True):
+        """
+        Make count sessions at once, the way create_users makes users.  Sessions without a user_id each get a new
+        user, made with a single create_users call.
+        :param count: How many sessions to make
+        :param spec_data: A dictionary of values for every session, or a list of count dictionaries, one per session
+        :param return_objects: Whether to return the objects, which are attached without loading them, or just ids
+        :return: A list of session db models, or of their ids
+        """
+        now = datetime.now()
+        rows = self._bulk_rows(Session, count, spec_data, lambda: {
+            'user_id': None, 'token': str(uuid4()), 'started': now, 'lastactive': now})
+        userless = [row for row in rows if row['user_id'] is None]
+        if userless:
+            user_ids = self.create_users(len(userless), return_objects=False)
+            for row, user_id in zip(userless, user_ids):
+                row['user_id'] = user_id
+        self.insert_rows(Session, rows)
+        if return_objects:
+            return [merge_row(self.session, Session, row) for row in rows]
+        return [row['id'] for row in rows]
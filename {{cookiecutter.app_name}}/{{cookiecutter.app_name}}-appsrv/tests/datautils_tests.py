@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from db import Session, User
+from tests import MyPyramidTestBase
+from tests.datautils import hash_generated
+
+
+class BulkCreateTests(MyPyramidTestBase):
+    """
+    Tests for making users and sessions in bulk
+    """
+    def test_users(self):
+        """
+        Bulk users are real rows, attached to the session, and cost two statements where one INSERT can hold them
+        """
+        with self.assertMaxQueries(2):
+            self.datautils.create_users(100)
+        users = self.datautils.create_users(1200)
+        self.assertEqual(self.session.query(User).count(), 1300)
+        self.assertEqual(len(set(u.username for u in users)), 1200)
+        self.assertIs(self.session.query(User).get(users[5].id), users[5])
+        loaded = self.session.query(User).filter(User.id == users[-1].id).one()
+        self.assertEqual(loaded.email, users[-1].email)
+        self.assertIsNotNone(loaded.created)
+
+    def test_users_spec(self):
+        """
+        Values can be given for all the users or for each, and string passwords are hashed like create_user's
+        """
+        one = self.datautils.create_user({'password': 'secret', 'salt': 'pepper'})
+        users = self.datautils.create_users(2, {'password': 'secret', 'salt': 'pepper', 'origin': 'bulk'})
+        self.assertEqual([u.password for u in users], [one.password] * 2)
+        self.assertEqual([u.origin for u in users], ['bulk'] * 2)
+        ids = self.datautils.create_users(2, [{'username': 'a'}, {'username': 'b', 'created': datetime(2018, 1, 1)}],
+                                          return_objects=False)
+        self.session.expunge_all()
+        users = self.session.query(User).filter(User.id.in_(ids)).order_by(User.id).all()
+        self.assertEqual([u.username for u in users], ['a', 'b'])
+        self.assertEqual(users[1].created, datetime(2018, 1, 1))
+        self.assertEqual(users[0].salt, hash_generated('generated_salt'))
+        with self.assertRaises(ValueError):
+            self.datautils.create_users(3, [{}, {}])
+
+    def test_sessions(self):
+        """
+        Sessions get a user each unless given one
+        """
+        user = self.datautils.create_user()
+        sessions = self.datautils.create_sessions(3)
+        self.assertEqual(len(set(s.user_id for s in sessions)), 3)
+        self.assertEqual(self.session.query(User).count(), 4)
+        ids = self.datautils.create_sessions(4, {'user_id': user.id}, return_objects=False)
+        self.assertEqual(self.session.query(Session).filter(Session.user_id == user.id).count(), 4)
+        self.assertEqual(len(set(s.token for s in self.session.query(Session).filter(Session.id.in_(ids)))), 4)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyramid.exceptions import ConfigurationError
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool
+
+from db import background_connections
+from db.pool import TimedQueuePool, check_pool_capacity, log_pool_stats, pool_stats, server_threads
+
+
+def pooled_engine(pool_size=1, max_overflow=0):
+    return create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                         pool_timeout=0.05, connect_args={'check_same_thread': False})
+
+
+class TimedQueuePoolTests(TestCase):
+    """
+    Tests for the pool statistics
+    """
+    def test_stats(self):
+        """
+        Checkouts, timeouts and what is checked out are counted, and the counts can be reset
+        """
+        engine = pooled_engine()
+        held = engine.connect()
+        self.assertEqual(pool_stats(engine)['checked_out'], 1)
+        with self.assertRaises(TimeoutError):
+            engine.connect()
+        stats = log_pool_stats(engine)
+        self.assertEqual((stats['checkouts'], stats['timeouts'], stats['size']), (2, 1, 1))
+        self.assertGreaterEqual(stats['wait_ms_max'], 50)
+        held.close()
+        stats = pool_stats(engine)
+        self.assertEqual((stats['checkouts'], stats['timeouts'], stats['checked_out']), (0, 0, 0))
+
+    def test_other_pools(self):
+        """
+        Other pools just report their status
+        """
+        engine = create_engine('sqlite://', poolclass=NullPool)
+        self.assertEqual(list(pool_stats(engine)), ['status'])
+
+
+class PoolCapacityTests(TestCase):
+    """
+    Tests for checking the pool against the server's threads
+    """
+    def test_capacity(self):
+        """
+        The pool has to hold a connection per thread, plus one
+        """
+        check_pool_capacity(pooled_engine(3, 1), 3)
+        with self.assertRaises(ConfigurationError):
+            check_pool_capacity(pooled_engine(3, 0), 3)
+        check_pool_capacity(pooled_engine(1, -1), 50)
+        check_pool_capacity(create_engine('sqlite://', poolclass=NullPool), 50)
+
+    def test_background(self):
+        """
+        Each background thread the settings turn on can hold a connection, and a pool sized for only one of them fails
+        """
+        everything = {'auth.token_secret': 'secret'}
+        self.assertEqual(background_connections(everything), 3)
+        self.assertEqual(background_connections({}), 2)
+        self.assertEqual(background_connections({'auth.lastactive.write_behind': 'false',
+                                                 'maintenance.prune_sessions.enabled': 'false'}), 0)
+        self.assertEqual(background_connections({'maintenance.enabled': 'false'}), 1)
+        with self.assertRaises(ConfigurationError):
+            check_pool_capacity(pooled_engine(3, 1), 3, background_connections(everything))
+        check_pool_capacity(pooled_engine(3, 3), 3, background_connections(everything))
+
+    def test_server_threads(self):
+        """
+        The thread count comes from waitress's section of the ini file, or its default
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'app.ini')
+
+        def threads(server):
+            with open(path, 'w') as f:
+                f.write('[app:main]\nsqlalchemy.url = %(here)s/db\n\n[server:main]\n' + server)
+            return server_threads({'__file__': path})
+
+        self.assertEqual(threads('use = egg:waitress#main\nthreads = 6\n'), 6)
+        self.assertEqual(threads('use = egg:waitress#main\n'), 4)
+        self.assertIsNone(threads('use = egg:gunicorn#main\nworkers = 2\n'))
+        self.assertIsNone(server_threads({}))
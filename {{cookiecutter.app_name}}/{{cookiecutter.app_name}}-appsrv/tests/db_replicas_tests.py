@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import time
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.response import Response
+
+from db import Session, User, enable_sqlite_savepoints, get_session_factory, metadata
+from db.replicas import ReplicaRouter, read_from_replica, use_primary
+from security import authenticated_user
+from tests import throwaway_engine
+
+users_table = User.__table__
+sessions_table = Session.__table__
+
+
+def make_database(username):
+    """
+    A separate in-memory database, with one user in it
+    """
+    engine = throwaway_engine()
+    enable_sqlite_savepoints(engine)
+    metadata.create_all(engine)
+    engine.execute(users_table.insert().values(
+        id=1, username=username, email='%s@example.com' % username, password=b'p', salt=b's'))
+    return engine
+
+
+class RoutingSessionTests(TestCase):
+    """
+    Tests for sending reads to a replica and writes to the primary
+    """
+    def setUp(self):
+        self.primary = make_database('on_primary')
+        self.replica = make_database('on_replica')
+        self.session = get_session_factory(self.primary, [self.replica])()
+
+    def tearDown(self):
+        self.session.close()
+
+    def usernames(self):
+        return sorted(name for name, in self.session.query(User.username))
+
+    def test_primary_by_default(self):
+        """
+        A session that hasn't been given a replica reads from the primary
+        """
+        self.assertEqual(self.usernames(), ['on_primary'])
+
+    def test_reads_from_replica(self):
+        """
+        Queries and Core selects go to the replica
+        """
+        self.assertIs(read_from_replica(self.session), self.replica)
+        self.assertEqual(self.usernames(), ['on_replica'])
+        self.assertEqual(self.session.execute(users_table.select()).first()['username'], 'on_replica')
+        self.assertEqual(self.session.query(User).get(1).username, 'on_replica')
+        self.assertFalse(self.session.info.get('wrote'))
+
+    def test_writes_go_to_primary(self):
+        """
+        A flush goes to the primary, and so do the reads after it
+        """
+        read_from_replica(self.session)
+        self.session.add(User(username='new', email='new@example.com', password=b'p', salt=b's'))
+        self.session.flush()
+        self.assertTrue(self.session.info['wrote'])
+        self.assertEqual(self.usernames(), ['new', 'on_primary'])
+
+    def test_statements_go_to_primary(self):
+        """
+        UPDATEs go to the primary, and so do the reads after them
+        """
+        read_from_replica(self.session)
+        self.session.execute(users_table.update().values(origin='updated'))
+        self.assertTrue(self.session.info['wrote'])
+        self.assertEqual(self.usernames(), ['on_primary'])
+
+    def test_for_update(self):
+        """
+        SELECT ... FOR UPDATE goes to the primary
+        """
+        read_from_replica(self.session)
+        self.assertEqual(self.session.query(User.username).with_for_update().scalar(), 'on_primary')
+
+    def test_use_primary(self):
+        """
+        use_primary moves reads to the primary, and says whether they were on a replica
+        """
+        self.assertFalse(use_primary(self.session))
+        read_from_replica(self.session)
+        self.assertTrue(use_primary(self.session))
+        self.assertEqual(self.usernames(), ['on_primary'])
+
+    def test_without_replicas(self):
+        """
+        Without replicas the session factory makes ordinary sessions
+        """
+        session = get_session_factory(self.primary)()
+        self.assertIsNone(read_from_replica(session))
+        self.assertEqual(session.query(User.username).scalar(), 'on_primary')
+        session.close()
+
+
+class ReplicaRouterTests(TestCase):
+    """
+    Tests for choosing which requests read from a replica and pinning clients to the primary
+    """
+    def setUp(self):
+        self.config = testing.setUp()
+        self.router = ReplicaRouter(pin_seconds=10)
+        self.primary = make_database('on_primary')
+        self.replica = make_database('on_replica')
+        self.factory = get_session_factory(self.primary, [self.replica])
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def route(self, method='GET', cookie=None):
+        request = testing.DummyRequest()
+        request.method = method
+        if cookie is not None:
+            request.cookies[self.router.cookie_name] = cookie
+        session = self.factory()
+        self.router.route(request, session)
+        return request, session
+
+    def respond(self, request):
+        response = Response()
+        request._process_response_callbacks(response)
+        return response.headers.get('Set-Cookie')
+
+    def test_reads(self):
+        """
+        GET and HEAD requests read from the replica, others from the primary
+        """
+        self.assertIs(self.route('GET')[1].info['replica'], self.replica)
+        self.assertIs(self.route('HEAD')[1].info['replica'], self.replica)
+        self.assertNotIn('replica', self.route('POST')[1].info)
+
+    def test_pin(self):
+        """
+        A request that writes pins the client to the primary
+        """
+        request, session = self.route('PUT')
+        session.execute(users_table.update().values(origin='updated'))
+        cookie = self.respond(request)
+        self.assertTrue(cookie.startswith(self.router.cookie_name + '='))
+        self.assertIn('Max-Age=10', cookie)
+
+        until = cookie.split(';')[0].split('=')[1]
+        self.assertNotIn('replica', self.route('GET', until)[1].info)
+
+    def test_no_pin(self):
+        """
+        Requests that only read, and GET requests whatever they do, don't pin
+        """
+        request, session = self.route('POST')
+        session.query(User).all()
+        self.assertIsNone(self.respond(request))
+        session.close()
+
+        request, session = self.route('GET')
+        session.execute(users_table.update().values(origin='updated'))
+        self.assertIsNone(self.respond(request))
+
+    def test_bad_pins(self):
+        """
+        Expired, malformed and too distant pins are ignored
+        """
+        now = int(time.time())
+        for cookie in [str(now - 1), 'soon', str(now + 3600)]:
+            self.assertIs(self.route('GET', cookie)[1].info['replica'], self.replica, cookie)
+
+
+class ReplicaAuthenticationTests(TestCase):
+    """
+    Tests for authenticating tokens the replica doesn't have yet
+    """
+    def setUp(self):
+        self.config = testing.setUp()
+        self.primary = make_database('on_primary')
+        self.replica = make_database('on_replica')
+        self.primary.execute(sessions_table.insert().values(user_id=1, token='new_token'))
+        self.session = get_session_factory(self.primary, [self.replica])()
+
+    def tearDown(self):
+        self.session.close()
+        testing.tearDown()
+
+    def test_token_on_primary(self):
+        """
+        A token missing from the replica is looked for on the primary
+        """
+        request = testing.DummyRequest(params={'token': 'new_token'})
+        request.dbsession = self.session
+        read_from_replica(self.session)
+        user = authenticated_user(request)
+        self.assertEqual(user.username, 'on_primary')
+
+    def test_unknown_token(self):
+        """
+        A token neither has still fails
+        """
+        request = testing.DummyRequest(params={'token': 'unknown'})
+        request.dbsession = self.session
+        read_from_replica(self.session)
+        self.assertIsNone(authenticated_user(request))
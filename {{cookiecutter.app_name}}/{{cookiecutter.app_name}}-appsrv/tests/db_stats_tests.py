@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from pyramid.response import Response
+
+from db.stats import collect, sql_stats_tween_factory
+from tests import MyPyramidTestBase
+
+
+class SqlStatsTests(MyPyramidTestBase):
+    """
+    Tests for the per-request SQL statistics
+    """
+    def handler(self, request):
+        self.session.execute('SELECT 1')
+        self.session.execute('SELECT 2')
+        return Response('ok')
+
+    def test_collect(self):
+        """
+        Statements run inside the block are counted and timed, and those outside aren't
+        """
+        self.session.connection()
+        with collect() as stats:
+            self.session.execute('SELECT 1')
+        self.session.execute('SELECT 1')
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.slowest_statement, 'SELECT 1')
+        self.assertGreaterEqual(stats.total_time, stats.slowest_time)
+
+    def test_headers(self):
+        """
+        With headers turned on, the response says how much SQL it took
+        """
+        self.session.connection()
+        self.config.registry.settings['sql_stats.headers'] = 'true'
+        tween = sql_stats_tween_factory(self.handler, self.config.registry)
+        response = tween(self.request)
+        self.assertEqual(response.headers['X-DB-Statements'], '2')
+        self.assertIn('X-DB-Time', response.headers)
+        self.assertTrue(response.headers['Server-Timing'].startswith('db;dur='))
+
+    def test_no_headers(self):
+        """
+        By default nothing is added to the response
+        """
+        tween = sql_stats_tween_factory(self.handler, self.config.registry)
+        response = tween(self.request)
+        self.assertNotIn('X-DB-Statements', response.headers)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from sqlalchemy import func, select
+
+from db import Session, User, metadata
+from scripts.initializedb import RowStream, grant_role, seed_users
+from security.authorize import ROLES
+from tests import throwaway_engine
+
+users_table = User.__table__
+sessions_table = Session.__table__
+
+
+class SeedUsersTests(TestCase):
+    """
+    Tests for seeding users and sessions, against their own throwaway database since they commit
+    """
+    def setUp(self):
+        self.engine = throwaway_engine()
+        metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def count(self, table):
+        return self.engine.execute(select([func.count()]).select_from(table)).scalar()
+
+    def test_seed(self):
+        """
+        Every user gets their sessions, across batches, with the shared password
+        """
+        self.assertEqual(seed_users(self.engine, 5, 2, b'pass', b'salt', batch_size=2), (0, 4))
+        self.assertEqual(self.count(users_table), 5)
+        self.assertEqual(self.count(sessions_table), 10)
+        users = self.engine.execute(select([users_table]).order_by(users_table.c.id)).fetchall()
+        self.assertEqual([u.username for u in users], ['loadtest%09d' % i for i in range(5)])
+        self.assertEqual(set((u.email, u.password, u.salt) for u in users[:1]),
+                         set([('loadtest000000000@example.com', b'pass', b'salt')]))
+        per_user = self.engine.execute(select([sessions_table.c.user_id, func.count()])
+                                       .group_by(sessions_table.c.user_id)).fetchall()
+        self.assertEqual(sorted(per_user), [(u.id, 2) for u in users])
+
+    def test_seed_again(self):
+        """
+        Seeding more carries on numbering from the last seeded user, ignoring other users
+        """
+        self.engine.execute(users_table.insert(), username='loadtest_extra', email='e', password=b'p', salt=b's')
+        seed_users(self.engine, 3)
+        self.assertEqual(seed_users(self.engine, 2, prefix='loadtest'), (3, 4))
+        self.assertEqual(seed_users(self.engine, 1, prefix='other'), (0, 0))
+        self.assertEqual(self.count(users_table), 7)
+        self.assertEqual(self.count(sessions_table), 0)
+
+    def test_grant_role(self):
+        """
+        Granting a role adds its bit to the user's roles, and a missing user is reported
+        """
+        seed_users(self.engine, 1)
+        self.assertTrue(grant_role(self.engine, 'loadtest000000000', 'MS_user'))
+        self.assertTrue(grant_role(self.engine, 'loadtest000000000', 'MS_admin'))
+        self.assertEqual(self.engine.execute(select([users_table.c.roles])).scalar(),
+                         ROLES['MS_user'] | ROLES['MS_admin'])
+        self.assertFalse(grant_role(self.engine, 'nobody', 'MS_admin'))
+
+
+class RowStreamTests(TestCase):
+    """
+    Tests for the COPY text format
+    """
+    def test_format(self):
+        """
+        Text is escaped, bytes are hex and None is null, and reads of any size get it all
+        """
+        stream = RowStream([(1, u'tab\there', b'\x00\xff', None), (2, 'back\\slash\n', b'', 'x')],
+                           [False, False, True, False])
+        expected = '1\ttab\\there\t\\\\x00ff\t\\N\n2\tback\\\\slash\\n\t\\\\x\tx\n'
+        chunks = []
+        while True:
+            chunk = stream.read(5)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertEqual(RowStream([(1,)], [False]).read(), '1\n')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from pyramid import testing
+from sqlalchemy import event, func, select
+
+from db import RevokedSession, Session, User
+from maintenance import Scheduler, includeme, prune_revocations, prune_sessions
+from tests import throwaway_engine
+
+
+class FakeClock(object):
+    """
+    A clock we can move by hand
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PruneSessionsTests(TestCase):
+    """
+    Tests for pruning expired sessions, against their own throwaway database since they commit
+    """
+    def setUp(self):
+        self.engine = throwaway_engine()
+        User.__table__.create(self.engine)
+        Session.__table__.create(self.engine)
+        self.engine.execute(User.__table__.insert(), id=1, username='u', email='e', password='p', salt='s')
+        old = datetime.now() - timedelta(days=30)
+        recent = datetime.now() - timedelta(hours=1)
+        self.engine.execute(Session.__table__.insert(), [
+            {'id': i, 'user_id': 1, 'token': 't%d' % i, 'started': old, 'lastactive': old if i <= 7 else recent}
+            for i in range(1, 11)])
+        self.deletes = 0
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('DELETE'):
+            self.deletes += 1
+
+    def remaining(self):
+        return [row.id for row in self.engine.execute(select([Session.__table__.c.id]).order_by('id'))]
+
+    def test_prunes_only_expired(self):
+        """
+        Expired sessions go, active ones stay
+        """
+        self.assertEqual(prune_sessions(self.engine, pause=0), 7)
+        self.assertEqual(self.remaining(), [8, 9, 10])
+        self.assertEqual(self.deletes, 1)
+
+    def test_batches(self):
+        """
+        Each statement deletes at most batch_size rows
+        """
+        self.assertEqual(prune_sessions(self.engine, batch_size=3, pause=0), 7)
+        self.assertEqual(self.remaining(), [8, 9, 10])
+        self.assertEqual(self.deletes, 3)
+
+    def test_nothing_to_prune(self):
+        """
+        With nothing expired it's a single cheap statement
+        """
+        prune_sessions(self.engine, pause=0)
+        self.deletes = 0
+        self.assertEqual(prune_sessions(self.engine, pause=0), 0)
+        self.assertEqual(self.deletes, 1)
+        self.assertEqual(self.engine.execute(select([func.count()]).select_from(Session.__table__)).scalar(), 3)
+
+    def test_scheduled_job(self):
+        """
+        The job includeme schedules reports how many sessions and revocations it pruned
+        """
+        RevokedSession.__table__.create(self.engine)
+        self.engine.execute(RevokedSession.__table__.insert(), [
+            {'session_id': 1, 'revoked': datetime.now() - timedelta(days=30)},
+            {'session_id': 8, 'revoked': datetime.now()}])
+        config = testing.setUp(settings={'maintenance.pool_stats.enabled': 'false'})
+        try:
+            config.registry['dbengine'] = self.engine
+            includeme(config)
+            scheduler = config.registry['scheduler']
+            scheduler.run_job(scheduler.jobs[0])
+            self.assertEqual(scheduler.stats()['prune_sessions']['last_result'], {'sessions': 7, 'revocations': 1})
+        finally:
+            testing.tearDown()
+
+
+class PruneRevocationsTests(TestCase):
+    """
+    Tests for pruning revocations no token can need any more
+    """
+    def setUp(self):
+        self.engine = throwaway_engine()
+        RevokedSession.__table__.create(self.engine)
+        self.engine.execute(RevokedSession.__table__.insert(), [
+            {'session_id': i, 'revoked': datetime.now() - timedelta(days=i)} for i in range(1, 11)])
+
+    def test_prunes_only_expired(self):
+        """
+        Revocations older than max_age go, the rest stay
+        """
+        self.assertEqual(prune_revocations(self.engine, 7 * 24 * 3600 + 60), 3)
+        remaining = select([RevokedSession.__table__.c.session_id]).order_by('session_id')
+        self.assertEqual([row.session_id for row in self.engine.execute(remaining)], list(range(1, 8)))
+
+
+class SchedulerTests(TestCase):
+    """
+    Tests for the Scheduler, run by hand rather than in its thread
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock)
+        self.calls = []
+
+    def job(self, stopping):
+        self.calls.append(self.clock.now)
+        return len(self.calls)
+
+    def test_runs_when_due(self):
+        """
+        A job first runs after its delay, and then every interval
+        """
+        self.scheduler.add_job('job', self.job, interval=10, delay=5)
+        self.assertEqual(self.scheduler.run_pending(), 5)
+        self.clock.now += 5
+        self.assertEqual(self.scheduler.run_pending(), 10)
+        self.clock.now += 9
+        self.scheduler.run_pending()
+        self.clock.now += 1
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, [1005.0, 1015.0])
+        stats = self.scheduler.stats()['job']
+        self.assertEqual(stats['runs'], 2)
+        self.assertEqual(stats['last_result'], 2)
+
+    def test_failure_does_not_stop_others(self):
+        """
+        A failing job is counted and retried later, and the other jobs still run
+        """
+        def broken(stopping):
+            raise ValueError('broken')
+        self.scheduler.add_job('broken', broken, interval=10, delay=0)
+        self.scheduler.add_job('job', self.job, interval=10, delay=0)
+        self.scheduler.run_pending()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.scheduler.stats()['broken']['failures'], 1)
+        self.assertEqual(self.scheduler.run_pending(), 10)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from pyramid import testing
+
+from networks import NetworkClassifier, Networks, host_name
+from views.base_views import is_dev_request
+from views.local_view import is_internal
+
+
+class NetworkClassifierTests(TestCase):
+    """
+    Tests for looking addresses up in a set of networks
+    """
+    def setUp(self):
+        self.classifier = NetworkClassifier(['10.0.0.0/8', '172.16.0.0/12', '10.1.0.0/16', '10.255.255.255/32',
+                                             '11.0.0.0/8', '192.168.1.7/24', 'fc00::/7'])
+
+    def test_ipv4(self):
+        """
+        Addresses are in a network up to its last address and no further, and overlapping ones are merged
+        """
+        for address in ['10.0.0.0', '10.1.2.3', '10.255.255.255', '11.255.255.255', '172.16.0.1', '172.31.255.255',
+                        '192.168.1.0', '192.168.1.255']:
+            self.assertIn(address, self.classifier)
+        for address in ['9.255.255.255', '12.0.0.0', '172.15.255.255', '172.32.0.0', '172.200.1.1', '192.168.2.0']:
+            self.assertNotIn(address, self.classifier)
+        # 10/8 and 11/8 are adjacent, and take in the networks inside them
+        self.assertEqual(len(self.classifier.starts[4]), 3)
+
+    def test_ipv6(self):
+        """
+        IPv6 addresses are looked up in the IPv6 networks, and IPv4-mapped ones in the IPv4 networks
+        """
+        self.assertIn('fd12:3456::1', self.classifier)
+        self.assertNotIn('fe80::1', self.classifier)
+        self.assertNotIn('::1', self.classifier)
+        self.assertIn('::ffff:10.2.3.4', self.classifier)
+        self.assertNotIn('::ffff:8.8.8.8', self.classifier)
+
+    def test_not_addresses(self):
+        """
+        Anything that isn't an address is in none of the networks
+        """
+        for address in [None, '', 'localhost', '10.0.0', '999.1.1.1', '10.0.0.\xff']:
+            self.assertNotIn(address, self.classifier)
+
+    def test_cache(self):
+        """
+        Answers are kept, up to the cache's size
+        """
+        classifier = NetworkClassifier(['10.0.0.0/8'], cache_size=2)
+        self.assertIn('10.0.0.1', classifier)
+        self.assertNotIn('8.8.8.8', classifier)
+        self.assertEqual(classifier.cache, {'10.0.0.1': True, '8.8.8.8': False})
+        self.assertNotIn('8.8.4.4', classifier)
+        self.assertEqual(classifier.cache, {'8.8.4.4': False})
+
+
+class NetworksTests(TestCase):
+    """
+    Tests for classifying requests by host and address
+    """
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def request(self, host, remote_addr):
+        return testing.DummyRequest(host=host, remote_addr=remote_addr)
+
+    def test_host_name(self):
+        """
+        The port and an IPv6 address's brackets aren't part of the host name
+        """
+        self.assertEqual(host_name(self.request('localhost:6543', None)), 'localhost')
+        self.assertEqual(host_name(self.request('[::1]:6543', None)), '::1')
+        self.assertEqual(host_name(self.request('app.example.com', None)), 'app.example.com')
+
+    def test_is_internal(self):
+        """
+        Only requests to an internal host from an internal address are internal
+        """
+        self.assertTrue(is_internal(self.request('localhost:6543', '127.0.0.1')))
+        self.assertTrue(is_internal(self.request('localhost', '172.20.1.1')))
+        self.assertFalse(is_internal(self.request('localhost', '172.200.1.1')))
+        self.assertFalse(is_internal(self.request('localhost', '203.0.113.9')))
+        self.assertFalse(is_internal(self.request('app.example.com', '127.0.0.1')))
+
+    def test_is_dev(self):
+        """
+        Requests to a development host or address, or from a development address, get the development shell
+        """
+        self.assertTrue(is_dev_request(self.request('localhost:6543', '203.0.113.9')))
+        self.assertTrue(is_dev_request(self.request('127.0.0.1:6543', '203.0.113.9')))
+        self.assertTrue(is_dev_request(self.request('[::1]:6543', '203.0.113.9')))
+        self.assertTrue(is_dev_request(self.request('app.example.com', '10.19.4.5')))
+        self.assertFalse(is_dev_request(self.request('app.example.com', '10.20.4.5')))
+        self.assertFalse(is_dev_request(self.request('app.example.com', None)))
+
+    def test_configured(self):
+        """
+        The networks come from the settings when they are included
+        """
+        self.config.registry.settings.update({
+            'networks.internal': '198.51.100.0/24\n2001:db8::/32',
+            'networks.internal_hosts': 'internal.example.com',
+            'networks.dev': '203.0.113.0/24',
+            'networks.dev_hosts': 'dev.example.com',
+        })
+        self.config.include('networks')
+        self.assertTrue(is_internal(self.request('internal.example.com', '2001:db8::5')))
+        self.assertFalse(is_internal(self.request('localhost', '127.0.0.1')))
+        self.assertTrue(is_dev_request(self.request('app.example.com', '203.0.113.9')))
+        self.assertTrue(is_dev_request(self.request('dev.example.com', '8.8.8.8')))
+        self.assertFalse(is_dev_request(self.request('localhost', '127.0.0.1')))
+        self.assertIsInstance(self.config.registry['networks'], Networks)
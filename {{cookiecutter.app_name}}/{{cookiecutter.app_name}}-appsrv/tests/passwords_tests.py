@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from security.passwords import PasswordHasher, PasswordHasherBusy
+from utilities import hash_password
+
+
+class PasswordHasherTests(TestCase):
+    """
+    Tests for the PasswordHasher
+    """
+    def setUp(self):
+        self.salt = b'\x00\x01salt\xff' * 8
+        self.hasher = PasswordHasher(iterations=1000, pool_size=0)
+
+    def test_round_trip(self):
+        """
+        A hash verifies against the same password and nothing else
+        """
+        stored = self.hasher.hash(u'pässword', self.salt)
+        self.assertTrue(stored.startswith(b'pbkdf2_sha512$1000$'))
+        self.assertEqual(self.hasher.verify(u'pässword', self.salt, stored), (True, False))
+        self.assertEqual(self.hasher.verify(u'password', self.salt, stored), (False, False))
+        self.assertEqual(self.hasher.verify(u'pässword', b'other', stored), (False, False))
+
+    def test_legacy(self):
+        """
+        The old single round SHA-512 digests still verify, and ask to be rehashed
+        """
+        stored = hash_password(u'password', self.salt)
+        self.assertEqual(self.hasher.verify(u'password', self.salt, stored), (True, True))
+        self.assertEqual(self.hasher.verify(u'wrong', self.salt, stored), (False, False))
+
+    def test_cost_change(self):
+        """
+        Raising the cost keeps older hashes working, but asks for them to be rehashed
+        """
+        stored = self.hasher.hash(u'password', self.salt)
+        stronger = PasswordHasher(iterations=2000, pool_size=0)
+        self.assertEqual(stronger.verify(u'password', self.salt, stored), (True, True))
+        sha256 = PasswordHasher(algorithm='pbkdf2_sha256', iterations=1000, pool_size=0)
+        self.assertEqual(sha256.verify(u'password', self.salt, stored), (True, True))
+
+    def test_pool(self):
+        """
+        Hashing on the pool gives the same answers as hashing inline
+        """
+        pooled = PasswordHasher(iterations=1000, pool_size=2, max_pending=2)
+        try:
+            self.assertEqual(pooled.hash(u'password', self.salt), self.hasher.hash(u'password', self.salt))
+        finally:
+            pooled.close()
+
+    def test_busy(self):
+        """
+        Once max_pending callers are hashing, the next is turned away instead of waiting
+        """
+        pooled = PasswordHasher(iterations=1000, pool_size=1, max_pending=1)
+        try:
+            pooled._slots.acquire()
+            with self.assertRaises(PasswordHasherBusy):
+                pooled.hash(u'password', self.salt)
+            self.assertEqual(pooled.rejected, 1)
+            pooled._slots.release()
+            pooled.hash(u'password', self.salt)
+        finally:
+            pooled.close()
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            PasswordHasher(algorithm='md5')
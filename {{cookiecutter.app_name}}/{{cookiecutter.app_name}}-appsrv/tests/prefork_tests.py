@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from unittest import TestCase
+
+from scripts.prefork import DEFAULT_OPTIONS, RecyclingApp, Supervisor, read_options, rss_mb
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello']
+
+
+class ReadOptionsTests(TestCase):
+    """
+    Tests for reading the prefork options from an ini file
+    """
+    def read(self, text):
+        handle, path = tempfile.mkstemp(suffix='.ini')
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+        try:
+            return read_options(path)
+        finally:
+            os.remove(path)
+
+    def test_defaults(self):
+        """
+        An ini without the sections gets the defaults
+        """
+        self.assertEqual(self.read('[app:main]\nuse = egg:app\n'), DEFAULT_OPTIONS)
+
+    def test_sections(self):
+        """
+        The address and threads come from [server:main] and the rest from [prefork], as numbers
+        """
+        options = self.read('[server:main]\nuse = egg:waitress#main\nhost = 127.0.0.1\nport = 8080\nthreads = 6\n'
+                            '[prefork]\nworkers = 3\nmax_requests = 1000\nmax_rss_mb = 512\n')
+        self.assertEqual(options['host'], '127.0.0.1')
+        self.assertEqual(options['port'], 8080)
+        self.assertEqual(options['threads'], 6)
+        self.assertEqual(options['workers'], 3)
+        self.assertEqual(options['max_requests'], 1000)
+        self.assertEqual(options['max_rss_mb'], 512)
+        self.assertEqual(options['graceful_timeout'], DEFAULT_OPTIONS['graceful_timeout'])
+
+    def test_listen(self):
+        """
+        waitress's listen option gives the address too
+        """
+        options = self.read('[server:main]\nlisten = [::1]:7000 127.0.0.1:7001\n')
+        self.assertEqual((options['host'], options['port']), ('::1', 7000))
+
+
+class RecyclingAppTests(TestCase):
+    """
+    Tests for counting requests and deciding when a worker retires
+    """
+    def call(self, app):
+        result = app({}, lambda status, headers: None)
+        body = b''.join(result)
+        result.close()
+        return body
+
+    def test_counts(self):
+        """
+        A request is in progress until its body is closed
+        """
+        app = RecyclingApp(hello_app)
+        result = app({}, lambda status, headers: None)
+        self.assertEqual((app.requests, app.active), (1, 1))
+        self.assertEqual(b''.join(result), b'hello')
+        result.close()
+        self.assertEqual((app.requests, app.active), (1, 0))
+
+    def test_errors(self):
+        """
+        A request that raises isn't left in progress
+        """
+        def failing_app(environ, start_response):
+            raise ValueError('broken')
+        app = RecyclingApp(failing_app)
+        with self.assertRaises(ValueError):
+            app({}, None)
+        self.assertEqual(app.active, 0)
+
+    def test_max_requests(self):
+        """
+        The worker is retired once, after its last request
+        """
+        reasons = []
+        app = RecyclingApp(hello_app, max_requests=3, retire=reasons.append)
+        for _ in range(2):
+            self.call(app)
+        self.assertEqual(reasons, [])
+        for _ in range(3):
+            self.call(app)
+        self.assertEqual(reasons, ['served 3 requests'])
+
+    def test_max_rss(self):
+        """
+        The worker is retired once it is bigger than allowed
+        """
+        self.assertGreater(rss_mb(), 0)
+        reasons = []
+        app = RecyclingApp(hello_app, max_rss_mb=1, retire=reasons.append)
+        self.call(app)
+        self.assertEqual(reasons, ['grew past 1MB'])
+
+        reasons = []
+        app = RecyclingApp(hello_app, max_rss_mb=1024 * 1024, retire=reasons.append)
+        self.call(app)
+        self.assertEqual(reasons, [])
+
+
+class SupervisorTests(TestCase):
+    """
+    Tests for the Supervisor's bookkeeping, without forking
+    """
+    def test_one_worker_prunes(self):
+        """
+        The first worker takes the maintenance jobs, and its replacement takes them over once it has exited
+        """
+        supervisor = Supervisor(None, None, dict(DEFAULT_OPTIONS))
+        self.assertTrue(supervisor.takes_maintenance())
+        supervisor.workers = {10: 0, 11: 0}
+        supervisor.maintenance_pid = 10
+        self.assertFalse(supervisor.takes_maintenance())
+        del supervisor.workers[11]
+        self.assertFalse(supervisor.takes_maintenance())
+        del supervisor.workers[10]
+        self.assertTrue(supervisor.takes_maintenance())
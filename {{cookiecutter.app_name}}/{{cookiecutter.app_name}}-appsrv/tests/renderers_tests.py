@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import uuid
+
+from pyramid.renderers import JSON
+from zope.interface import Interface, implementer
+
+from renderers import FastJSON
+from tests import MyPyramidTestBase
+from utilities import date_serializer, time_serializer
+
+
+class IThing(Interface):
+    pass
+
+
+@implementer(IThing)
+class Thing(object):
+    pass
+
+
+class HasJson(object):
+    def __json__(self, request):
+        return {'json': True}
+
+
+class FastJSONTests(MyPyramidTestBase):
+    """
+    Tests for the FastJSON renderer
+    """
+    def setUp(self):
+        MyPyramidTestBase.setUp(self)
+        self.renderer = FastJSON()
+
+    def render(self, value, renderer=None):
+        return (renderer or self.renderer)(None)(value, {'request': self.request})
+
+    def test_same_as_pyramid(self):
+        """
+        A typical response renders exactly as it did with Pyramid's renderer and our old adapters
+        """
+        old = JSON()
+        old.add_adapter(datetime.date, date_serializer)
+        old.add_adapter(datetime.time, time_serializer)
+        now = datetime.datetime(2018, 2, 3, 4, 5, 6, 789)
+        value = {'d': [{
+            'id': 1, 'username': u'üser', 'email': 'user@example.com', 'created': now, 'origin': None,
+            'score': 1.9999999999999999, 'active': True, 'day': now.date(), 'at': now.time(),
+            'session': {'id': 2, 'started': now, 'token': 'abc'}, 'tags': ['a', 'b'],
+        }]}
+        self.assertEqual(self.render(value), self.render(value, old))
+
+    def test_content_type(self):
+        """
+        The response is marked as JSON, like Pyramid's renderer does
+        """
+        self.render({'d': {}})
+        self.assertEqual(self.request.response.content_type, 'application/json')
+
+    def test_native_types(self):
+        """
+        Decimals, UUIDs and binary are handled without adapters
+        """
+        value = uuid.UUID('12345678123456781234567812345678')
+        self.assertEqual(self.render([decimal.Decimal('1.10'), value, bytearray(b'\x00\xff')]),
+                         '["1.10", "12345678-1234-5678-1234-567812345678", "AP8="]')
+
+    def test_adapters(self):
+        """
+        Adapters still work, for classes, subclasses and interfaces, and a class adapter replaces a native one
+        """
+        self.renderer.add_adapter(Thing, lambda obj, request: 'thing')
+        self.renderer.add_adapter(decimal.Decimal, lambda obj, request: float(obj))
+        self.assertEqual(self.render([Thing(), decimal.Decimal('1.5')]), '["thing", 1.5]')
+        renderer = FastJSON()
+        renderer.add_adapter(IThing, lambda obj, request: 'by interface')
+        self.assertEqual(self.render([Thing()], renderer), '["by interface"]')
+
+    def test_json_method(self):
+        """
+        Objects with __json__ render through it
+        """
+        self.assertEqual(self.render(HasJson()), '{"json": true}')
+
+    def test_unknown(self):
+        """
+        Anything else is still an error
+        """
+        with self.assertRaises(TypeError):
+            self.render(object())
+
+    def test_compact(self):
+        self.assertEqual(self.render({'a': [1, 2]}, FastJSON(compact=True)), '{"a":[1,2]}')
@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
+import datetime
 
+import transaction
+from pyramid import testing
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from db.activity import LastActiveBuffer
 from security import (
-    get_user_from_token
+    SESSION_IDLE_LIMIT,
+    authenticated_user,
+    get_user_from_token,
+    includeme,
+    invalidate_token
 )
-from tests import MyTestBase, bad_data_typevals_list
+from security.token_cache import TokenCache
+from security.tokens import RevocationList, TokenSigner
+from tests import MyTestBase, MyPyramidTestBase, bad_data_typevals_list
+from db import RevokedSession, Session, User, get_tm_session, is_postgresql
 from db.converters import dict_from_row
+from tests.datautils import DataUtils
 
 
 class SecurityTestBase(MyTestBase):
@@ -52,3 +67,191 @@ class GetUserFromTokenTests(SecurityTestBase):
         result = get_user_from_token(self.session, sess.token)
         self.assertEqual(dict_from_row(user), dict_from_row(result))
 
+
+class AuthenticationTestBase(MyPyramidTestBase):
+    """
+    Helper for request.user tests, recording every statement sent to the database
+    """
+    def setUp(self):
+        MyPyramidTestBase.setUp(self)
+        self.user = self.datautils.create_user()
+        self.token = str(self.datautils.create_session({'user_id': self.user.id}).token)
+        self.request.GET['token'] = self.token
+        self.statements = []
+        self.engine = self.session.get_bind()
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+        MyPyramidTestBase.tearDown(self)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class AuthenticatedUserTests(AuthenticationTestBase):
+    """
+    Tests for the request.user property, mostly about how many statements it costs
+    """
+    def test_one_statement(self):
+        """
+        Authenticating and bumping lastactive is exactly one statement, or two where UPDATE can't return rows
+        """
+        result = authenticated_user(self.request)
+        self.assertEqual(len(self.statements), 1 if is_postgresql(self.session) else 2)
+        self.assertEqual(result.id, self.user.id)
+
+    def test_one_statement_with_write_behind(self):
+        """
+        With the write-behind buffer it is still one statement, and nothing is written
+        """
+        lastactive_buffer = LastActiveBuffer(self.engine, min_interval=0)
+        self.request.registry['lastactive_buffer'] = lastactive_buffer
+        result = authenticated_user(self.request)
+        self.assertEqual(len(self.statements), 1)
+        self.assertTrue(self.statements[0].lstrip().upper().startswith('SELECT'))
+        self.assertEqual(result.id, self.user.id)
+        self.assertEqual(lastactive_buffer.stats()['pending'], 1)
+
+    def test_no_statements_when_cached(self):
+        """
+        Once the token is cached, authenticating doesn't touch the database at all
+        """
+        self.request.registry['token_cache'] = TokenCache()
+        authenticated_user(self.request)
+        del self.statements[:]
+        result = authenticated_user(self.request)
+        self.assertEqual(self.statements, [])
+        self.assertEqual(result.id, self.user.id)
+
+    def test_bad_token(self):
+        """
+        An unknown token is None, still for one statement
+        """
+        self.request.GET['token'] = 'invalid_token'
+        self.assertIsNone(authenticated_user(self.request))
+        self.assertEqual(len(self.statements), 1)
+
+
+class TouchCommitTests(MyTestBase):
+    """
+    Tests that bumping lastactive outlives a request that only reads, so with rows committed for real rather than
+    inside a test transaction
+    """
+    def setUp(self):
+        self.session = self.class_session
+        self.datautils = DataUtils(self.session)
+        self.config = testing.setUp()
+        user = self.datautils.create_user()
+        self.user_id = user.id
+        self.long_ago = datetime.datetime.now() - datetime.timedelta(days=1)
+        self.token = str(self.datautils.create_session({'user_id': user.id, 'lastactive': self.long_ago}).token)
+        self.session.commit()
+
+    def tearDown(self):
+        testing.tearDown()
+        self.session.rollback()
+        self.session.query(Session).filter(Session.token == self.token).delete(synchronize_session=False)
+        self.session.query(User).filter(User.id == self.user_id).delete(synchronize_session=False)
+        self.session.commit()
+
+    def test_get_commits_touch(self):
+        """
+        The transaction manager commits the lastactive bump of a GET, though nothing was written through the ORM
+        """
+        transaction_manager = transaction.TransactionManager()
+        with transaction_manager:
+            request = testing.DummyRequest(params={'token': self.token})
+            request.dbsession = get_tm_session(sessionmaker(bind=self.session.get_bind()), transaction_manager)
+            self.assertEqual(authenticated_user(request).id, self.user_id)
+        lastactive = self.session.query(Session.lastactive).filter(Session.token == self.token).scalar()
+        self.assertGreater(lastactive, self.long_ago)
+        self.session.rollback()
+
+
+class SignedTokenTests(AuthenticationTestBase):
+    """
+    Tests for request.user with signed tokens
+    """
+    def setUp(self):
+        AuthenticationTestBase.setUp(self)
+        self.signer = TokenSigner('secret')
+        self.revocations = RevocationList(self.engine)
+        self.request.registry['token_signer'] = self.signer
+        self.request.registry['token_revocations'] = self.revocations
+        session_id = self.session.query(Session.id).filter(Session.token == self.token).scalar()
+        self.token = self.signer.sign(self.user.id, session_id)
+        self.session.query(Session).filter(Session.id == session_id).update({Session.token: self.token})
+        self.session_id = session_id
+        self.request.GET['token'] = self.token
+        del self.statements[:]
+
+    def test_no_statements_with_write_behind(self):
+        """
+        A signed token with the write-behind buffer and a warm cache costs nothing
+        """
+        self.request.registry['lastactive_buffer'] = LastActiveBuffer(self.engine, min_interval=0)
+        self.request.registry['token_cache'] = TokenCache()
+        self.assertEqual(authenticated_user(self.request).id, self.user.id)
+        del self.statements[:]
+        self.assertEqual(authenticated_user(self.request).id, self.user.id)
+        self.assertEqual(self.statements, [])
+
+    def test_bad_signature(self):
+        """
+        A signed token that doesn't verify is refused without asking the database
+        """
+        self.request.GET['token'] = self.token[:-2]
+        self.assertIsNone(authenticated_user(self.request))
+        self.assertEqual(self.statements, [])
+
+    def test_revoked(self):
+        """
+        A revoked session's token is refused
+        """
+        self.revocations.deny(self.session_id)
+        self.assertIsNone(authenticated_user(self.request))
+        self.assertEqual(self.statements, [])
+
+    def test_idle(self):
+        """
+        A signed token for a session idle for longer than SESSION_IDLE_LIMIT is refused, however young the token
+        """
+        idle = datetime.datetime.now() - SESSION_IDLE_LIMIT - datetime.timedelta(hours=1)
+        self.session.query(Session).filter(Session.id == self.session_id).update({Session.lastactive: idle})
+        self.assertIsNone(authenticated_user(self.request))
+
+    def test_active_touched(self):
+        """
+        A signed token for an active session authenticates and bumps its lastactive
+        """
+        long_ago = datetime.datetime.now() - datetime.timedelta(days=1)
+        self.session.query(Session).filter(Session.id == self.session_id).update({Session.lastactive: long_ago})
+        self.assertEqual(authenticated_user(self.request).id, self.user.id)
+        self.session.expire_all()
+        self.assertGreater(self.session.query(Session).get(self.session_id).lastactive, long_ago)
+
+    def test_invalidate_records(self):
+        """
+        Invalidating a signed token revokes it here at once, and records it for the other processes
+        """
+        invalidate_token(self.request, self.token)
+        self.assertTrue(self.revocations.is_revoked(self.session_id))
+        self.assertEqual(self.session.query(RevokedSession.session_id).all(), [(self.session_id,)])
+
+
+class IncludemeTests(MyPyramidTestBase):
+    """
+    Tests for how includeme sets signed tokens up
+    """
+    def test_revocations_not_started(self):
+        """
+        The revocation list is neither read nor refreshed until main starts it, once the whole app has configured
+        """
+        self.config.registry.settings['auth.token_secret'] = 'secret'
+        self.config.registry['dbengine'] = self.session.get_bind()
+        includeme(self.config)
+        self.config.registry['password_hasher'].close()
+        revocations = self.config.registry['token_revocations']
+        self.assertIsNone(revocations._thread)
+        self.assertIsNone(revocations.refreshed)
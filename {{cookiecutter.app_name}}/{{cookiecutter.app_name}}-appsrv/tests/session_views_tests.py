@@ -4,25 +4,50 @@ from datetime import datetime
 
 from dateutil.relativedelta import relativedelta
 
-from pjAppsrv.tests import PJPyramidTestBase
-from pjAppsrv.views.session_views import (
+from security import password_hasher
+from security.passwords import PasswordHasherBusy
+from security.token_cache import TokenCache
+from security.tokens import TokenSigner
+from tests import MyPyramidTestBase
+from views.session_views import (
     sessions_post_view,
     sessions_delete_view, sessions_put_view)
-from pjDb import Session
-from pjDb.converters import dict_from_row
-from pjLib.utilities import error_dict
+from db import Session
+from db.converters import dict_from_row
+from utilities import error_dict
 
 
-class SessionViewsTestBase(PJPyramidTestBase):
+class BusyHasher(object):
+    """
+    A password hasher whose pool is always full
+    """
+    def verify(self, password, salt, stored):
+        raise PasswordHasherBusy()
+
+    hash = verify
+
+
+class BusyRehasher(object):
+    """
+    A password hasher that accepts any password as needing an upgrade, but is too busy to hash it
+    """
+    def verify(self, password, salt, stored):
+        return True, True
+
+    def hash(self, password, salt):
+        raise PasswordHasherBusy()
+
+
+class SessionViewsTestBase(MyPyramidTestBase):
     """
     Helper for all session view stuffs
     """
     def setUp(self):
-        PJPyramidTestBase.setUp(self)
+        MyPyramidTestBase.setUp(self)
         self.request.user = None
 
     def tearDown(self):
-        PJPyramidTestBase.tearDown(self)
+        MyPyramidTestBase.tearDown(self)
 
 
 class SessionsPostViewsTest(SessionViewsTestBase):
@@ -100,6 +125,52 @@ class SessionsPostViewsTest(SessionViewsTestBase):
         s['origin'] = 'testorigin'
         self.assertEqual(result, s)
 
+    def test_query_budget(self):
+        """
+        Logging in is the user lookup, the session insert and reload, and clearing out their stale sessions
+        """
+        self.request.json_body = {'username': 'testuser', 'password': 'testpass'}
+        user = self.datautils.create_user(self.request.json_body)
+        user.password = password_hasher(self.request).hash('testpass', user.salt)
+        self.session.flush()
+        with self.assertMaxQueries(4):
+            sessions_post_view(self.request)
+
+    def test_legacy_hash_upgraded(self):
+        """
+        Logging in with a password stored the old way replaces it with a current hash
+        """
+        self.request.json_body = {'username': 'testuser', 'password': 'testpass'}
+        user = self.datautils.create_user(self.request.json_body)
+        self.assertEqual(len(bytes(user.password)), 64)
+        result = sessions_post_view(self.request)['d']
+        self.assertIn('token', result)
+        self.assertTrue(bytes(user.password).startswith(b'pbkdf2_sha512$1000$'))
+        self.assertEqual(password_hasher(self.request).verify('testpass', user.salt, user.password), (True, False))
+
+    def test_busy(self):
+        """
+        When too many requests are already hashing we get a 503 rather than waiting
+        """
+        self.request.json_body = {'username': 'testuser', 'password': 'testpass'}
+        self.datautils.create_user(self.request.json_body)
+        self.request.registry['password_hasher'] = BusyHasher()
+        result = sessions_post_view(self.request)['d']
+        self.assertEqual(self.request.response.status_int, 503)
+        self.assertEqual(result['error_type'], 'server_busy')
+
+    def test_busy_rehash(self):
+        """
+        When the hasher is too busy to upgrade a legacy hash, the login still succeeds and the hash stays as it was
+        """
+        self.request.json_body = {'username': 'testuser', 'password': 'testpass'}
+        user = self.datautils.create_user(self.request.json_body)
+        stored = user.password
+        self.request.registry['password_hasher'] = BusyRehasher()
+        result = sessions_post_view(self.request)['d']
+        self.assertIn('token', result)
+        self.assertEqual(user.password, stored)
+
 
 class SessionsDeleteViewsTest(SessionViewsTestBase):
     """
@@ -161,6 +232,18 @@ class SessionsDeleteViewsTest(SessionViewsTestBase):
         self.assertEqual(result, {})
         self.assertEqual(self.session.query(Session).filter(Session.id == s.id).count(), 0)
 
+    def test_good_token_leaves_cache(self):
+        """
+        If the token is deleted, the token cache should forget it too
+        """
+        s = self.datautils.create_session()
+        cache = TokenCache()
+        cache.put(s.token, s.user_id, {'id': s.user_id})
+        self.request.registry['token_cache'] = cache
+        self.request.json_body = {'token': s.token}
+        sessions_delete_view(self.request)
+        self.assertIsNone(cache.get(s.token))
+
 
 class SessionsPutViewsTest(SessionViewsTestBase):
     """
@@ -229,3 +312,37 @@ class SessionsPutViewsTest(SessionViewsTestBase):
         self.assertNotEqual(s.started, s.lastactive)
         self.assertTrue(s.lastactive > datetime.now() - relativedelta(hours=1))
 
+    def test_signed_token_reissued(self):
+        """
+        Refreshing a signed token hands out one issued now, which outlives the max_age of the one it replaces
+        """
+        clock = [1500000000]
+        signer = TokenSigner('secret', max_age=7 * 24 * 3600, clock=lambda: clock[0])
+        self.request.registry['token_signer'] = signer
+        s = self.datautils.create_session({'user_id': self.request.user.id})
+        old_token = signer.sign(s.user_id, s.id, issued=clock[0] - 6 * 24 * 3600)
+        s.token = old_token
+        self.session.flush()
+        self.request.json_body = {'token': old_token}
+        result = sessions_put_view(self.request)['d']
+        self.assertNotEqual(result['token'], old_token)
+        clock[0] += 2 * 24 * 3600
+        self.assertIsNone(signer.verify(old_token))
+        self.assertEqual(signer.verify(result['token'])[:2], (s.user_id, s.id))
+
+    def test_previous_signed_token(self):
+        """
+        Until it expires, the signed token a refresh replaced still finds its session, to refresh or log out with
+        """
+        signer = TokenSigner('secret')
+        self.request.registry['token_signer'] = signer
+        s = self.datautils.create_session({'user_id': self.request.user.id})
+        old_token = signer.sign(s.user_id, s.id, issued=signer.clock() - 60)
+        s.token = old_token
+        self.session.flush()
+        self.request.json_body = {'token': old_token}
+        self.assertNotEqual(sessions_put_view(self.request)['d']['token'], old_token)
+        self.assertEqual(sessions_put_view(self.request)['d']['id'], s.id)
+        self.assertEqual(sessions_delete_view(self.request)['d'], {})
+        self.assertEqual(self.session.query(Session).count(), 0)
+
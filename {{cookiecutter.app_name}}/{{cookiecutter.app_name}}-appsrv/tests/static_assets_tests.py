@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.request import Request
+
+from scripts.build_static import build
+from static_assets import IMMUTABLE, MANIFEST, StaticAssets, static_url
+
+SCRIPT = b'function hello() { return "hello"; }\n' * 50
+
+
+class StaticAssetsTests(TestCase):
+    """
+    Tests for fingerprinting the static files and serving them
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'build', 'js'))
+        with open(os.path.join(self.directory, 'build', 'js', 'app.js'), 'wb') as f:
+            f.write(SCRIPT)
+        with open(os.path.join(self.directory, 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        self.manifest = build(self.directory)
+        self.assets = StaticAssets(self.directory, self.manifest)
+        self.config = testing.setUp()
+        self.config.registry['static_assets'] = self.assets
+        self.config.add_route('static', '/static/*subpath')
+
+    def tearDown(self):
+        testing.tearDown()
+        shutil.rmtree(self.directory)
+
+    def get(self, name, **headers):
+        request = Request.blank('/static/' + name, headers=headers)
+        request.matchdict = {'subpath': tuple(name.split('/'))}
+        response = self.assets(request)
+        if response.status_int == 404:
+            return response
+        return request.get_response(response)
+
+    def test_build(self):
+        """
+        Each file gets a fingerprinted copy, and text ones a gzip copy, which a second build leaves alone
+        """
+        self.assertEqual(sorted(self.manifest), ['build/js/app.js', 'logo.png'])
+        built = self.manifest['build/js/app.js']
+        self.assertRegexpMatches(built, r'^build/js/app\.[0-9a-f]{16}\.js$')
+        with open(os.path.join(self.directory, built), 'rb') as f:
+            self.assertEqual(f.read(), SCRIPT)
+        with gzip.open(os.path.join(self.directory, built + '.gz')) as f:
+            self.assertEqual(f.read(), SCRIPT)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, self.manifest['logo.png'] + '.gz')))
+        with open(os.path.join(self.directory, MANIFEST)) as f:
+            self.assertEqual(json.load(f), self.manifest)
+
+        self.assertEqual(build(self.directory), self.manifest)
+
+    def test_static_url(self):
+        """
+        Templates link to the fingerprinted name, or the original if there isn't one
+        """
+        request = testing.DummyRequest()
+        self.assertEqual(static_url(request, 'build/js/app.js'), '/static/' + self.manifest['build/js/app.js'])
+        self.assertEqual(static_url(request, 'missing.js'), '/static/missing.js')
+
+    def test_cache_control(self):
+        """
+        A fingerprinted name is cached for good, and an original one is revalidated
+        """
+        response = self.get(self.manifest['build/js/app.js'])
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.headers['Cache-Control'], IMMUTABLE)
+        self.assertTrue(response.content_type.endswith('/javascript'))
+        self.assertEqual(response.body, SCRIPT)
+        original = self.get('build/js/app.js')
+        self.assertEqual(original.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(original.body, SCRIPT)
+
+    def test_encoding(self):
+        """
+        The gzip copy is sent to clients that accept it, and the response varies on Accept-Encoding
+        """
+        name = self.manifest['build/js/app.js']
+        response = self.get(name, **{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.vary, ('Accept-Encoding',))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(response.body)).read(), SCRIPT)
+        self.assertIsNone(self.get(name, **{'Accept-Encoding': 'identity'}).content_encoding)
+        self.assertIsNone(self.get(name).content_encoding)
+
+    def test_not_found(self):
+        """
+        Nothing outside the directory, or missing from it, is served
+        """
+        self.assertEqual(self.get('../etc/passwd').status_int, 404)
+        self.assertEqual(self.get('build/js/missing.js').status_int, 404)
+        self.assertEqual(self.get('build').status_int, 404)
+
+    def test_conditional(self):
+        """
+        A request with the file's ETag gets a 304, and a Range request the part it asked for
+        """
+        name = self.manifest['build/js/app.js']
+        etag = self.get(name).etag
+        self.assertEqual(self.get(name, **{'If-None-Match': '"%s"' % etag}).status_int, 304)
+        partial = self.get(name, Range='bytes=0-7')
+        self.assertEqual(partial.status_int, 206)
+        self.assertEqual(partial.body, SCRIPT[:8])
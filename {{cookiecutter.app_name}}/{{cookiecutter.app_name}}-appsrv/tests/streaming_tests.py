@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+
+from sqlalchemy import select
+
+from db import User
+from db.converters import array_of_dicts_from_array_of_models, array_of_dicts_from_rows
+from renderers import FastJSON
+from streaming import stream_json
+from tests import MyPyramidTestBase
+
+
+class StreamJsonTests(MyPyramidTestBase):
+    """
+    Tests for streaming query results as JSON
+    """
+    def setUp(self):
+        MyPyramidTestBase.setUp(self)
+        self.config.add_renderer('json', FastJSON())
+        self.users = [self.datautils.create_user() for _ in range(5)]
+        self.removals = ['password', 'salt']
+
+    def stream(self, query, **kw):
+        kw.setdefault('dbsession', self.session)
+        response = stream_json(self.request, query, **kw)
+        self.assertEqual(response.content_type, 'application/json')
+        return list(response.app_iter)
+
+    def rendered(self, rows):
+        return FastJSON()(None)({'d': rows}, {'request': self.request})
+
+    def test_models(self):
+        """
+        A model query streams exactly what rendering the whole list would
+        """
+        query = self.session.query(User).order_by(User.id)
+        body = b''.join(self.stream(query, remove_fields=self.removals))
+        self.assertEqual(body, self.rendered(array_of_dicts_from_array_of_models(self.users, self.removals)))
+
+    def test_chunks(self):
+        """
+        Rows are written a chunk at a time, with the separators in the right places
+        """
+        query = self.session.query(User).order_by(User.id)
+        chunks = self.stream(query, remove_fields=self.removals, chunk_size=2)
+        # The opening, three chunks of rows and the closing
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks))['d'], json.loads(self.rendered(
+            array_of_dicts_from_array_of_models(self.users, self.removals)))['d'])
+
+    def test_outside_session_kept(self):
+        """
+        Streaming with a session of our own only lets go of the instances it loaded
+        """
+        other = self.datautils.create_session({'user_id': self.users[0].id})
+        query = self.session.query(User).order_by(User.id)
+        self.stream(query, remove_fields=self.removals, chunk_size=2)
+        self.assertIn(other, self.session)
+        self.assertIn(self.users[0], self.session)
+
+    def test_columns(self):
+        """
+        Column queries and Core selects stream their rows as dictionaries
+        """
+        query = self.session.query(User.id, User.username).order_by(User.id)
+        self.assertEqual(b''.join(self.stream(query)),
+                         self.rendered([{'id': u.id, 'username': u.username} for u in self.users]))
+        users_table = User.__table__
+        query = select([users_table]).order_by(users_table.c.id)
+        expected = array_of_dicts_from_rows(self.session.execute(query), self.removals)
+        self.assertEqual(b''.join(self.stream(query, remove_fields=self.removals, chunk_size=3)),
+                         self.rendered(expected))
+
+    def test_empty(self):
+        """
+        No rows is still the envelope, with an empty list
+        """
+        query = self.session.query(User).filter(User.id < 0)
+        self.assertEqual(b''.join(self.stream(query)), b'{"d": []}')
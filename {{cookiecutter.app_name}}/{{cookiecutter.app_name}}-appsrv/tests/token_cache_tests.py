@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from security.token_cache import TokenCache
+
+
+class FakeClock(object):
+    """
+    A clock we can move by hand
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenCacheTests(TestCase):
+    """
+    Tests for the TokenCache
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_miss_then_hit(self):
+        """
+        An unknown token is a miss, and once stored it is a hit
+        """
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 1, {'id': 1})
+        self.assertEqual(self.cache.get('a'), {'id': 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_expiry(self):
+        """
+        Entries are gone once the ttl has passed
+        """
+        self.cache.put('a', 1, {'id': 1})
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """
+        When full, the least recently used token is the one that goes
+        """
+        self.cache.put('a', 1, {'id': 1})
+        self.cache.put('b', 2, {'id': 2})
+        self.cache.get('a')
+        self.cache.put('c', 3, {'id': 3})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), {'id': 1})
+        self.assertEqual(self.cache.get('c'), {'id': 3})
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate_token(self):
+        """
+        Invalidating a token only drops that token
+        """
+        self.cache.put('a', 1, {'id': 1})
+        self.cache.put('b', 1, {'id': 1})
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), {'id': 1})
+
+    def test_invalidate_user(self):
+        """
+        Invalidating a user drops every token they have and nobody else's
+        """
+        self.cache.put('a', 1, {'id': 1})
+        self.cache.put('b', 1, {'id': 1})
+        self.cache.invalidate_user(1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.cache.put('c', 2, {'id': 2})
+        self.cache.invalidate_user(1)
+        self.assertEqual(self.cache.get('c'), {'id': 2})
+
+    def test_disabled(self):
+        """
+        A size of zero stores nothing
+        """
+        cache = TokenCache(max_size=0)
+        cache.put('a', 1, {'id': 1})
+        self.assertIsNone(cache.get('a'))
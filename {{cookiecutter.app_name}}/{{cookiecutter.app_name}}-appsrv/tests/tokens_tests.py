@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from unittest import TestCase
+from uuid import uuid4
+
+from sqlalchemy.orm import sessionmaker
+
+from db import RevokedSession
+from security.tokens import REFRESH_OVERLAP, RevocationList, TokenSigner
+from tests import throwaway_engine
+
+
+class TokenSignerTests(TestCase):
+    """
+    Tests for the TokenSigner
+    """
+    def setUp(self):
+        self.now = 1500000000
+        self.signer = TokenSigner('secret', max_age=100, clock=lambda: self.now)
+
+    def test_round_trip(self):
+        """
+        A token we signed verifies back to what we put in
+        """
+        token = self.signer.sign(12, 34)
+        self.assertEqual(self.signer.verify(token), (12, 34, self.now))
+        self.assertEqual(self.signer.verify(unicode(token)), (12, 34, self.now))
+
+    def test_tampered(self):
+        """
+        Changing any part of the token, or signing with another key, fails
+        """
+        token = self.signer.sign(12, 34)
+        self.assertIsNone(self.signer.verify(token.replace('.12.', '.13.')))
+        self.assertIsNone(self.signer.verify(token[:-1]))
+        self.assertIsNone(TokenSigner('other').verify(token))
+        self.assertIsNone(self.signer.verify(u's1.12.34.1500000000.é'))
+
+    def test_expired(self):
+        """
+        Tokens older than max_age don't verify
+        """
+        token = self.signer.sign(12, 34)
+        self.now += 101
+        self.assertIsNone(self.signer.verify(token))
+
+    def test_uuid_token(self):
+        """
+        The old uuid tokens simply aren't signed tokens
+        """
+        self.assertIsNone(self.signer.verify(str(uuid4())))
+        self.assertIsNone(self.signer.verify(None))
+
+
+class RevocationListTests(TestCase):
+    """
+    Tests for the RevocationList, against its own throwaway database
+    """
+    def setUp(self):
+        self.engine = throwaway_engine()
+        RevokedSession.__table__.create(self.engine)
+        self.engine.execute(RevokedSession.__table__.insert(), [
+            {'session_id': 4, 'revoked': datetime.now() - timedelta(days=30)},
+            {'session_id': 7, 'revoked': datetime.now() - timedelta(days=1)},
+            {'session_id': 8, 'revoked': datetime.now() - timedelta(hours=1)}])
+        self.revocations = RevocationList(self.engine, max_age=7 * 24 * 3600)
+
+    def test_recorded_are_revoked(self):
+        """
+        Sessions recorded within a token's max_age are revoked, older records and anything else aren't
+        """
+        self.assertEqual(self.revocations.refresh(), 2)
+        for session_id in [7, 8]:
+            self.assertTrue(self.revocations.is_revoked(session_id))
+        for session_id in [4, 5, 9]:
+            self.assertFalse(self.revocations.is_revoked(session_id))
+
+    def test_recorded_after_refresh(self):
+        """
+        A session revoked elsewhere is revoked after the next refresh, even if it is the newest one
+        """
+        self.revocations.refresh()
+        self.engine.execute(RevokedSession.__table__.insert(), session_id=9, revoked=datetime.now())
+        self.assertFalse(self.revocations.is_revoked(9))
+        self.revocations.refresh()
+        self.assertTrue(self.revocations.is_revoked(9))
+
+    def test_late_commit(self):
+        """
+        A revocation that committed after a refresh, but is stamped from before it, is still picked up
+        """
+        self.revocations.refresh()
+        late = self.revocations.read_until - timedelta(seconds=REFRESH_OVERLAP / 2)
+        self.engine.execute(RevokedSession.__table__.insert(), session_id=10, revoked=late)
+        self.revocations.refresh()
+        self.assertTrue(self.revocations.is_revoked(10))
+
+    def test_incremental(self):
+        """
+        Later refreshes only read what was recorded around and since the previous one
+        """
+        self.revocations.refresh()
+        self.engine.execute(RevokedSession.__table__.update().values(session_id=11)
+                            .where(RevokedSession.__table__.c.session_id == 7))
+        self.revocations.refresh()
+        self.assertTrue(self.revocations.is_revoked(7))
+        self.assertFalse(self.revocations.is_revoked(11))
+
+    def test_expired(self):
+        """
+        Revocations older than a token can live are forgotten on refresh
+        """
+        self.revocations.refresh()
+        self.revocations.max_age = timedelta(hours=2)
+        self.revocations.refresh()
+        self.assertFalse(self.revocations.is_revoked(7))
+        self.assertTrue(self.revocations.is_revoked(8))
+
+    def test_record(self):
+        """
+        record() adds a row the next refresh picks up
+        """
+        dbsession = sessionmaker(bind=self.engine)()
+        RevocationList.record(dbsession, 12)
+        dbsession.commit()
+        self.revocations.refresh()
+        self.assertTrue(self.revocations.is_revoked(12))
+
+    def test_local_deny(self):
+        """
+        Revoking in this process takes effect immediately, and survives a refresh
+        """
+        self.revocations.deny(12)
+        self.assertTrue(self.revocations.is_revoked(12))
+        self.revocations.refresh()
+        self.assertTrue(self.revocations.is_revoked(12))
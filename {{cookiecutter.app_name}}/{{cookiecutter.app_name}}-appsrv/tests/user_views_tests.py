@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
-import hashlib
 from copy import deepcopy
+from datetime import datetime
 
 from email_validator import validate_email, EmailNotValidError
+from pyramid.httpexceptions import HTTPForbidden
+from sqlalchemy.dialects import postgresql
 
+from security import password_hasher
+from security.authorize import ROLES
 from tests import MyPyramidTestBase, bad_data_typevals_list
-from views.user_views import users_post_view, user_id_get_view, user_id_put_view
-from db import Session, User
+from views.user_views import signup_statement, users_get_view, users_post_view, user_id_get_view, user_id_put_view
+from db import Session, User, is_postgresql
 from db.converters import dict_from_row
 from utilities import error_dict
 
@@ -88,6 +92,14 @@ class UsersPostViewsTest(AccountViewsTestBase):
         expected['session'] = dict_from_row(session, remove_fields=removals)
         self.assertEqual(result, expected)
 
+    def test_query_budget(self):
+        """
+        Signup is a single statement on PostgreSQL, and stays small elsewhere
+        """
+        self.request.json_body = deepcopy(self.new_account)
+        with self.assertMaxQueries(1 if is_postgresql(self.session) else 6):
+            users_post_view(self.request)
+
     def test_password_is_hashed(self):
         """
         If we create a user, their password should be a hash
@@ -104,13 +116,28 @@ class UsersPostViewsTest(AccountViewsTestBase):
 
     def test_username_in_use(self):
         """
-        If we provide a username that is in use, get True
+        If we provide a username that is in use, the unique constraint turns us away and nothing is created
         """
-        self.request.json_body = {'username': 'testuser'}
+        self.request.json_body = {'username': 'TestUser', 'email': 'other@example.com', 'password': 'otherpass'}
         self.datautils.create_user({'username': 'testuser', 'password': 'testpass'})
         result = users_post_view(self.request)['d']
         self.assertIsInstance(result, dict)
-        self.assertEqual(result, error_dict('verification_error', 'username already in use: testuser'))
+        self.assertEqual(result, error_dict('verification_error', 'username already in use: TestUser'))
+        self.assertEqual(self.session.query(User).count(), 1)
+        self.assertEqual(self.session.query(Session).count(), 0)
+
+    def test_postgresql_statement(self):
+        """
+        On PostgreSQL signup is one statement: the user insert gives way on a taken username, and the session insert
+        selects from whatever it returned, so a taken username inserts nothing at all
+        """
+        sql = ' '.join(str(signup_statement({'username': 'newuser', 'email': 'e', 'password': 'p', 'salt': 's'},
+                                            'token').compile(dialect=postgresql.dialect())).split())
+        self.assertTrue(sql.startswith('WITH new_user AS (INSERT INTO users '))
+        self.assertIn('ON CONFLICT (username) DO NOTHING RETURNING users.id', sql)
+        self.assertIn('new_session AS (INSERT INTO sessions (user_id, token) SELECT new_user.id, ', sql)
+        self.assertIn('FROM new_user RETURNING sessions.id', sql)
+        self.assertTrue(sql.endswith('FROM new_user JOIN new_session ON new_session.user_id = new_user.id'))
 
     def test_username_not_in_use(self):
         """
@@ -123,6 +150,111 @@ class UsersPostViewsTest(AccountViewsTestBase):
         self.assertEqual(result, error_dict('api_errors', 'username, email, and password are all required string fields'))
 
 
+class UsersGetViewTest(AccountViewsTestBase):
+    """
+    Tests for listing users a page at a time
+    """
+    def setUp(self):
+        AccountViewsTestBase.setUp(self)
+        # Two pairs share a created time, so pages have to break ties by id
+        days = [1, 2, 2, 3, 4, 4, 5]
+        self.users = self.datautils.create_users(len(days), [
+            {'created': datetime(2018, 1, day), 'origin': 'web' if day % 2 else 'app'} for day in days])
+        self.request.user = self.users[0]
+        self.request.roles = ROLES['MS_admin']
+
+    def get_pages(self, **params):
+        pages = []
+        cursor = None
+        while True:
+            self.request.GET = dict(params)
+            if cursor is not None:
+                self.request.GET['cursor'] = cursor
+            result = users_get_view(self.request)['d']
+            pages.append([u['id'] for u in result['users']])
+            cursor = result['next']
+            if cursor is None:
+                return pages
+
+    def test_not_logged_in(self):
+        """
+        Listing users needs a login
+        """
+        self.request.user = None
+        self.request.roles = 0
+        self.assertIsInstance(users_get_view(self.request), HTTPForbidden)
+
+    def test_not_admin(self):
+        """
+        Listing users needs the admin role, which a plain user doesn't have
+        """
+        self.request.roles = ROLES['MS_user']
+        result = users_get_view(self.request)
+        self.assertIsInstance(result, HTTPForbidden)
+        self.assertEqual(result.status_code, 403)
+
+    def test_pages(self):
+        """
+        Following the cursors visits every user once, in created then id order, without the removals
+        """
+        self.assertEqual(self.get_pages(limit='3'), [[u.id for u in self.users[:3]], [u.id for u in self.users[3:6]],
+                                                     [self.users[6].id]])
+        self.request.GET = {}
+        result = users_get_view(self.request)['d']
+        self.assertEqual(result['users'][0], dict_from_row(self.users[0], remove_fields=removals))
+        self.assertIsNone(result['next'])
+
+    def test_exact_pages(self):
+        """
+        A last page that is exactly full has no next page after it
+        """
+        pages = self.get_pages(limit='7')
+        self.assertEqual(pages, [[u.id for u in self.users]])
+
+    def test_query_budget(self):
+        """
+        A page is a single query, however deep into the list it is
+        """
+        self.request.GET = {'limit': '2'}
+        cursor = users_get_view(self.request)['d']['next']
+        self.request.GET = {'limit': '2', 'cursor': cursor}
+        with self.assertMaxQueries(1):
+            users_get_view(self.request)
+
+    def test_filters(self):
+        """
+        Users can be filtered by origin and created range, and the filters hold across pages
+        """
+        web = [u.id for u in self.users if u.origin == 'web']
+        self.assertEqual(sum(self.get_pages(limit='1', origin='web'), []), web)
+        ids = sum(self.get_pages(limit='2', created_after='2018-01-02', created_before='2018-01-04T00:00:00'), [])
+        self.assertEqual(ids, [u.id for u in self.users[1:4]])
+
+    def test_limit(self):
+        """
+        The page size is capped by users.list.max_limit, and must be a positive whole number
+        """
+        self.request.registry.settings['users.list.max_limit'] = '2'
+        self.request.GET = {'limit': '1000'}
+        self.assertEqual(len(users_get_view(self.request)['d']['users']), 2)
+        for limit in ['0', '-1', 'ten']:
+            self.request.GET = {'limit': limit}
+            result = users_get_view(self.request)['d']
+            self.assertEqual(result, error_dict('api_errors', 'limit must be a whole number from 1 to 2'))
+            self.assertEqual(self.request.response.status_code, 400)
+
+    def test_bad_parameters(self):
+        """
+        Cursors we didn't make and dates we can't read are errors
+        """
+        for cursor in ['nonsense', 'bm9uc2Vuc2U=', u'\xfc', 'WzEsIDJd']:
+            self.request.GET = {'cursor': cursor}
+            self.assertEqual(users_get_view(self.request)['d'], error_dict('api_errors', 'invalid cursor'))
+        self.request.GET = {'created_after': 'yesterday'}
+        self.assertEqual(users_get_view(self.request)['d'],
+                         error_dict('api_errors', 'created_after must be an ISO 8601 date or time'))
+
+
 class UserIDGetViewTest(AccountViewsTestBase):
     """
     Tests for the user_id get view
@@ -158,6 +290,9 @@ class UserIDGetViewTest(AccountViewsTestBase):
             'username': user.username,
             'created': user.created,
             'email': user.email,
+            'origin': user.origin,
+            'lockmessage': user.lockmessage,
+            'roles': user.roles,
         }
         self.assertEqual(result, expected)
 
@@ -251,15 +386,12 @@ class UserIDPutViewTest(AccountViewsTestBase):
         When we match the appropriate guidelines, the password should be changed
         """
         newpass = 'Just Complex Enough'
-        m = hashlib.sha512()
-        m.update(newpass.encode('utf-8'))
-        m.update(self.request.user.salt)
-        hashed =  m.digest()
+        hasher = password_hasher(self.request)
         self.request.json_body = deepcopy(self.good_dict)
-        self.assertNotEqual(self.request.user.password, hashed)
+        self.assertFalse(hasher.verify(newpass, self.request.user.salt, self.request.user.password)[0])
         self.request.json_body['password'] = newpass
         result = user_id_put_view(self.request)['d']
         self.assertEqual(result, dict_from_row(self.request.user, remove_fields=removals))
-        self.assertEqual(self.request.user.password, hashed)
+        self.assertEqual(hasher.verify(newpass, self.request.user.salt, self.request.user.password), (True, False))
 
 
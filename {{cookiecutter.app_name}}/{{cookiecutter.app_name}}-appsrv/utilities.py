@@ -31,7 +31,8 @@ def error_dict(error_type='generic_errors', errors=''):
 
 def hash_password(password, salt):
     """
-    Hashes a password with the sale and returns the hash
+    Hashes a password with the salt and returns the hash.  This is the legacy single round SHA-512 scheme, only
+    used now to verify passwords stored before security.passwords.PasswordHasher, which replaces them on login.
     :param password: a password string
     :type password: basestring
     :param salt: a salt hash
@@ -58,3 +59,17 @@ def time_serializer(the_time, request):
         return str(the_time.isoformat())
     raise TypeError('Can not determine rendering for data given')
 
+
+def parse_iso_datetime(value):
+    """
+    Read a date, or a date and time, in the ISO 8601 forms isoformat() writes
+    :param value: A string like 2018-01-02, 2018-01-02T03:04:05 or 2018-01-02T03:04:05.678901
+    :return: A naive datetime, midnight for a date alone
+    :raises ValueError: If the string isn't one of those forms
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('not an ISO 8601 date or time: %r' % (value,))
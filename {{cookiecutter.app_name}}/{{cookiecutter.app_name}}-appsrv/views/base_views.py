@@ -1,27 +1,89 @@
 # -*- coding: utf-8 -*-
 import hashlib
-import ujson
+import os
 
 from sqlalchemy.orm import Session as dbSession
 
 from db.converters import array_of_dicts_from_array_of_models
 from pyramid.exceptions import HTTPNotFound
 from pyramid.httpexceptions import HTTPFound
+from pyramid.renderers import render
+from pyramid.response import Response
+from pyramid.scripting import prepare
+from pyramid.settings import asbool
+from networks import request_networks
+from static_assets import static_url
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+APP_SHELL_TEMPLATE = os.path.join(TEMPLATES, 'app_base.jinja2')
+
+
+def is_dev_request(request):
+    """
+    Whether a request is for the development version of the app, by its host or where it comes from, as set by
+    networks.dev_hosts and networks.dev
+    """
+    return request_networks(request).is_dev(request)
+
+
+def app_shell(request, is_dev):
+    """
+    The rendered app shell for one variant, from the registry's cache if there is one
+    :param request: The current request
+    :param is_dev: Whether it is the development variant
+    :return: A tuple of the HTML as bytes and its ETag
+    """
+    shells = request.registry.get('app_shells')
+    shell = shells.get(is_dev) if shells is not None else None
+    if shell is None:
+        values = {
+            'is_dev': is_dev,
+            'some_key': request.registry.settings['some_key'],
+            'static_url': lambda name: static_url(request, name),
+        }
+        body = render(APP_SHELL_TEMPLATE, values, request=request).encode('utf-8')
+        shell = body, hashlib.sha1(body).hexdigest()
+        if shells is not None:
+            shells[is_dev] = shell
+    return shell
 
 
 def app_base(request):
     """
     This should render the required HTML to start the Angular application.  It is the only entry point for
-    the pyramid UI via Angular
+    the pyramid UI via Angular.  The page only depends on the settings and whether the request is for the
+    development version, so each version is rendered once and then served from memory with its ETag, which
+    answers a matching If-None-Match with a 304.
     :param request: A pyramid request object, default for a view
-    :return: A dictionary of variables to be rendered into the template
-    """
-    dev_endpoints = ['localhost', '0.0.0.0', '127.0.', '192.168.', '10.19.', 'dev.squizzlezig.com']
-    is_dev = False
-    for point in dev_endpoints:
-        if request.host.split(':', 1)[0].startswith(point) or request.remote_addr.startswith(point):
-            is_dev = True
-    return { 'is_dev': is_dev, 'some_key': request.registry.settings['some_key']}
+    :return: The HTML response
+    """
+    body, etag = app_shell(request, is_dev_request(request))
+    response = Response(body=body, content_type='text/html', charset='UTF-8', conditional_response=True)
+    response.etag = etag
+    response.headers['Cache-Control'] = request.registry.settings.get('app_shell.cache_control', 'no-cache')
+    return response
+
+
+def warm_templates(config):
+    """
+    Compile every template, so the first requests don't wait for it, and render both versions of the app shell
+    into a cache in the registry, unless templates are being reloaded as they change.  With jinja2's bytecode
+    cache on, the compiled templates are also kept on disk for the next process to start with.
+    :param config: The app's configurator, once the app has been made
+    """
+    environment = config.get_jinja2_environment()
+    for name in sorted(os.listdir(TEMPLATES)):
+        if name.endswith('.jinja2'):
+            environment.get_template(os.path.join(TEMPLATES, name))
+    if asbool(config.registry.settings.get('pyramid.reload_templates', False)):
+        return
+    config.registry['app_shells'] = {}
+    env = prepare(registry=config.registry)
+    try:
+        for is_dev in (False, True):
+            app_shell(env['request'], is_dev)
+    finally:
+        env['closer']()
 
 
 def notfound_view(request):
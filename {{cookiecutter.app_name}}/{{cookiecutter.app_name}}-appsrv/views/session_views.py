@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
-import binascii
 from datetime import datetime, timedelta
 from uuid import uuid4
 
 from cornice import Service
 
-from pjDb import Session, User
-from pjLib.utilities import error_dict, hash_password
+from db import Session, User
+from security import invalidate_token, password_hasher, session_for_token, sign_session
+from security.passwords import PasswordHasherBusy
+from utilities import error_dict
 
 # Sphinx doc stuff
-from pjDb.converters import dict_from_row
+from db.converters import dict_from_row
 
 sessions_desc = """
 Work with sessions for user accounts
@@ -23,8 +24,7 @@ def sessions_post_view(request):
     """
     if request.user is not None and request.json_body.get('token') is not None:
         # Our request validated their token, so just get that token
-        return {'d': dict_from_row(request.dbsession.query(Session)\
-                                   .filter(Session.token == request.json_body['token']).one())}
+        return {'d': dict_from_row(session_for_token(request, request.json_body['token']))}
     username = request.json_body.get('username')
     if username is None or not isinstance(username, basestring):
         request.response.status = 400
@@ -38,9 +38,22 @@ def sessions_post_view(request):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid username provided')}
 
-    salted_pass = binascii.b2a_hex(hash_password(password, user.salt))
-
-    if binascii.b2a_hex(user.password) != salted_pass:
+    hasher = password_hasher(request)
+    try:
+        matches, needs_rehash = hasher.verify(password, user.salt, user.password)
+    except PasswordHasherBusy:
+        request.response.status = 503
+        request.response.headers['Retry-After'] = '1'
+        return {'d': error_dict('server_busy', 'too many logins at once, please try again')}
+    if matches and needs_rehash:
+        # Upgrade legacy or cheaper hashes now, while we have the password in hand.  If the hasher is busy the login
+        # still goes ahead, and the upgrade waits for a later one.
+        try:
+            user.password = hasher.hash(password, user.salt)
+        except PasswordHasherBusy:
+            pass
+
+    if not matches:
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid username provided')}
 
@@ -56,6 +69,8 @@ def sessions_post_view(request):
     request.dbsession.add(new_session)
     request.dbsession.flush()
     request.dbsession.refresh(new_session)
+    sign_session(request, new_session)
+    request.dbsession.flush()
 
     since = datetime.now() - timedelta(weeks=2)
     request.dbsession.query(Session)\
@@ -77,13 +92,14 @@ def sessions_delete_view(request):
     if token is None or not isinstance(token, basestring):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid token provided')}
-    s = request.dbsession.query(Session).filter(Session.token == token).one_or_none()
+    s = session_for_token(request, token)
     if s is None:
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid token provided')}
 
     request.dbsession.delete(s)
     request.dbsession.flush()
+    invalidate_token(request, token)
 
     return {'d': {}}
 
@@ -94,19 +110,21 @@ def sessions_put_view(request):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'not authenticated for this request')}
     token = request.json_body.get('token')
-    s = request.dbsession.query(Session).filter(Session.token == token,
-                                                Session.user_id == request.user.id).one_or_none()
-    if s is None:
+    s = session_for_token(request, token) if isinstance(token, basestring) else None
+    if s is None or s.user_id != request.user.id:
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid token provided')}
 
     expiration_value = timedelta(weeks=2)
     if (datetime.now() - s.lastactive) > expiration_value:
         request.dbsession.delete(s)
+        invalidate_token(request, token)
         request.response.status = 400
         return {'d': error_dict('api_errors', 'no valid token provided')}
 
     s.lastactive = datetime.now()
+    # A signed token is good for max_age from when it was issued, so a refresh hands out one issued now
+    sign_session(request, s)
     request.dbsession.flush()
 
     result = dict_from_row(s)
@@ -1,17 +1,27 @@
 # -*- coding: utf-8 -*-
+import base64
+import binascii
+import json
 import os
 import re
 from datetime import datetime
 from uuid import uuid4
 
 from cornice import Service
+from pyramid.settings import asbool
 from email_validator import validate_email, EmailNotValidError
+from sqlalchemy import Text, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 
-from db import Session, User
-from utilities import error_dict, hash_password
+from db import Session, User, is_postgresql, mark_changed, merge_row
+from security import invalidate_user, password_hasher, sign_session
+from security.authorize import authorized_roles
+from security.passwords import PasswordHasherBusy
+from utilities import error_dict, parse_iso_datetime
 
 # Sphinx doc stuff
-from db.converters import dict_from_row
+from db.converters import array_of_dicts_from_rows, dict_from_row
 
 users_desc = """
 Work with users or accounts
@@ -41,17 +51,135 @@ For any questions, don't hesitate to contact us at support@phonejanitor.com
 We Have a Clever Slogan!
 """
 
-def username_in_use(username, dbsession):
+def signup_statement(values, token):
     """
-    Returns true if a username exists
-    :param username: a string username
-    :param dbsession: a db session
-    :return: True if a username exists, otherwise False
+    The PostgreSQL statement create_user_and_session runs, which inserts the user unless the username is taken and
+    then their session from whatever the user insert returned, and selects both rows
+    :param values: A dictionary of the new user's column values
+    :param token: The token for the new session
+    :return: A select of the user's columns and the session's, prefixed with session_
     """
-    exists = dbsession.query(User).filter(User.username == username.lower()).one_or_none()
-    return exists is not None
+    users_table = User.__table__
+    sessions_table = Session.__table__
+    new_user = pg_insert(users_table).values(**values)\
+        .on_conflict_do_nothing(index_elements=[users_table.c.username])\
+        .returning(*users_table.c)\
+        .cte('new_user')
+    new_session = sessions_table.insert()\
+        .from_select(['user_id', 'token'], select([new_user.c.id, literal(token, Text)]))\
+        .returning(*sessions_table.c)\
+        .cte('new_session')
+    return select([new_user] + [c.label('session_' + c.name) for c in new_session.c])\
+        .select_from(new_user.join(new_session, new_session.c.user_id == new_user.c.id))
 
 
+def create_user_and_session(dbsession, values, token):
+    """
+    Create a user and their first session.  On PostgreSQL this is one statement, inserting both rows in a CTE, with
+    a username that is already taken leaving both inserts empty rather than raising.  Elsewhere the user is
+    inserted inside a SAVEPOINT, and the unique constraint failing is caught.  Either way it is the constraint that
+    decides, so two signups racing for the same name can't both succeed.
+    :param dbsession: A db session
+    :param values: A dictionary of the new user's column values
+    :param token: The token for the new session
+    :return: A tuple of the new (User, Session), or None if the username is in use
+    """
+    if is_postgresql(dbsession):
+        users_table = User.__table__
+        sessions_table = Session.__table__
+        row = dbsession.execute(signup_statement(values, token)).first()
+        if row is None:
+            return None
+        mark_changed(dbsession)
+        user = merge_row(dbsession, User, dict((c.name, row[c.name]) for c in users_table.c))
+        s = merge_row(dbsession, Session, dict((c.name, row['session_' + c.name]) for c in sessions_table.c))
+        return user, s
+
+    user = User(**values)
+    try:
+        with dbsession.begin_nested():
+            dbsession.add(user)
+    except IntegrityError:
+        return None
+    s = Session(user_id=user.id, token=token)
+    dbsession.add(s)
+    dbsession.flush()
+    dbsession.refresh(user)
+    dbsession.refresh(s)
+    return user, s
+
+
+def page_cursor(row):
+    """
+    The opaque token for the page of users after this one, which ended with row
+    :param row: The last row of the page, with its created and id
+    :return: A URL safe string
+    """
+    position = json.dumps([row['created'].isoformat(), row['id']])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def cursor_position(cursor):
+    """
+    Where a token from page_cursor says to carry on from
+    :param cursor: The token
+    :return: A tuple of (created, id) to list users after, or None if this isn't a token we made
+    """
+    try:
+        created, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return parse_iso_datetime(created), int(user_id)
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
+@users_svc.get()
+@authorized_roles(['MS_admin'])
+def users_get_view(request):
+    """
+    List users a page at a time, oldest first, for admins only.  Pages are found by seeking past the (created, id)
+    the last page ended on, which the ix_users_created_id index makes as cheap for the thousandth page as for the
+    first, where an OFFSET would read and throw away every row before it.  Pass the returned next token as cursor
+    for the next page; next is null on the last page.  The page size is limit, at most users.list.max_limit, and
+    users can be filtered by origin and by created_after (inclusive) and created_before (exclusive).
+    """
+    settings = request.registry.settings
+    max_limit = int(settings.get('users.list.max_limit', 200))
+    try:
+        limit = min(int(request.GET.get('limit', settings.get('users.list.default_limit', 50))), max_limit)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        request.response.status = 400
+        return {'d': error_dict('api_errors', 'limit must be a whole number from 1 to %d' % max_limit)}
+
+    users_table = User.__table__
+    query = select([c for c in users_table.c if c.name not in removals])
+    if request.GET.get('origin') is not None:
+        query = query.where(users_table.c.origin == request.GET['origin'])
+    for field, compare in (('created_after', users_table.c.created.__ge__),
+                           ('created_before', users_table.c.created.__lt__)):
+        if request.GET.get(field) is None:
+            continue
+        try:
+            query = query.where(compare(parse_iso_datetime(request.GET[field])))
+        except ValueError:
+            request.response.status = 400
+            return {'d': error_dict('api_errors', '%s must be an ISO 8601 date or time' % field)}
+    if request.GET.get('cursor') is not None:
+        position = cursor_position(request.GET['cursor'])
+        if position is None:
+            request.response.status = 400
+            return {'d': error_dict('api_errors', 'invalid cursor')}
+        query = query.where(tuple_(users_table.c.created, users_table.c.id) > tuple_(*position))
+
+    # One row more than the page says whether there is another page, without counting
+    rows = request.dbsession.execute(
+        query.order_by(users_table.c.created, users_table.c.id).limit(limit + 1)).fetchall()
+    return {'d': {
+        'users': array_of_dicts_from_rows(rows[:limit], remove_fields=removals),
+        'next': page_cursor(rows[limit - 1]) if len(rows) > limit else None,
+    }}
+
 
 @users_svc.post()
 def users_post_view(request):
@@ -59,9 +187,6 @@ def users_post_view(request):
     if not isinstance(username, basestring):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'username, email, and password are all required string fields')}
-    if username_in_use(request.json_body['username'], request.dbsession):
-        request.response.status = 400
-        return {'d': error_dict('verification_error', 'username already in use: %s' % request.json_body['username'])}
 
     requires = ['email', 'password']
     if not all(field in request.json_body for field in requires) \
@@ -69,24 +194,29 @@ def users_post_view(request):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'username, email, and password are all required string fields')}
 
-    user = User()
-    user.salt = os.urandom(256)
-    user.password = hash_password(request.json_body['password'], user.salt)
-    user.username = request.json_body['username'].lower()
-    user.email = request.json_body['email'].lower()
-    user.origin = request.json_body.get('origin', None)
-    user.authpin = '123456'
+    salt = os.urandom(256)
+    try:
+        password = password_hasher(request).hash(request.json_body['password'], salt)
+    except PasswordHasherBusy:
+        request.response.status = 503
+        request.response.headers['Retry-After'] = '1'
+        return {'d': error_dict('server_busy', 'too many requests at once, please try again')}
 
-    request.dbsession.add(user)
-    request.dbsession.flush()
-    request.dbsession.refresh(user)
+    created = create_user_and_session(request.dbsession, {
+        'username': username.lower(),
+        'email': request.json_body['email'].lower(),
+        'password': password,
+        'salt': salt,
+        'origin': request.json_body.get('origin', None),
+    }, str(uuid4()))
+    if created is None:
+        request.response.status = 400
+        return {'d': error_dict('verification_error', 'username already in use: %s' % username)}
+    user, s = created
 
-    s = Session()
-    s.owner = user.id
-    s.token = str(uuid4())
-    request.dbsession.add(s)
+    # Signing needs the session id, so a signed token costs an UPDATE on top
+    sign_session(request, s)
     request.dbsession.flush()
-    request.dbsession.refresh(s)
     result = dict_from_row(user, remove_fields=removals)
     result['session'] = dict_from_row(s, remove_fields=removals)
 
@@ -114,8 +244,16 @@ def users_put_view(request):
         return {'d': error_dict('api_errors', 'invalid state found')}
     uid = uuid4()
     newpass = uid.hex
-    user.salt = os.urandom(256)
-    user.password = hash_password(newpass, user.salt)
+    salt = os.urandom(256)
+    try:
+        password = password_hasher(request).hash(newpass, salt)
+    except PasswordHasherBusy:
+        request.response.status = 503
+        request.response.headers['Retry-After'] = '1'
+        return {'d': error_dict('server_busy', 'too many requests at once, please try again')}
+    user.salt = salt
+    user.password = password
+    invalidate_user(request, user.id)
 
     # This needs to be written to whatever queues/sends an email out.
     # send_email.apply_async((user.email, "{{cookiecutter.app_name}} password recovery", recovery_template %(username, newpass)))
@@ -156,7 +294,9 @@ def user_id_put_view(request):
         request.response.status = 400
         return {'d': error_dict('api_errors', 'email invalid: must be a string')}
     try:
-        v = validate_email(email) # validate and get info
+        # The deliverability check is a DNS lookup, which tests and offline development can turn off
+        check_deliverability = asbool(request.registry.settings.get('email.check_deliverability', True))
+        v = validate_email(email, check_deliverability=check_deliverability) # validate and get info
         email = v["email"] # replace with normalized form
     except EmailNotValidError as e:
         # email is not valid, exception message is human-readable
@@ -171,8 +311,16 @@ def user_id_put_view(request):
         if len(password) < 8:
             request.response.status = 400
             return {'d': error_dict('api_errors', 'password must be at least 8 characters')}
-        request.user.password = hash_password(password, request.user.salt)
+        try:
+            request.user.password = password_hasher(request).hash(password, request.user.salt)
+        except PasswordHasherBusy:
+            request.response.status = 503
+            request.response.headers['Retry-After'] = '1'
+            return {'d': error_dict('server_busy', 'too many requests at once, please try again')}
 
+    if password is not None or request.user.email != email:
+        # Anything cached for their tokens is now stale
+        invalidate_user(request, request.user.id)
     request.user.email = email
 
     request.dbsession.flush()